@@ -0,0 +1,365 @@
+"""Gradioクライアントの同時セッション負荷試験
+
+gradio/app.py を1プロセスで起動し、gradio_clientで複数のセッションから同時にログイン・チャットを行う。
+バックエンドのAPIは応答遅延を指定できるスタブ、CognitoはmotoでAWSへの接続なしに再現する。
+セッションごとの応答時間と全体の処理時間を計測し、ほかのセッションのトークンや会話IDを
+使ってしまっていないか（セッション間で状態が混ざっていないか）を検証する。
+スタブは本番と同じく、/chat/streamではSSEをチャンク転送で少しずつ返し、/chat（"stream": true）では
+SSEをまとめて返す。画面に最初のトークンが表示されるまでの時間も計測する。
+
+使い方:
+    pip install -r gradio/requirements.txt -r benchmarks/requirements.txt
+    python benchmarks/bench_gradio.py --sessions 30 --messages 3 --api-latency-ms 1000 --tokens 40
+    # 同時実行数を変えて比較する場合
+    python benchmarks/bench_gradio.py --concurrency 1
+    # /chat/streamもSSEをまとめて返す場合（ストリーミングしないバックエンド）と比較する場合
+    python benchmarks/bench_gradio.py --buffered-stream
+"""
+import argparse
+import base64
+import json
+import math
+import os
+import socket
+import statistics
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+ROOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+GRADIO_DIR = os.path.join(ROOT_DIR, 'gradio')
+
+REGION = 'us-east-1'
+PASSWORD = 'BenchPass123!'
+
+
+class StubApi:
+    """チャットAPIのスタブ（/chat・/chat/stream と /conversations のみ）
+
+    IDトークンのペイロードからユーザー名を取り出し、会話ごとに所有者とメッセージ数を記録する。
+    ほかのユーザーの会話IDで呼び出された場合は403を返し、混在として数える。
+    最初のトークンまでlatency_ms待ち、以降token_interval_msごとにトークンを生成する。
+    /chat/streamはトークンを生成した分から送り（buffered_stream=Trueの場合はまとめて送る）、
+    途中で切断されるとそのターンを取り消す。/chatの"stream": trueはSSEをまとめて返す。
+    """
+
+    def __init__(self, latency_ms, tokens, token_interval_ms, buffered_stream=False):
+        self.latency = latency_ms / 1000
+        self.tokens = tokens
+        self.token_interval = token_interval_ms / 1000
+        self.buffered_stream = buffered_stream
+        self.conversations = {}
+        self.requests = 0
+        self.max_in_flight = 0
+        self.cancelled = 0
+        self._in_flight = 0
+        self._lock = threading.Lock()
+
+    def serve(self):
+        """別スレッドでHTTPサーバーを起動し、ベースURLを返す"""
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                api.handle(self, 'GET')
+
+            def do_POST(self):
+                api.handle(self, 'POST')
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return f"http://127.0.0.1:{server.server_address[1]}"
+
+    def handle(self, request, method):
+        length = int(request.headers.get('Content-Length') or 0)
+        body = json.loads(request.rfile.read(length) or b'{}')
+        user = token_username(request.headers.get('Authorization', ''))
+
+        with self._lock:
+            self.requests += 1
+            self._in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self._in_flight)
+        try:
+            if method == 'POST' and request.path == '/chat/stream' and not self.buffered_stream:
+                self.stream_chat(request, user, body)
+                return
+            if method == 'POST' and (request.path == '/chat/stream' or (
+                    request.path == '/chat' and body.get('stream'))):
+                self.buffered_stream_chat(request, user, body)
+                return
+            if method == 'POST' and request.path == '/chat':
+                time.sleep(self.latency + self.tokens * self.token_interval)
+                status, payload = self.chat(user, body)
+            elif method == 'GET' and request.path == '/conversations':
+                status, payload = 200, {'conversations': self.list_conversations(user)}
+            else:
+                status, payload = 404, {'error': 'Not found'}
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+
+        data = json.dumps(payload, ensure_ascii=False).encode()
+        request.send_response(status)
+        request.send_header('Content-Type', 'application/json')
+        request.send_header('Content-Length', str(len(data)))
+        request.end_headers()
+        request.wfile.write(data)
+
+    def stream_chat(self, request, user, body):
+        """SSEイベントをチャンク転送で1つずつ送る"""
+        time.sleep(self.latency)
+        status, payload = self.chat(user, body)
+        if status != 200:
+            data = json.dumps(payload).encode()
+            request.send_response(status)
+            request.send_header('Content-Length', str(len(data)))
+            request.end_headers()
+            request.wfile.write(data)
+            return
+
+        request.send_response(200)
+        request.send_header('Content-Type', 'text/event-stream; charset=utf-8')
+        request.send_header('Transfer-Encoding', 'chunked')
+        request.end_headers()
+
+        def send(event, data):
+            chunk = sse_event(event, data)
+            request.wfile.write(f"{len(chunk):x}\r\n".encode() + chunk + b"\r\n")
+            request.wfile.flush()
+
+        try:
+            send('start', {'conversationId': payload['conversationId']})
+            # 応答本文を1トークン目に、残りは区切りの文字を送る（最終的な本文は非ストリーミングと同じ）
+            send('delta', {'text': payload['response']})
+            for _ in range(self.tokens - 1):
+                time.sleep(self.token_interval)
+                send('delta', {'text': ''})
+            send('done', {'conversationId': payload['conversationId']})
+            request.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            # クライアントが停止した: 本番と同じく生成を止めてターンを取り消す
+            with self._lock:
+                self.cancelled += 1
+                self.conversations[payload['conversationId']]['messageCount'] -= 2
+
+    def buffered_stream_chat(self, request, user, body):
+        """全トークンを生成してから、SSEイベント列を1つの本文として返す（Lambdaプロキシ統合と同じ）"""
+        time.sleep(self.latency + self.tokens * self.token_interval)
+        status, payload = self.chat(user, body)
+        if status != 200:
+            data = json.dumps(payload).encode()
+        else:
+            data = b''.join([
+                sse_event('start', {'conversationId': payload['conversationId']}),
+                sse_event('delta', {'text': payload['response']}),
+                *(sse_event('delta', {'text': ''}) for _ in range(self.tokens - 1)),
+                sse_event('done', {'conversationId': payload['conversationId']}),
+            ])
+        request.send_response(status)
+        request.send_header(
+            'Content-Type', 'text/event-stream; charset=utf-8' if status == 200 else 'application/json'
+        )
+        request.send_header('Content-Length', str(len(data)))
+        request.end_headers()
+        request.wfile.write(data)
+
+    def chat(self, user, body):
+        with self._lock:
+            conversation_id = body.get('conversationId') or str(uuid.uuid4())
+            conv = self.conversations.setdefault(
+                conversation_id, {'owner': user, 'title': body['message'][:20], 'messageCount': 0}
+            )
+            if conv['owner'] != user:
+                return 403, {'error': 'Access denied'}
+            conv['messageCount'] += 2
+            turn = conv['messageCount'] // 2
+            conv['lastMessagePreview'] = f"{user}:{turn}"
+        return 200, {
+            'conversationId': conversation_id,
+            'response': conv['lastMessagePreview']
+        }
+
+    def list_conversations(self, user):
+        with self._lock:
+            return [
+                {'conversationId': conversation_id, 'title': conv['title'],
+                 'messageCount': conv['messageCount'],
+                 'lastMessagePreview': conv.get('lastMessagePreview')}
+                for conversation_id, conv in self.conversations.items()
+                if conv['owner'] == user
+            ]
+
+
+def sse_event(event, data):
+    """SSE形式のイベントのバイト列"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode()
+
+
+def token_username(authorization):
+    """IDトークン（JWT）のペイロードからユーザー名を取り出す（署名は検証しない）"""
+    token = authorization.removeprefix('Bearer ')
+    try:
+        payload = token.split('.')[1]
+        claims = json.loads(base64.urlsafe_b64decode(payload + '=' * (-len(payload) % 4)))
+    except (IndexError, ValueError):
+        return None
+    return claims.get('cognito:username') or claims.get('username')
+
+
+def create_users(count):
+    """motoのCognitoにユーザープールとユーザーを作成し、クライアントIDとユーザー名を返す"""
+    import boto3
+
+    client = boto3.client('cognito-idp', region_name=REGION)
+    pool_id = client.create_user_pool(PoolName='bench-pool')['UserPool']['Id']
+    client_id = client.create_user_pool_client(
+        UserPoolId=pool_id,
+        ClientName='bench-client',
+        ExplicitAuthFlows=['USER_PASSWORD_AUTH']
+    )['UserPoolClient']['ClientId']
+
+    usernames = [f"bench-user-{i}" for i in range(count)]
+    for username in usernames:
+        client.admin_create_user(UserPoolId=pool_id, Username=username, TemporaryPassword=PASSWORD)
+        client.admin_set_user_password(
+            UserPoolId=pool_id, Username=username, Password=PASSWORD, Permanent=True
+        )
+    return client_id, usernames
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def message_text(message):
+    """Chatbotのメッセージから本文を取り出す（文字列・コンテンツブロックのどちらにも対応）"""
+    content = message['content']
+    if isinstance(content, list):
+        return ''.join(
+            block.get('text', '') if isinstance(block, dict) else str(block) for block in content
+        )
+    return str(content)
+
+
+def run_session(url, username, messages):
+    """1セッション分のログインとチャットを行い、チャットごとの最初のトークン・応答完了までの時間と混在の有無を返す"""
+    from gradio_client import Client
+
+    client = Client(url, verbose=False)
+    status = client.predict(username, PASSWORD, api_name='/login')[0]
+    if '✅' not in status:
+        raise RuntimeError(f"{username}: {status}")
+
+    first_tokens = []
+    latencies = []
+    mixups = 0
+    for turn in range(1, messages + 1):
+        started = time.perf_counter()
+        job = client.submit(f"{username} のメッセージ {turn}", [], api_name='/respond')
+        first_token = None
+        # 途中経過の出力を受け取り、応答本文が表示され始めた時点を記録する
+        for _, history in job:
+            if first_token is None and message_text(history[-1]):
+                first_token = (time.perf_counter() - started) * 1000
+        _, history = job.result()
+        latencies.append((time.perf_counter() - started) * 1000)
+        first_tokens.append(first_token or latencies[-1])
+        # 自分のトークンで、同じ会話を続けられていれば「ユーザー名:ターン数」が返る
+        if message_text(history[-1]) != f"{username}:{turn}":
+            mixups += 1
+    return first_tokens, latencies, mixups
+
+
+def percentile(values, pct):
+    """最近傍順位法のパーセンタイル（pct%以上の値がこれ以下になる最小の値）"""
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(pct / 100 * len(ordered)) - 1)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sessions', type=int, default=30, help='同時に操作するセッション数')
+    parser.add_argument('--messages', type=int, default=3, help='セッションごとのチャット回数')
+    parser.add_argument('--api-latency-ms', type=float, default=1000,
+                        help='スタブAPIの/chatが最初のトークンを返すまでの遅延')
+    parser.add_argument('--tokens', type=int, default=20, help='スタブAPIが返すトークン数')
+    parser.add_argument('--token-interval-ms', type=float, default=50)
+    parser.add_argument('--concurrency', type=int, default=None,
+                        help='Gradioの同時実行数（既定はapp.pyの設定）')
+    parser.add_argument('--buffered-stream', action='store_true',
+                        help='スタブの/chat/streamもSSEをまとめて返す（ストリーミングしないバックエンドの再現）')
+    args = parser.parse_args()
+
+    from moto import mock_aws
+
+    with mock_aws():
+        api = StubApi(
+            args.api_latency_ms, args.tokens, args.token_interval_ms, args.buffered_stream
+        )
+        client_id, usernames = create_users(args.sessions)
+
+        os.environ.update({
+            'API_URL': api.serve(),
+            'USER_POOL_CLIENT_ID': client_id,
+            'REGION': REGION,
+        })
+        if args.concurrency:
+            os.environ['GRADIO_CONCURRENCY_LIMIT'] = str(args.concurrency)
+        sys.path.insert(0, GRADIO_DIR)
+        import app
+
+        port = free_port()
+        app.demo.launch(
+            server_name='127.0.0.1',
+            server_port=port,
+            prevent_thread_lock=True,
+            quiet=True,
+            max_threads=max(40, app.CONCURRENCY_LIMIT)
+        )
+        url = f"http://127.0.0.1:{port}/"
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.sessions) as executor:
+            results = list(executor.map(
+                lambda username: run_session(url, username, args.messages), usernames
+            ))
+        elapsed = time.perf_counter() - started
+        app.demo.close()
+
+    first_tokens = [latency for session, _, _ in results for latency in session]
+    latencies = [latency for _, session, _ in results for latency in session]
+    mixups = sum(mixup for _, _, mixup in results)
+    api_seconds = (args.api_latency_ms + args.tokens * args.token_interval_ms) / 1000
+    serial = args.sessions * args.messages * api_seconds
+    print(
+        f"{args.sessions}セッション x {args.messages}回  同時実行数 {app.CONCURRENCY_LIMIT}  "
+        f"API遅延 {args.api_latency_ms:.0f} ms  "
+        f"{'SSEをまとめて返す' if args.buffered_stream else 'ストリーミング'}"
+    )
+    for label, values in (('最初のトークン', first_tokens), ('応答完了', latencies)):
+        print(
+            f"{label:<8}  p50 {statistics.median(values):8.1f}  p95 {percentile(values, 95):8.1f}  "
+            f"p99 {percentile(values, 99):8.1f} ms"
+        )
+    print(
+        f"全体 {elapsed:.1f}秒（1件ずつ処理した場合 {serial:.1f}秒）  "
+        f"API同時リクエスト最大 {api.max_in_flight}  セッション間の混在 {mixups}件"
+    )
+    if mixups:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
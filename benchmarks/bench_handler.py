@@ -0,0 +1,659 @@
+"""Lambdaハンドラーのローカルベンチマーク
+
+API Gatewayのプロキシイベントを組み立てて lambda_handler を直接呼び出し、
+全ルートのレイテンシ・DynamoDB呼び出し回数・消費キャパシティ・ピークメモリを計測する。
+あわせて会話ごとのメッセージの保存サイズと全件読み込みの読み込み単位を、平文で保存した場合と比較する。
+DynamoDBはmoto（既定）またはDynamoDB Local、Bedrockは遅延と生成速度を指定できる偽クライアントを使う。
+
+使い方:
+    pip install -r benchmarks/requirements.txt
+    python benchmarks/bench_handler.py --sizes 1,50,500,5000 --iterations 10
+    # Bedrockのリージョンごとに遅延を変える場合（レイテンシの小さいリージョンへ振り分けられる）
+    python benchmarks/bench_handler.py --region-latency us-east-1=800,us-west-2=200
+    # DynamoDB Localを使う場合
+    python benchmarks/bench_handler.py --dynamodb-endpoint http://localhost:8000
+    # メッセージ本文を圧縮して保存する場合
+    python benchmarks/bench_handler.py --compression zlib
+    # 会話ヘッダーを使い、会話を開く際のDynamoDB呼び出しを1回にする場合
+    python benchmarks/bench_handler.py --conversation-headers
+    # 以前の結果と比較する場合
+    python benchmarks/bench_handler.py --compare benchmarks/results/<commit>.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import math
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import threading
+import tracemalloc
+import uuid
+from collections import deque
+
+
+ROOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+LAMBDA_DIR = os.path.join(ROOT_DIR, 'lambda')
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+CONVERSATIONS_TABLE_NAME = 'bench-conversations'
+MESSAGES_TABLE_NAME = 'bench-messages'
+JOBS_TABLE_NAME = 'bench-jobs'
+USER_ID = 'bench-user'
+
+# シードするメッセージ本文の素材（日本語の説明文とコードが混在する応答を想定）
+SAMPLE_SENTENCES = [
+    'DynamoDBのパーティションキーには会話IDを使い、ソートキーにはタイムスタンプを使います。',
+    'Lambda関数のタイムアウトは30秒に設定されているため、長い処理は非同期に分けてください。',
+    'まずは要件を整理し、次に小さな単位で実装とテストを繰り返すのがおすすめです。',
+    'エラーが発生した場合は、CloudWatch Logsでスタックトレースを確認してください。',
+    'def lambda_handler(event, context):\n    body = json.loads(event["body"])\n    return response(200, body)\n',
+    'for item in response["Items"]:\n    print(item["conversationId"], item["timestamp"])\n',
+    'この方法であれば、既存のデータを移行せずに新しい形式へ段階的に切り替えられます。',
+    'const res = await fetch(`${API_URL}/conversations`, { headers: { Authorization: token } });\n',
+    '注意点として、トランザクションは最大100件のアイテムまでしか含められません。',
+    '以上の手順で設定は完了です。ほかに気になる点があれば教えてください。',
+]
+
+
+class FakeBedrockClient:
+    """遅延と生成速度を指定できるBedrock Runtimeの偽クライアント
+
+    throttle_rateの確率、または直近1秒の呼び出しがmax_rpsを超えた場合に
+    ThrottlingExceptionを送出し、スロットリング時の挙動を再現する。
+    slow_rateの確率で遅延をslow_latency_msにし、テールレイテンシを再現する。
+    """
+
+    def __init__(self, latency_ms, tokens_per_second, output_tokens, throttle_rate=0.0, max_rps=None,
+                 slow_rate=0.0, slow_latency_ms=0):
+        self.latency = latency_ms / 1000
+        self.slow_rate = slow_rate
+        self.slow_latency = slow_latency_ms / 1000
+        self.token_interval = 1 / tokens_per_second
+        self.output_tokens = output_tokens
+        self.throttle_rate = throttle_rate
+        self.max_rps = max_rps
+        self.throttled = 0
+        self._calls = deque()
+        self._lock = threading.Lock()
+        self._rng = random.Random(0)
+
+    def _maybe_throttle(self, operation):
+        from botocore.exceptions import ClientError
+
+        now = time.monotonic()
+        with self._lock:
+            while self._calls and self._calls[0] <= now - 1:
+                self._calls.popleft()
+            over_capacity = self.max_rps is not None and len(self._calls) >= self.max_rps
+            if not over_capacity:
+                self._calls.append(now)
+            throttle = over_capacity or self._rng.random() < self.throttle_rate
+            if throttle:
+                self.throttled += 1
+        if throttle:
+            raise ClientError(
+                {'Error': {'Code': 'ThrottlingException', 'Message': 'Too many requests'}},
+                operation
+            )
+
+    def _first_token_latency(self):
+        with self._lock:
+            slow = self._rng.random() < self.slow_rate
+        return self.slow_latency if slow else self.latency
+
+    def _usage(self, messages):
+        input_tokens = sum(len(c.get('text', '')) // 4 for m in messages for c in m['content'])
+        return {
+            'inputTokens': input_tokens,
+            'outputTokens': self.output_tokens,
+            'totalTokens': input_tokens + self.output_tokens,
+        }
+
+    def converse(self, **kwargs):
+        self._maybe_throttle('Converse')
+        time.sleep(self._first_token_latency() + self.output_tokens * self.token_interval)
+        return {
+            'output': {'message': {
+                'role': 'assistant',
+                'content': [{'text': 'ベンチマーク応答 ' * self.output_tokens}]
+            }},
+            'usage': self._usage(kwargs['messages']),
+            'metrics': {'latencyMs': int(self.latency * 1000)},
+            'stopReason': 'end_turn',
+        }
+
+    def converse_stream(self, **kwargs):
+        self._maybe_throttle('ConverseStream')
+        latency = self._first_token_latency()
+
+        def events():
+            time.sleep(latency)
+            yield {'messageStart': {'role': 'assistant'}}
+            for _ in range(self.output_tokens):
+                time.sleep(self.token_interval)
+                yield {'contentBlockDelta': {'delta': {'text': 'ベンチマーク応答 '}, 'contentBlockIndex': 0}}
+            yield {'messageStop': {'stopReason': 'end_turn'}}
+            yield {'metadata': {
+                'usage': self._usage(kwargs['messages']),
+                'metrics': {'latencyMs': int(self.latency * 1000)},
+            }}
+        return {'stream': events()}
+
+
+class DynamoDBCallCounter:
+    """botocoreのイベントフックでDynamoDBの呼び出し回数と消費キャパシティを集計"""
+
+    def __init__(self, client):
+        self.calls = 0
+        self.capacity = 0.0
+        client.meta.events.register('provide-client-params.dynamodb.*', self._request_capacity)
+        client.meta.events.register('after-call.dynamodb.*', self._record)
+
+    def _request_capacity(self, params, model, **kwargs):
+        if 'ReturnConsumedCapacity' in model.input_shape.members:
+            params.setdefault('ReturnConsumedCapacity', 'TOTAL')
+
+    def _record(self, parsed, **kwargs):
+        self.calls += 1
+        consumed = parsed.get('ConsumedCapacity')
+        if isinstance(consumed, dict):
+            consumed = [consumed]
+        for entry in consumed or []:
+            self.capacity += float(entry.get('CapacityUnits', 0))
+
+    def reset(self):
+        self.calls = 0
+        self.capacity = 0.0
+
+
+def create_tables(client):
+    """CDKのDatabaseStackと同じ構成のテーブルを作成"""
+    client.create_table(
+        TableName=CONVERSATIONS_TABLE_NAME,
+        BillingMode='PAY_PER_REQUEST',
+        AttributeDefinitions=[
+            {'AttributeName': 'userId', 'AttributeType': 'S'},
+            {'AttributeName': 'conversationId', 'AttributeType': 'S'},
+            {'AttributeName': 'updatedAt', 'AttributeType': 'N'},
+        ],
+        KeySchema=[
+            {'AttributeName': 'userId', 'KeyType': 'HASH'},
+            {'AttributeName': 'conversationId', 'KeyType': 'RANGE'},
+        ],
+        GlobalSecondaryIndexes=[{
+            'IndexName': 'userId-updatedAt-index',
+            'KeySchema': [
+                {'AttributeName': 'userId', 'KeyType': 'HASH'},
+                {'AttributeName': 'updatedAt', 'KeyType': 'RANGE'},
+            ],
+            'Projection': {'ProjectionType': 'ALL'},
+        }],
+    )
+    client.create_table(
+        TableName=MESSAGES_TABLE_NAME,
+        BillingMode='PAY_PER_REQUEST',
+        AttributeDefinitions=[
+            {'AttributeName': 'conversationId', 'AttributeType': 'S'},
+            {'AttributeName': 'timestamp', 'AttributeType': 'N'},
+        ],
+        KeySchema=[
+            {'AttributeName': 'conversationId', 'KeyType': 'HASH'},
+            {'AttributeName': 'timestamp', 'KeyType': 'RANGE'},
+        ],
+    )
+    client.create_table(
+        TableName=JOBS_TABLE_NAME,
+        BillingMode='PAY_PER_REQUEST',
+        AttributeDefinitions=[{'AttributeName': 'jobId', 'AttributeType': 'S'}],
+        KeySchema=[{'AttributeName': 'jobId', 'KeyType': 'HASH'}],
+    )
+
+
+def parse_region_latency(spec):
+    """'us-east-1=800,us-west-2=200' をリージョンごとの遅延（ミリ秒）のdictに変換"""
+    if not spec:
+        return None
+    latencies = {}
+    for entry in spec.split(','):
+        region, latency_ms = entry.split('=')
+        latencies[region.strip()] = float(latency_ms)
+    return latencies
+
+
+def sample_content(rng, content_chars):
+    """指定文字数のメッセージ本文を生成"""
+    parts = []
+    length = 0
+    while length < content_chars:
+        sentence = rng.choice(SAMPLE_SENTENCES)
+        parts.append(sentence)
+        length += len(sentence)
+    return ''.join(parts)[:content_chars]
+
+
+def seed_conversation(dynamodb_service, size, content_chars):
+    """指定件数のメッセージを持つ会話を作成（本文は設定中のコーデックで保存）"""
+    conversation_id = str(uuid.uuid4())
+    now = int(time.time())
+    start = now - size
+
+    conversation_item = {
+        'userId': USER_ID,
+        'conversationId': conversation_id,
+        'title': f'benchmark {size}',
+        'createdAt': start,
+        'updatedAt': now,
+        'messageCount': size,
+    }
+    dynamodb_service.conversations_table.put_item(Item=conversation_item)
+    rng = random.Random(size)
+    with dynamodb_service.messages_table.batch_writer() as batch:
+        if dynamodb_service.conversation_headers:
+            batch.put_item(Item=dynamodb_service.build_conversation_header(conversation_item))
+        for i in range(size):
+            batch.put_item(Item=dynamodb_service.codec.encode({
+                'conversationId': conversation_id,
+                'timestamp': start + i,
+                'messageId': str(uuid.uuid4()),
+                'role': 'user' if i % 2 == 0 else 'assistant',
+                'content': sample_content(rng, content_chars),
+            }))
+    return conversation_id
+
+
+def attribute_size(value):
+    """DynamoDBの属性値のサイズ（バイト）の概算"""
+    if isinstance(value, str):
+        return len(value.encode('utf-8'))
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if hasattr(value, 'value'):  # boto3のBinary型
+        return len(value.value)
+    if isinstance(value, bool) or value is None:
+        return 1
+    if isinstance(value, dict):
+        return 3 + sum(len(k.encode('utf-8')) + attribute_size(v) + 1 for k, v in value.items())
+    if isinstance(value, (list, tuple, set)):
+        return 3 + sum(attribute_size(v) + 1 for v in value)
+    # 数値は有効桁2桁ごとに1バイト+1バイト
+    return (len(str(value).lstrip('-').replace('.', '').strip('0')) + 1) // 2 + 1
+
+
+def item_size(item):
+    """DynamoDBのアイテムサイズ（属性名と値の合計）"""
+    return sum(len(name.encode('utf-8')) + attribute_size(value) for name, value in item.items())
+
+
+def read_units(size_bytes):
+    """結果整合性のQueryで全件読み込む場合の読み込み単位（4KBごとに0.5）"""
+    return math.ceil(size_bytes / 4096) * 0.5
+
+
+def storage_report(dynamodb_service, conversation_id, size):
+    """会話のメッセージの保存サイズと読み込み単位を、平文で保存した場合と比較"""
+    stored = 0
+    plain = 0
+    kwargs = {
+        'KeyConditionExpression': 'conversationId = :cid',
+        'ExpressionAttributeValues': {':cid': conversation_id},
+    }
+    while True:
+        response = dynamodb_service.messages_table.query(**kwargs)
+        for item in response['Items']:
+            if item.get('itemType') == 'header':
+                continue
+            stored += item_size(item)
+            plain += item_size(dynamodb_service.codec.decode(item))
+        if 'LastEvaluatedKey' not in response:
+            break
+        kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    return {
+        'messages': size,
+        'compression': dynamodb_service.codec.compression,
+        'storedBytes': stored,
+        'plainBytes': plain,
+        'historyReadUnits': read_units(stored),
+        'plainHistoryReadUnits': read_units(plain),
+        'savedPercent': round((1 - stored / plain) * 100, 1) if plain else 0.0,
+    }
+
+
+def make_event(method, path, body=None, params=None):
+    """API Gatewayプロキシ統合のイベントを組み立て"""
+    return {
+        'httpMethod': method,
+        'path': path,
+        'headers': {'Content-Type': 'application/json'},
+        'queryStringParameters': params,
+        'body': json.dumps(body) if body is not None else None,
+        'requestContext': {'authorizer': {'claims': {'sub': USER_ID}}},
+    }
+
+
+class FakeContext:
+    """Lambdaのcontext（残り時間のみ）"""
+
+    def __init__(self, timeout_seconds=30):
+        self.deadline = time.monotonic() + timeout_seconds
+
+    def get_remaining_time_in_millis(self):
+        return int((self.deadline - time.monotonic()) * 1000)
+
+
+def percentile(values, pct):
+    """最近傍順位法によるパーセンタイル（pct%以上の値がこれ以下になる最小の値）"""
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(pct / 100 * len(ordered)) - 1)]
+
+
+def run_scenario(handler, counter, name, size, make_request, iterations, cold_cache):
+    """1シナリオを繰り返し実行して集計
+
+    1回目はtracemallocでピークメモリを計測するウォームアップとし、
+    複数回実行する場合はレイテンシの集計から除外する。
+    """
+    latencies = []
+    statuses = {}
+    calls = 0
+    capacity = 0.0
+    peak = 0
+    phases = {}
+
+    for i in range(iterations):
+        if cold_cache:
+            handler.history_cache.invalidate_all()
+        event = make_request(i)
+        traced = i == 0
+        if traced:
+            tracemalloc.start()
+        counter.reset()
+
+        started = time.perf_counter()
+        # ハンドラーのログ出力は計測結果から除外し、EMFのレコードのみ集計に使う
+        logs = io.StringIO()
+        with contextlib.redirect_stdout(logs):
+            result = handler.lambda_handler(event, FakeContext())
+        elapsed = (time.perf_counter() - started) * 1000
+
+        for line in logs.getvalue().splitlines():
+            record = handler.metrics.parse_emf_line(line)
+            if record is None:
+                continue
+            for metric in record['_aws']['CloudWatchMetrics'][0]['Metrics']:
+                if metric['Unit'] == 'Milliseconds':
+                    phases[metric['Name']] = phases.get(metric['Name'], 0) + record[metric['Name']]
+
+        if traced:
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        if not traced or iterations == 1:
+            latencies.append(elapsed)
+        calls += counter.calls
+        capacity += counter.capacity
+        statuses[result['statusCode']] = statuses.get(result['statusCode'], 0) + 1
+
+    return {
+        'route': name,
+        'messages': size,
+        'iterations': iterations,
+        'statusCodes': statuses,
+        'p50Ms': round(percentile(latencies, 50), 2),
+        'p95Ms': round(percentile(latencies, 95), 2),
+        'p99Ms': round(percentile(latencies, 99), 2),
+        'meanMs': round(statistics.mean(latencies), 2),
+        'dynamodbCallsPerRequest': round(calls / iterations, 2),
+        'consumedCapacityPerRequest': round(capacity / iterations, 2),
+        'peakMemoryKiB': round(peak / 1024, 1),
+        # EMFから集計した区間ごとの平均所要時間（Server-Timingと同じ内訳）
+        'phasesMeanMs': {name: round(total / iterations, 2) for name, total in phases.items()},
+    }
+
+
+def git_commit():
+    """計測対象のコミットID"""
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=ROOT_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def compare(results, baseline_path):
+    """以前の結果とのp50/p95の差分を表示"""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    previous = {(r['route'], r['messages']): r for r in baseline['results']}
+
+    print(f"\n比較対象: {baseline_path} ({baseline.get('commit')})")
+    for r in results:
+        before = previous.get((r['route'], r['messages']))
+        if before is None:
+            continue
+        print(
+            f"{r['route']:<28} {r['messages']:>5}件  "
+            f"p50 {before['p50Ms']:>8.1f} -> {r['p50Ms']:>8.1f} ms  "
+            f"p95 {before['p95Ms']:>8.1f} -> {r['p95Ms']:>8.1f} ms  "
+            f"DynamoDB {before['dynamodbCallsPerRequest']:>5} -> {r['dynamodbCallsPerRequest']:>5}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='1,50,500,5000', help='会話のメッセージ数（カンマ区切り）')
+    parser.add_argument('--iterations', type=int, default=10)
+    parser.add_argument('--delete-iterations', type=int, default=3, help='DELETEの試行回数（会話を都度作成）')
+    parser.add_argument('--content-chars', type=int, default=400, help='シードするメッセージの文字数')
+    parser.add_argument('--bedrock-latency-ms', type=float, default=200)
+    parser.add_argument('--tokens-per-second', type=float, default=1000)
+    parser.add_argument('--output-tokens', type=int, default=200)
+    parser.add_argument('--throttle-rate', type=float, default=0.0,
+                        help='Bedrockの呼び出しをスロットリングする確率')
+    parser.add_argument('--bedrock-max-rps', type=float,
+                        help='これを超える1秒あたりの呼び出しをスロットリングする')
+    parser.add_argument('--slow-rate', type=float, default=0.0,
+                        help='Bedrockの応答が遅くなる確率（テールレイテンシの再現）')
+    parser.add_argument('--slow-latency-ms', type=float, default=5000)
+    parser.add_argument('--hedge', action='store_true', help='Bedrockへのヘッジリクエストを有効にする')
+    parser.add_argument('--region-latency',
+                        help='Bedrockのリージョンごとの遅延（例: us-east-1=800,us-west-2=200）')
+    parser.add_argument('--batch-items', type=int, default=8, help='POST /chat/batch の1リクエストあたりの件数')
+    parser.add_argument('--compression', default='off', choices=('off', 'zlib', 'zstd'),
+                        help='メッセージ本文の圧縮方式（MESSAGE_COMPRESSION）')
+    parser.add_argument('--conversation-headers', action='store_true',
+                        help='会話ヘッダーを使い、会話を開く際に1回のQueryで読む（CONVERSATION_HEADERS=on）')
+    parser.add_argument('--cold-cache', action='store_true', help='リクエストごとに履歴キャッシュを破棄する')
+    parser.add_argument('--dynamodb-endpoint', help='DynamoDB LocalのURL（省略時はmoto）')
+    parser.add_argument('--output', help='結果JSONの保存先（既定: benchmarks/results/<commit>.json）')
+    parser.add_argument('--compare', help='比較する以前の結果JSON')
+    args = parser.parse_args()
+
+    os.environ.update({
+        'AWS_DEFAULT_REGION': 'us-east-1',
+        'AWS_ACCESS_KEY_ID': os.environ.get('AWS_ACCESS_KEY_ID', 'bench'),
+        'AWS_SECRET_ACCESS_KEY': os.environ.get('AWS_SECRET_ACCESS_KEY', 'bench'),
+        'CONVERSATIONS_TABLE_NAME': CONVERSATIONS_TABLE_NAME,
+        'MESSAGES_TABLE_NAME': MESSAGES_TABLE_NAME,
+        'JOBS_TABLE_NAME': JOBS_TABLE_NAME,
+        'PREWARM_CONNECTIONS': 'false',
+        # ページングカーソルの署名鍵（デプロイ環境ではCURSOR_SECRET_ARNのシークレットから読む）
+        'CURSOR_SECRET': 'bench-cursor-secret',
+        'MESSAGE_COMPRESSION': args.compression,
+        # アイテム上限に近い本文の退避先（S3の代わりにローカルのディレクトリ）
+        'OBJECT_STORE_DIR': tempfile.mkdtemp(prefix='bench-objects-'),
+    })
+    if args.hedge:
+        os.environ['BEDROCK_HEDGE'] = 'on'
+    if args.conversation_headers:
+        os.environ['CONVERSATION_HEADERS'] = 'on'
+    region_latencies = parse_region_latency(args.region_latency)
+    if region_latencies:
+        os.environ['BEDROCK_REGIONS'] = ','.join(region_latencies)
+
+    mock = None
+    if args.dynamodb_endpoint:
+        os.environ['AWS_ENDPOINT_URL_DYNAMODB'] = args.dynamodb_endpoint
+    else:
+        try:
+            from moto import mock_aws
+        except ImportError:
+            sys.exit('motoが必要です: pip install -r benchmarks/requirements.txt')
+        mock = mock_aws()
+        mock.start()
+
+    sys.path.insert(0, LAMBDA_DIR)
+    import handler
+
+    dynamodb_service = handler.dynamodb_service
+    create_tables(dynamodb_service.client)
+    bedrock_clients = {
+        region: FakeBedrockClient(
+            latency_ms, args.tokens_per_second, args.output_tokens,
+            throttle_rate=args.throttle_rate, max_rps=args.bedrock_max_rps,
+            slow_rate=args.slow_rate, slow_latency_ms=args.slow_latency_ms
+        )
+        for region, latency_ms in (region_latencies or {'default': args.bedrock_latency_ms}).items()
+    }
+    if region_latencies:
+        handler.bedrock_service.region_clients = bedrock_clients
+    else:
+        handler.bedrock_service.client = bedrock_clients['default']
+    throttled = lambda: sum(client.throttled for client in bedrock_clients.values())
+    counter = DynamoDBCallCounter(dynamodb_service.client)
+
+    sizes = [int(size) for size in args.sizes.split(',')]
+    results = []
+    storage = []
+    for size in sizes:
+        conversation_id = seed_conversation(dynamodb_service, size, args.content_chars)
+        print(f"seeded conversation with {size} messages", file=sys.stderr)
+        storage.append(storage_report(dynamodb_service, conversation_id, size))
+
+        scenarios = [
+            ('POST /chat', lambda i: make_event(
+                'POST', '/chat', {'message': f'質問 {i}', 'conversationId': conversation_id}
+            )),
+            ('POST /chat (stream)', lambda i: make_event(
+                'POST', '/chat', {'message': f'質問 {i}', 'conversationId': conversation_id, 'stream': True}
+            )),
+            # ジョブの受付までを計測する（ジョブはプロセス内のキューに積まれる）
+            ('POST /chat (async)', lambda i: make_event(
+                'POST', '/chat', {'message': f'質問 {i}', 'conversationId': conversation_id, 'async': True}
+            )),
+            ('POST /chat/batch', lambda i: make_event(
+                'POST', '/chat/batch', {'items': [
+                    {'message': f'質問 {i}-{j}', 'conversationId': conversation_id if j == 0 else None}
+                    for j in range(args.batch_items)
+                ]}
+            )),
+            ('GET /conversations', lambda i: make_event('GET', '/conversations')),
+            ('GET /conversations (preview)', lambda i: make_event(
+                'GET', '/conversations', params={'include': 'preview'}
+            )),
+            ('GET /conversations/{id}', lambda i: make_event(
+                'GET', f'/conversations/{conversation_id}'
+            )),
+        ]
+        for name, make_request in scenarios:
+            results.append(run_scenario(
+                handler, counter, name, size, make_request, args.iterations, args.cold_cache
+            ))
+
+        # DELETEは試行ごとに削除対象の会話を作成する
+        targets = [
+            seed_conversation(dynamodb_service, size, args.content_chars)
+            for _ in range(args.delete_iterations)
+        ]
+        results.append(run_scenario(
+            handler, counter, 'DELETE /conversations/{id}', size,
+            lambda i: make_event('DELETE', f'/conversations/{targets[i]}'),
+            args.delete_iterations, args.cold_cache
+        ))
+
+    if mock is not None:
+        mock.stop()
+
+    report = {
+        'commit': git_commit(),
+        'createdAt': int(time.time()),
+        'backend': args.dynamodb_endpoint or 'moto',
+        'config': {
+            'iterations': args.iterations,
+            'contentChars': args.content_chars,
+            'bedrockLatencyMs': args.bedrock_latency_ms,
+            'regionLatency': region_latencies,
+            'slowRate': args.slow_rate,
+            'slowLatencyMs': args.slow_latency_ms,
+            'hedge': args.hedge,
+            'tokensPerSecond': args.tokens_per_second,
+            'outputTokens': args.output_tokens,
+            'batchItems': args.batch_items,
+            'throttleRate': args.throttle_rate,
+            'bedrockMaxRps': args.bedrock_max_rps,
+            'coldCache': args.cold_cache,
+            'compression': args.compression,
+            'conversationHeaders': args.conversation_headers,
+        },
+        'results': results,
+        'storage': storage,
+        'bedrock': {
+            'throttled': throttled(),
+            'finalRateLimit': round(handler.bedrock_service.limiter.rate, 2),
+            'regions': handler.bedrock_service.router.snapshot(),
+            'hedge': handler.bedrock_service.hedge.snapshot(),
+        },
+    }
+
+    output = args.output or os.path.join(RESULTS_DIR, f"{report['commit']}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+
+    for r in results:
+        print(
+            f"{r['route']:<28} {r['messages']:>5}件  "
+            f"p50 {r['p50Ms']:>8.1f}  p95 {r['p95Ms']:>8.1f}  p99 {r['p99Ms']:>8.1f} ms  "
+            f"DynamoDB {r['dynamodbCallsPerRequest']:>5}回 / {r['consumedCapacityPerRequest']:>7} CU  "
+            f"peak {r['peakMemoryKiB']:>9} KiB"
+        )
+    for r in storage:
+        print(
+            f"storage ({r['compression']}) {r['messages']:>5}件  "
+            f"{r['plainBytes']:>10} -> {r['storedBytes']:>10} bytes ({r['savedPercent']}%削減)  "
+            f"全件読み込み {r['plainHistoryReadUnits']:>7} -> {r['historyReadUnits']:>7} RCU"
+        )
+    if throttled():
+        print(
+            f"Bedrockのスロットリング {throttled()}回  "
+            f"呼び出し上限 {report['bedrock']['finalRateLimit']} req/s"
+        )
+    if args.hedge:
+        hedge = report['bedrock']['hedge']
+        print(
+            f"ヘッジ {hedge['hedges']}回 / {hedge['requests']}リクエスト  "
+            f"ヘッジ側の勝ち {hedge['wins']}回"
+        )
+    if region_latencies:
+        for region, stats in report['bedrock']['regions'].items():
+            latency = stats['latencyMs']
+            print(
+                f"region {region:<12} {stats['calls']:>5}回  "
+                f"EWMA {latency if latency is None else round(latency, 1)} ms  "
+                f"エラー率 {stats['errorRate']:.2f}"
+            )
+    print(f"\n結果を保存しました: {output}")
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
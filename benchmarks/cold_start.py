@@ -0,0 +1,103 @@
+"""Lambdaハンドラーのインポート時間・初期化時間の計測
+
+別プロセスで handler をインポートし、コールドスタート相当の時間を計測する。
+AWSへの通信は行わない（接続の事前確立は無効化して計測する）。
+
+使い方:
+    python benchmarks/cold_start.py --runs 10 --output cold_start.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+
+LAMBDA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lambda')
+
+# 子プロセスで実行する計測コード
+MEASURE_SCRIPT = """
+import json, time
+started = time.perf_counter()
+import handler
+imported = time.perf_counter()
+handler.bedrock_service.client
+first_client = time.perf_counter()
+print(json.dumps({
+    'importMs': (imported - started) * 1000,
+    'bedrockClientMs': (first_client - imported) * 1000,
+}))
+"""
+
+
+def is_own_module(name):
+    """計測対象のLambdaのコード（handlerとservices配下）のモジュールか"""
+    return name == 'handler' or name == 'services' or name.startswith('services.')
+
+
+def measure_once():
+    """1回分のコールドスタートを計測"""
+    env = {
+        **os.environ,
+        'AWS_DEFAULT_REGION': os.environ.get('AWS_DEFAULT_REGION', 'us-east-1'),
+        'CONVERSATIONS_TABLE_NAME': 'bench-conversations',
+        'MESSAGES_TABLE_NAME': 'bench-messages',
+        'PREWARM_CONNECTIONS': 'false',
+        # Secrets Managerから読まずに済むよう、署名鍵は直接渡す
+        'CURSOR_SECRET': 'bench-cursor-secret',
+    }
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', MEASURE_SCRIPT],
+        cwd=LAMBDA_DIR, env=env, capture_output=True, text=True, check=True
+    )
+    timings = json.loads(result.stdout.strip().splitlines()[-1])
+
+    # -X importtime の出力から、handlerとservices配下のモジュールが直接インポートした
+    # パッケージ（boto3など。その内部でインポートされるサブモジュールは除く）の時間を集計する
+    entries = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        _, cumulative, field = line[len('import time:'):].split('|')
+        # 階層はストリップ前のフィールドのインデント（区切りの後の空白1つ + 階層ごとに2つ）で判定する
+        depth = (len(field) - len(field.lstrip(' ')) - 1) // 2
+        if cumulative.strip().isdigit():
+            entries.append((depth, field.strip(), int(cumulative.strip()) / 1000))
+
+    # 出力は子が親より先に並ぶため、逆順（親が先）にたどって親のモジュールを追う
+    modules = []
+    parents = []
+    for depth, name, cumulative in reversed(entries):
+        del parents[depth:]
+        if parents and all(is_own_module(parent) for parent in parents):
+            if not is_own_module(name) and '.' not in name:
+                modules.append((name, cumulative))
+        parents.append(name)
+    timings['slowestImports'] = sorted(modules, key=lambda m: m[1], reverse=True)[:5]
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--output', help='結果を保存するJSONファイル')
+    args = parser.parse_args()
+
+    runs = [measure_once() for _ in range(args.runs)]
+    summary = {
+        'runs': args.runs,
+        'importMsMedian': statistics.median(r['importMs'] for r in runs),
+        'importMsMax': max(r['importMs'] for r in runs),
+        'bedrockClientMsMedian': statistics.median(r['bedrockClientMs'] for r in runs),
+        'slowestImports': runs[-1]['slowestImports'],
+    }
+
+    print(json.dumps(summary, indent=2, ensure_ascii=False))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(summary, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == '__main__':
+    main()
@@ -11,8 +11,10 @@ app = cdk.App()
 env = cdk.Environment(region="us-east-1")
 
 # 1. DynamoDBスタック
+# GSIの射影（-c conversationsIndexProjection=INCLUDE で会話一覧に必要な属性のみ）
 database_stack = DatabaseStack(
     app, "BedrockChatDatabaseStack",
+    conversations_index_projection=app.node.try_get_context("conversationsIndexProjection") or "ALL",
     env=env
 )
 
@@ -27,6 +29,8 @@ lambda_stack = LambdaStack(
     app, "BedrockChatLambdaStack",
     conversations_table=database_stack.conversations_table,
     messages_table=database_stack.messages_table,
+    jobs_table=database_stack.jobs_table,
+    content_bucket=database_stack.content_bucket,
     env=env
 )
 
@@ -36,6 +40,7 @@ lambda_stack.add_dependency(database_stack)
 api_stack = ApiStack(
     app, "BedrockChatApiStack",
     lambda_function=lambda_stack.chat_function,
+    stream_function=lambda_stack.stream_function,
     user_pool=auth_stack.user_pool,
     env=env
 )
@@ -1,5 +1,6 @@
 from aws_cdk import (
     Stack,
+    Duration,
     aws_apigateway as apigateway,
     aws_lambda as lambda_,
     aws_cognito as cognito,
@@ -13,6 +14,7 @@ class ApiStack(Stack):
         scope: Construct, 
         construct_id: str,
         lambda_function: lambda_.Function,
+        stream_function: lambda_.Function,
         user_pool: cognito.UserPool,
         **kwargs
     ) -> None:
@@ -37,7 +39,9 @@ class ApiStack(Stack):
                     'Authorization',
                     'X-Amz-Date',
                     'X-Api-Key',
-                    'X-Amz-Security-Token'
+                    'X-Amz-Security-Token',
+                    'If-None-Match',
+                    'Prefer'
                 ]
             ),
             deploy_options=apigateway.StageOptions(
@@ -49,7 +53,16 @@ class ApiStack(Stack):
                     "/chat/POST": apigateway.MethodDeploymentOptions(
                         throttling_rate_limit=2,
                         throttling_burst_limit=5,
-                    )
+                    ),
+                    # 1リクエストで最大BATCH_CHAT_MAX_ITEMS件を生成するため低めに抑える
+                    "/chat/batch/POST": apigateway.MethodDeploymentOptions(
+                        throttling_rate_limit=1,
+                        throttling_burst_limit=2,
+                    ),
+                    "/chat/stream/POST": apigateway.MethodDeploymentOptions(
+                        throttling_rate_limit=2,
+                        throttling_burst_limit=5,
+                    ),
                 }
             ),
         )
@@ -69,6 +82,31 @@ class ApiStack(Stack):
             authorization_type=apigateway.AuthorizationType.COGNITO,
         )
 
+        # POST /chat/batch
+        chat_batch_resource = chat_resource.add_resource("batch")
+        chat_batch_resource.add_method(
+            "POST",
+            lambda_integration,
+            authorizer=authorizer,
+            authorization_type=apigateway.AuthorizationType.COGNITO,
+        )
+
+        # POST /chat/stream（Lambdaのレスポンスストリーミングで応答を届いた分から返す）
+        stream_integration = apigateway.LambdaIntegration(
+            stream_function,
+            proxy=True,
+            response_transfer_mode=apigateway.ResponseTransferMode.STREAM,
+            # ストリーミングでは29秒を超えるタイムアウトを設定できる
+            timeout=Duration.seconds(60),
+        )
+        chat_stream_resource = chat_resource.add_resource("stream")
+        chat_stream_resource.add_method(
+            "POST",
+            stream_integration,
+            authorizer=authorizer,
+            authorization_type=apigateway.AuthorizationType.COGNITO,
+        )
+
         # GET /conversations
         conversations_resource = api.root.add_resource("conversations")
         conversations_resource.add_method(
@@ -95,6 +133,16 @@ class ApiStack(Stack):
             authorization_type=apigateway.AuthorizationType.COGNITO,
         )
 
+        # GET /jobs/{jobId}（非同期生成ジョブの結果取得）
+        jobs_resource = api.root.add_resource("jobs")
+        job_detail = jobs_resource.add_resource("{jobId}")
+        job_detail.add_method(
+            "GET",
+            lambda_integration,
+            authorizer=authorizer,
+            authorization_type=apigateway.AuthorizationType.COGNITO,
+        )
+
         # 出力
         from aws_cdk import CfnOutput
         CfnOutput(
@@ -2,12 +2,23 @@ from aws_cdk import (
     Stack,
     RemovalPolicy,
     aws_dynamodb as dynamodb,
+    aws_s3 as s3,
 )
 from constructs import Construct
 
 
+# 会話一覧で使う属性（キー属性以外）。INCLUDE射影の場合はこれだけをGSIに射影する
+CONVERSATION_LIST_NON_KEY_ATTRIBUTES = ["title", "createdAt", "messageCount", "lastMessagePreview"]
+
+
 class DatabaseStack(Stack):
-    def __init__(self, scope: Construct, construct_id: str, **kwargs) -> None:
+    def __init__(
+        self,
+        scope: Construct,
+        construct_id: str,
+        conversations_index_projection: str = "ALL",
+        **kwargs
+    ) -> None:
         super().__init__(scope, construct_id, **kwargs)
 
         # Conversationsテーブル
@@ -26,6 +37,16 @@ class DatabaseStack(Stack):
         )
         
         # GSI: userId-updatedAt-index
+        # INCLUDEにすると要約などの大きな属性を射影せず、インデックスの容量と読み込み単位を抑えられる
+        # （既存のGSIの射影は変更できないため、切り替え時はインデックスの再作成が必要）
+        if conversations_index_projection == "INCLUDE":
+            projection = dict(
+                projection_type=dynamodb.ProjectionType.INCLUDE,
+                non_key_attributes=CONVERSATION_LIST_NON_KEY_ATTRIBUTES,
+            )
+        else:
+            projection = dict(projection_type=dynamodb.ProjectionType.ALL)
+
         self.conversations_table.add_global_secondary_index(
             index_name="userId-updatedAt-index",
             partition_key=dynamodb.Attribute(
@@ -36,6 +57,7 @@ class DatabaseStack(Stack):
                 name="updatedAt",
                 type=dynamodb.AttributeType.NUMBER
             ),
+            **projection,
         )
 
         # Messagesテーブル
@@ -53,6 +75,28 @@ class DatabaseStack(Stack):
             removal_policy=RemovalPolicy.DESTROY,  # 開発用
         )
 
+        # Jobsテーブル（非同期生成ジョブの状態。expiresAtを過ぎたジョブはTTLで削除）
+        self.jobs_table = dynamodb.Table(
+            self, "JobsTable",
+            partition_key=dynamodb.Attribute(
+                name="jobId",
+                type=dynamodb.AttributeType.STRING
+            ),
+            billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST,
+            time_to_live_attribute="expiresAt",
+            removal_policy=RemovalPolicy.DESTROY,  # 開発用
+        )
+
+        # DynamoDBのアイテム上限（400KB）に近いメッセージ本文の退避先
+        self.content_bucket = s3.Bucket(
+            self, "MessageContentBucket",
+            block_public_access=s3.BlockPublicAccess.BLOCK_ALL,
+            encryption=s3.BucketEncryption.S3_MANAGED,
+            enforce_ssl=True,
+            removal_policy=RemovalPolicy.DESTROY,  # 開発用
+            auto_delete_objects=True,
+        )
+
         # 出力
         from aws_cdk import CfnOutput
         CfnOutput(
@@ -66,3 +110,9 @@ class DatabaseStack(Stack):
             value=self.messages_table.table_name,
             description="Messages table name"
         )
+
+        CfnOutput(
+            self, "JobsTableName",
+            value=self.jobs_table.table_name,
+            description="Jobs table name"
+        )
@@ -4,6 +4,10 @@ from aws_cdk import (
     aws_lambda as lambda_,
     aws_iam as iam,
     aws_dynamodb as dynamodb,
+    aws_secretsmanager as secretsmanager,
+    aws_s3 as s3,
+    aws_sqs as sqs,
+    aws_lambda_event_sources as lambda_event_sources,
 )
 from constructs import Construct
 
@@ -15,6 +19,8 @@ class LambdaStack(Stack):
         construct_id: str,
         conversations_table: dynamodb.Table,
         messages_table: dynamodb.Table,
+        jobs_table: dynamodb.Table,
+        content_bucket: s3.Bucket,
         **kwargs
     ) -> None:
         super().__init__(scope, construct_id, **kwargs)
@@ -30,15 +36,109 @@ class LambdaStack(Stack):
             ]
         )
 
+        # ワーカー用実行ロール（チャット関数のロールから呼び出し権限を参照するため分ける）
+        worker_role = iam.Role(
+            self, "BedrockChatWorkerRole",
+            assumed_by=iam.ServicePrincipal("lambda.amazonaws.com"),
+            managed_policies=[
+                iam.ManagedPolicy.from_aws_managed_policy_name(
+                    "service-role/AWSLambdaBasicExecutionRole"
+                )
+            ]
+        )
+
         # Bedrock呼び出し権限
-        lambda_role.add_to_policy(
-            iam.PolicyStatement(
-                effect=iam.Effect.ALLOW,
-                actions=[
-                    "bedrock:InvokeModel",
-                    "bedrock:InvokeModelWithResponseStream"
-                ],
-                resources=["*"]
+        for role in (lambda_role, worker_role):
+            role.add_to_policy(
+                iam.PolicyStatement(
+                    effect=iam.Effect.ALLOW,
+                    actions=[
+                        "bedrock:InvokeModel",
+                        "bedrock:InvokeModelWithResponseStream"
+                    ],
+                    resources=["*"]
+                )
+            )
+
+        # 共通の環境変数
+        common_environment = {
+            "BEDROCK_MODEL_ID": "us.anthropic.claude-haiku-4-5-20251001-v1:0",
+            "CONVERSATIONS_TABLE_NAME": conversations_table.table_name,
+            "MESSAGES_TABLE_NAME": messages_table.table_name,
+            "JOBS_TABLE_NAME": jobs_table.table_name,
+            # プロンプトに含める直近メッセージ数（それより古いものは要約で補う）
+            "RECENT_MESSAGE_LIMIT": "20",
+            # Bedrockへ送る会話履歴の入力トークン上限
+            "CONTEXT_TOKEN_BUDGET": "16000",
+            # 要約の更新を依頼する未要約メッセージ数（直近分を除く）
+            "SUMMARY_THRESHOLD": "20",
+            # Bedrock呼び出しのアドミッション制御（初期・最大の1秒あたりの呼び出し数と同時呼び出し数）
+            # スロットリングを受けると呼び出し数を下げ、待ちきれない場合は429を返す
+            "BEDROCK_RATE_LIMIT": "5",
+            "BEDROCK_MAX_RATE": "20",
+            "BEDROCK_MAX_CONCURRENCY": "8",
+            # Bedrockを呼び出すリージョン（レイテンシ・エラー率のよいリージョンを選び、障害時は切り替える）
+            # us.のクロスリージョン推論プロファイルを呼び出せるリージョンを指定する
+            "BEDROCK_REGIONS": "us-east-1,us-east-2,us-west-2",
+            # ヘッジリクエスト（on: 直近p95を過ぎても応答がなければ別リージョンへ2本目を出す）
+            # 追加の呼び出しはBEDROCK_HEDGE_BUDGET（呼び出し数に対する割合）までに抑える
+            "BEDROCK_HEDGE": "off",
+            "BEDROCK_HEDGE_BUDGET": "0.1",
+            # Bedrockのプロンプトキャッシュ（auto: 対応モデルで有効 / off: 無効）
+            "BEDROCK_PROMPT_CACHE": "auto",
+            # 会話ヘッダー（所有者・タイトル）をMessagesテーブルにも書き、会話を開く際に1回のQueryで読む
+            # 有効にする前の会話は scripts/migrate_conversation_headers.py でヘッダーを書き込む
+            "CONVERSATION_HEADERS": "on",
+            # メッセージ本文の圧縮（off / zlib / zstd）。読み込み時の復号は常に行う
+            "MESSAGE_COMPRESSION": "off",
+            # アイテム上限に近い本文の退避先
+            "OBJECT_STORE_BUCKET": content_bucket.bucket_name,
+        }
+
+        # バックグラウンド処理用Lambda関数（会話要約など）
+        self.worker_function = lambda_.Function(
+            self, "BedrockChatWorkerFunction",
+            runtime=lambda_.Runtime.PYTHON_3_12,
+            handler="worker.lambda_handler",
+            code=lambda_.Code.from_asset("../lambda", exclude=["tests"]),
+            role=worker_role,
+            timeout=Duration.minutes(5),
+            memory_size=512,
+            environment={
+                **common_environment,
+                # botocoreの読み取りタイムアウトをLambdaのタイムアウトに合わせる
+                "LAMBDA_TIMEOUT_SECONDS": "300",
+                # 非同期ジョブの出力トークン数の上限
+                "JOB_MAX_TOKENS": "8192",
+                # 実行中のまま止まったジョブを再実行できるとみなすまでの秒数
+                "JOB_STALE_SECONDS": "360",
+            },
+        )
+
+        # 非同期生成ジョブのキュー（処理に失敗し続けたメッセージはDLQへ）
+        job_dead_letter_queue = sqs.Queue(
+            self, "ChatJobDeadLetterQueue",
+            retention_period=Duration.days(14),
+        )
+        self.job_queue = sqs.Queue(
+            self, "ChatJobQueue",
+            # ワーカーのタイムアウトより長くし、処理中のメッセージが再配信されないようにする
+            visibility_timeout=Duration.minutes(30),
+            dead_letter_queue=sqs.DeadLetterQueue(
+                max_receive_count=3,
+                queue=job_dead_letter_queue,
+            ),
+        )
+        self.worker_function.add_event_source(
+            lambda_event_sources.SqsEventSource(self.job_queue, batch_size=1)
+        )
+
+        # ページングカーソルの署名鍵
+        cursor_secret = secretsmanager.Secret(
+            self, "CursorSigningSecret",
+            generate_secret_string=secretsmanager.SecretStringGenerator(
+                exclude_punctuation=True,
+                password_length=32
             )
         )
 
@@ -47,20 +147,81 @@ class LambdaStack(Stack):
             self, "BedrockChatFunction",
             runtime=lambda_.Runtime.PYTHON_3_12,
             handler="handler.lambda_handler",
-            code=lambda_.Code.from_asset("../lambda"),
+            code=lambda_.Code.from_asset("../lambda", exclude=["tests"]),
             role=lambda_role,
             timeout=Duration.seconds(30),
             memory_size=512,
             environment={
-                "BEDROCK_MODEL_ID": "us.anthropic.claude-haiku-4-5-20251001-v1:0",
-                "CONVERSATIONS_TABLE_NAME": conversations_table.table_name,
-                "MESSAGES_TABLE_NAME": messages_table.table_name,
+                **common_environment,
+                # botocoreの読み取りタイムアウトをLambdaのタイムアウトに合わせる
+                "LAMBDA_TIMEOUT_SECONDS": "30",
+                "WORKER_FUNCTION_NAME": self.worker_function.function_name,
+                # 会話履歴キャッシュに使うメモリの割合（memory_sizeに対する比率）
+                "HISTORY_CACHE_MEMORY_RATIO": "0.1",
+                # 非同期生成ジョブのキュー
+                "JOB_QUEUE_URL": self.job_queue.queue_url,
+                # POST /chat/batch の最大件数とBedrockの同時呼び出し数
+                "BATCH_CHAT_MAX_ITEMS": "20",
+                "BATCH_CHAT_CONCURRENCY": "8",
+                # このメッセージ数を超える会話の削除はワーカーLambdaで行う
+                "ASYNC_DELETE_THRESHOLD": "2000",
+                # 全コンテナで同じ鍵を使い、どのコンテナで発行したカーソルも検証できるようにする
+                # 鍵の値は環境変数に置かず、初期化時にSecrets Managerから読む
+                "CURSOR_SECRET_ARN": cursor_secret.secret_arn,
+            }
+        )
+
+        # POST /chat/stream 用Lambda関数
+        # Lambda Web Adapterの背後でHTTPサーバー（stream_server.py）を起動し、
+        # レスポンスストリーミングで応答を届いた分から返す
+        self.stream_function = lambda_.Function(
+            self, "BedrockChatStreamFunction",
+            runtime=lambda_.Runtime.PYTHON_3_12,
+            handler="run.sh",
+            code=lambda_.Code.from_asset("../lambda", exclude=["tests"]),
+            role=lambda_role,
+            timeout=Duration.seconds(60),
+            memory_size=512,
+            layers=[
+                lambda_.LayerVersion.from_layer_version_arn(
+                    self, "LambdaWebAdapterLayer",
+                    f"arn:aws:lambda:{self.region}:753240598075:layer:LambdaAdapterLayerX86:25"
+                )
+            ],
+            environment={
+                **common_environment,
+                "AWS_LAMBDA_EXEC_WRAPPER": "/opt/bootstrap",
+                "AWS_LWA_INVOKE_MODE": "response_stream",
+                "AWS_LWA_PORT": "8080",
+                "AWS_LWA_READINESS_CHECK_PATH": "/health",
+                # EMFのログを応答の途中でも出力する
+                "PYTHONUNBUFFERED": "1",
+                # botocoreの読み取りタイムアウトをLambdaのタイムアウトに合わせる
+                "LAMBDA_TIMEOUT_SECONDS": "60",
+                "WORKER_FUNCTION_NAME": self.worker_function.function_name,
+                # 会話履歴キャッシュに使うメモリの割合（memory_sizeに対する比率）
+                "HISTORY_CACHE_MEMORY_RATIO": "0.1",
             }
         )
 
         # DynamoDBアクセス権限を付与
         conversations_table.grant_read_write_data(self.chat_function)
         messages_table.grant_read_write_data(self.chat_function)
+        conversations_table.grant_read_write_data(self.stream_function)
+        messages_table.grant_read_write_data(self.stream_function)
+        content_bucket.grant_read_write(self.stream_function)
+        self.worker_function.grant_invoke(self.stream_function)
+        conversations_table.grant_read_write_data(self.worker_function)
+        messages_table.grant_read_write_data(self.worker_function)
+        jobs_table.grant_read_write_data(self.chat_function)
+        jobs_table.grant_read_write_data(self.worker_function)
+        content_bucket.grant_read_write(self.chat_function)
+        content_bucket.grant_read_write(self.worker_function)
+        cursor_secret.grant_read(self.chat_function)
+
+        # チャット関数からワーカー関数の非同期呼び出しとジョブの投入を許可
+        self.worker_function.grant_invoke(self.chat_function)
+        self.job_queue.grant_send_messages(self.chat_function)
 
         # 出力
         from aws_cdk import CfnOutput
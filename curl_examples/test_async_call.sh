@@ -0,0 +1,20 @@
+ID_TOKEN="XXXX"
+API_URL="XXXX"
+
+# POST /chat（非同期ジョブとして受け付け、202とジョブIDを返す）
+JOB_ID=$(curl -s -X POST "$API_URL/chat" \
+  -H "Authorization: Bearer $ID_TOKEN" \
+  -H "Content-Type: application/json" \
+  -H "Prefer: respond-async" \
+  -d '{"message":"LLMのファインチューニング手法を網羅的に、コード例付きで詳しく解説して"}' | jq -r '.jobId')
+
+# GET /jobs/{id}（完了するまでポーリング）
+while true; do
+  JOB=$(curl -s "$API_URL/jobs/$JOB_ID" -H "Authorization: Bearer $ID_TOKEN")
+  STATUS=$(echo "$JOB" | jq -r '.status')
+  if [ "$STATUS" = "succeeded" ] || [ "$STATUS" = "failed" ]; then
+    echo "$JOB" | jq -r '.result.response // .error'
+    break
+  fi
+  sleep 2
+done
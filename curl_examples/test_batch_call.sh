@@ -0,0 +1,9 @@
+ID_TOKEN="XXXX"
+API_URL="XXXX"
+CONVERSATION_ID="XXXX"
+
+# POST /chat/batch（複数のプロンプトをまとめて生成。conversationIdを指定した項目は会話の続きとして生成、同じ会話は1項目まで）
+curl -X POST "$API_URL/chat/batch" \
+  -H "Authorization: Bearer $ID_TOKEN" \
+  -H "Content-Type: application/json" \
+  -d '{"items":[{"id":"q1","message":"Pythonのジェネレーターとは？"},{"id":"q2","message":"DynamoDBのGSIとは？"},{"id":"q3","message":"もう少し詳しく教えて","conversationId":"'"$CONVERSATION_ID"'"}]}' | jq '.results[] | {id, conversationId, error, response}'
@@ -0,0 +1,9 @@
+ID_TOKEN="XXXX"
+API_URL="XXXX"
+
+# POST /chat/stream (SSEストリーミング、届いた分から表示される)
+curl -N -X POST "$API_URL/chat/stream" \
+  -H "Authorization: Bearer $ID_TOKEN" \
+  -H "Content-Type: application/json" \
+  -H "Accept: text/event-stream" \
+  -d '{"message":"Google Colab（のT4）ではどの大きさのモデルまでSFT可能か？"}'
@@ -125,6 +125,19 @@ export default function Home() {
         setCurrentConversationId(response.conversationId);
         // Reload conversations to get the new one
         await loadConversations();
+      } else {
+        // Show the new reply as the preview without reloading the list
+        setConversations((prev) =>
+          prev.map((conv) =>
+            conv.conversationId === currentConversationId
+              ? {
+                  ...conv,
+                  messageCount: conv.messageCount + 2,
+                  lastMessagePreview: response.response,
+                }
+              : conv
+          )
+        );
       }
     } catch (error) {
       console.error('Failed to send message:', error);
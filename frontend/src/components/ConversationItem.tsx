@@ -46,6 +46,9 @@ export default function ConversationItem({
       </svg>
       <div className="flex-1 min-w-0">
         <p className="text-sm text-gray-200 truncate">{conversation.title}</p>
+        {conversation.lastMessagePreview && (
+          <p className="text-xs text-gray-500 truncate">{conversation.lastMessagePreview}</p>
+        )}
       </div>
       <button
         onClick={handleDelete}
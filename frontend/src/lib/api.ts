@@ -44,19 +44,49 @@ export async function sendMessage(
 
 export async function getConversations(
   token: string,
-  limit: number = 20
+  limit: number = 20,
+  cursor?: string,
+  includePreview: boolean = true
 ): Promise<ConversationsResponse> {
-  const response = await fetchWithAuth(`/conversations?limit=${limit}`, token);
+  const params = new URLSearchParams({ limit: String(limit) });
+  if (cursor) {
+    params.set('lastEvaluatedKey', cursor);
+  }
+  // 最後のメッセージも一覧と一緒に受け取り、会話ごとにメッセージを取得しない
+  if (includePreview) {
+    params.set('include', 'preview');
+  }
+  const response = await fetchWithAuth(`/conversations?${params}`, token);
   return response.json();
 }
 
+export interface GetMessagesOptions {
+  // このtimestampより新しいメッセージのみ（古い順）
+  since?: number;
+  // このtimestampより古いメッセージのみ
+  before?: number;
+  // 前回のレスポンスのlastEvaluatedKey
+  cursor?: string;
+}
+
 export async function getMessages(
   conversationId: string,
   token: string,
-  limit: number = 50
+  limit: number = 50,
+  options: GetMessagesOptions = {}
 ): Promise<MessagesResponse> {
+  const params = new URLSearchParams({ limit: String(limit) });
+  if (options.since !== undefined) {
+    params.set('since', String(options.since));
+  }
+  if (options.before !== undefined) {
+    params.set('before', String(options.before));
+  }
+  if (options.cursor) {
+    params.set('lastEvaluatedKey', options.cursor);
+  }
   const response = await fetchWithAuth(
-    `/conversations/${conversationId}?limit=${limit}`,
+    `/conversations/${conversationId}?${params}`,
     token
   );
   return response.json();
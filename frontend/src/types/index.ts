@@ -12,6 +12,8 @@ export interface Conversation {
   messageCount: number;
   createdAt: number;
   updatedAt: number;
+  // 最後のメッセージの先頭部分（include=previewを指定した場合のみ）
+  lastMessagePreview?: string | null;
 }
 
 export interface ChatResponse {
@@ -22,13 +24,17 @@ export interface ChatResponse {
 
 export interface ConversationsResponse {
   conversations: Conversation[];
-  lastEvaluatedKey?: Record<string, unknown>;
+  lastEvaluatedKey?: string | null;
 }
 
 export interface MessagesResponse {
   conversationId: string;
+  conversation?: {
+    title: string;
+    createdAt: number;
+  };
   messages: Message[];
-  lastEvaluatedKey?: Record<string, unknown>;
+  lastEvaluatedKey?: string | null;
 }
 
 export interface User {
@@ -1,33 +1,89 @@
+import json
 import os
 
 import gradio as gr
 import requests
 import boto3
 from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
 
 
-assert load_dotenv(), "環境変数の読み込みに失敗しました"
+# .envがなくても環境変数で設定されていれば起動できる（負荷試験などから起動する場合）
+assert load_dotenv() or "API_URL" in os.environ, "環境変数の読み込みに失敗しました"
 
 # === 設定(デプロイ後の値を入力)===
 API_URL = os.environ["API_URL"]
 USER_POOL_CLIENT_ID = os.environ["USER_POOL_CLIENT_ID"]
 REGION = os.environ["REGION"]
-
-# グローバル状態
+# 同時に処理するイベント数（1プロセスで同時に応答を待てるチャットの数）
+CONCURRENCY_LIMIT = int(os.environ.get("GRADIO_CONCURRENCY_LIMIT", 32))
+# 処理待ちのイベント数の上限（超えた分はすぐにエラーを返す）
+MAX_QUEUE_SIZE = int(os.environ.get("GRADIO_MAX_QUEUE_SIZE", 256))
+# API呼び出しのタイムアウト（接続, 読み込み）。読み込みはLambdaのタイムアウトより少し長くする
+REQUEST_TIMEOUT = (5, float(os.environ.get("API_TIMEOUT_SECONDS", 35)))
+# 1回に読み込むメッセージ数（「古いメッセージを読み込む」で次のページを読み込む）
+MESSAGE_PAGE_SIZE = int(os.environ.get("GRADIO_MESSAGE_PAGE_SIZE", 50))
+# メッセージをキャッシュしておく会話数（セッションごと。最近開いていないものから捨てる）
+MESSAGE_CACHE_CONVERSATIONS = int(os.environ.get("GRADIO_MESSAGE_CACHE_CONVERSATIONS", 20))
+# 会話一覧に表示する最後のメッセージの文字数（APIが返すプレビューより短くする場合）
+PREVIEW_LENGTH = int(os.environ.get("GRADIO_PREVIEW_LENGTH", 40))
+
+
+# セッション（ブラウザのタブ）ごとの状態。gr.Stateに入れてセッションごとに複製される
 class AppState:
-    id_token = None
-    conversation_id = None
-    username = None
+    def __init__(self):
+        self.id_token = None
+        self.conversation_id = None
+        self.username = None
+        self.reset_cache()
+
+    def reset_cache(self):
+        """会話一覧・メッセージのキャッシュを空にする（ログイン・ログアウト時）"""
+        # 会話一覧（APIの並び順）と取得時のETag
+        self.conversations = []
+        self.conversations_etag = None
+        # 会話ID -> 読み込み済みのメッセージ（古い順）と古いページのカーソル（最近開いた順）
+        self.message_cache = {}
+
+
+# APIへの接続はセッション間で共有し、同時実行数分の接続をプールして使い回す
+http = requests.Session()
+http.mount("https://", HTTPAdapter(pool_maxsize=CONCURRENCY_LIMIT))
+http.mount("http://", HTTPAdapter(pool_maxsize=CONCURRENCY_LIMIT))
+
+cognito = boto3.client('cognito-idp', region_name=REGION)
+
+
+def api_request(state, method, path, headers=None, **kwargs):
+    """ログイン中のユーザーのトークンを付けてAPIを呼び出す"""
+    return http.request(
+        method,
+        f"{API_URL}{path}",
+        headers={"Authorization": f"Bearer {state.id_token}", **(headers or {})},
+        timeout=REQUEST_TIMEOUT,
+        **kwargs
+    )
 
-state = AppState()
 
+def iter_sse(response):
+    """SSEのレスポンスを(イベント名, データ)の組として届いた順に返す"""
+    response.encoding = "utf-8"
+    event, data = "message", []
+    # chunk_size=Noneで、届いたチャンクをバッファリングせずに読む
+    for line in response.iter_lines(chunk_size=None, decode_unicode=True):
+        if line.startswith("event:"):
+            event = line[len("event:"):].strip()
+        elif line.startswith("data:"):
+            data.append(line[len("data:"):].strip())
+        elif not line and data:
+            yield event, json.loads("\n".join(data))
+            event, data = "message", []
 
-def login(username, password):
-    """Cognitoでログイン"""
-    client = boto3.client('cognito-idp', region_name=REGION)
 
+def login(username, password, state):
+    """Cognitoでログイン"""
     try:
-        response = client.initiate_auth(
+        response = cognito.initiate_auth(
             ClientId=USER_POOL_CLIENT_ID,
             AuthFlow='USER_PASSWORD_AUTH',
             AuthParameters={
@@ -37,9 +93,11 @@ def login(username, password):
         )
         state.id_token = response['AuthenticationResult']['IdToken']
         state.username = username
+        state.conversation_id = None
+        state.reset_cache()
 
         # ログイン成功時に会話一覧を取得
-        dropdown_update, conversations_text = get_conversations()
+        dropdown_update, conversations_text = get_conversations(state)
 
         return (
             f"✅ ログイン成功: {username}",
@@ -58,77 +116,243 @@ def login(username, password):
         )
 
 
-def chat(message, history):
-    """チャット処理"""
+def chat(message, history, state):
+    """チャット処理（SSEで受け取り、届いた分までの応答を順に返すジェネレーター）
+
+    POST /chat/stream はLambdaのレスポンスストリーミングで生成された分から返す。
+    停止ボタンでキャンセルされるとジェネレーターが閉じられ、APIとの接続も切断する。
+    切断されたAPIは生成を止め、このターンのメッセージ（新規会話なら会話も）を取り消す。
+    """
     if not state.id_token:
-        return "⚠️ 先にログインしてください"
-    
+        yield "⚠️ 先にログインしてください"
+        return
+
+    text = ""
     try:
+        is_new = state.conversation_id is None
         body = {"message": message}
         if state.conversation_id:
             body["conversationId"] = state.conversation_id
-        
-        response = requests.post(
-            f"{API_URL}/chat",
-            headers={
-                "Authorization": f"Bearer {state.id_token}",
-                "Content-Type": "application/json"
-            },
-            json=body
-        )
-
-        if response.status_code != 200:
-            return f"❌ エラー: {response.text}"
 
-        data = response.json()
-        state.conversation_id = data.get("conversationId")
-        return data["response"]
-        
+        with api_request(
+            state, "POST", "/chat/stream",
+            headers={"Accept": "text/event-stream"},
+            json=body,
+            stream=True
+        ) as response:
+            if response.status_code != 200:
+                yield f"❌ エラー: {response.text}"
+                return
+
+            for event, data in iter_sse(response):
+                if event == "start":
+                    # 最初のイベントで会話IDが決まる
+                    state.conversation_id = data["conversationId"]
+                    # 応答の保存を確認できるまではキャッシュを古いものとして扱う
+                    # （受信を途中で停止した場合、次に開いたときに差分を取得する）
+                    entry = state.message_cache.get(state.conversation_id)
+                    cache_fresh = entry is None or not entry["stale"]
+                    if entry is not None:
+                        entry["stale"] = True
+                elif event == "delta":
+                    text += data["text"]
+                    yield text
+                elif event == "error":
+                    yield f"{text}\n\n❌ エラー: {data['error']}"
+                    return
+                elif event == "done" and cache_fresh:
+                    remember_turn(state, data["conversationId"], message, text,
+                                  data.get("timestamp"), is_new)
+
+    except GeneratorExit:
+        # 停止した新規会話はAPI側で削除されるため、次のメッセージは新しい会話として送る
+        if is_new:
+            state.conversation_id = None
+        raise
     except Exception as e:
-        return f"❌ エラー: {str(e)}"
+        yield f"{text}\n\n❌ エラー: {str(e)}"
 
 
-def new_conversation():
+def new_conversation(state):
     """新規会話を開始"""
     state.conversation_id = None
     return [], "✅ 新しい会話を開始しました"
 
 
-def get_conversations():
-    """会話一覧を取得してドロップダウン用のリストを返す"""
+def remember_turn(state, conversation_id, message, response_text, timestamp, is_new):
+    """送信したメッセージと応答をキャッシュに追加（会話を開き直してもAPIを呼ばずに表示できる）"""
+    entry = state.message_cache.get(conversation_id)
+    if entry is None and is_new:
+        entry = {"messages": [], "olderCursor": None, "messageCount": 0, "stale": False}
+        store_messages(state, conversation_id, entry)
+    if entry is None:
+        return
+
+    # ユーザーメッセージのtimestampは応答に含まれないため、差分取得の起点には応答のtimestampを使う
+    entry["messages"].append({"role": "user", "content": message, "timestamp": None})
+    entry["messages"].append({"role": "assistant", "content": response_text, "timestamp": timestamp})
+    entry["messageCount"] += 2
+    entry["stale"] = False
+
+    listed = listed_conversation(state, conversation_id)
+    if listed is not None:
+        listed["messageCount"] = int(listed["messageCount"]) + 2
+        listed["lastMessagePreview"] = response_text
+
+
+def listed_conversation(state, conversation_id):
+    """キャッシュした会話一覧から会話のメタデータを探す"""
+    return next(
+        (conv for conv in state.conversations if conv["conversationId"] == conversation_id),
+        None
+    )
+
+
+def cached_messages(state, conversation_id):
+    """キャッシュしたメッセージを取り出し、最近開いた会話として末尾に移す"""
+    entry = state.message_cache.pop(conversation_id, None)
+    if entry is not None:
+        state.message_cache[conversation_id] = entry
+    return entry
+
+
+def store_messages(state, conversation_id, entry):
+    """メッセージをキャッシュし、上限を超えたら最近開いていない会話から捨てる"""
+    state.message_cache.pop(conversation_id, None)
+    state.message_cache[conversation_id] = entry
+    while len(state.message_cache) > MESSAGE_CACHE_CONVERSATIONS:
+        state.message_cache.pop(next(iter(state.message_cache)))
+
+
+def fetch_messages(state, conversation_id, **params):
+    """会話のメッセージを1ページ取得（会話が見つからなければNone）"""
+    response = api_request(
+        state, "GET", f"/conversations/{conversation_id}",
+        params={"limit": MESSAGE_PAGE_SIZE, **params}
+    )
+    if response.status_code == 404:
+        return None
+    if response.status_code != 200:
+        raise RuntimeError(response.text)
+    return response.json()
+
+
+def load_latest_messages(state, conversation_id):
+    """最新のメッセージを1ページ読み込んでキャッシュする（会話が見つからなければNone）"""
+    data = fetch_messages(state, conversation_id)
+    if data is None:
+        return None
+
+    # 新しい順に返るため、タイムスタンプでソート（古い順）
+    messages = sorted(data.get("messages", []), key=lambda x: x['timestamp'])
+    listed = listed_conversation(state, conversation_id)
+    entry = {
+        "messages": messages,
+        # 続きのページ（さらに古いメッセージ）のカーソル
+        "olderCursor": data.get("lastEvaluatedKey"),
+        "messageCount": int(listed["messageCount"]) if listed else len(messages),
+        "stale": False
+    }
+    store_messages(state, conversation_id, entry)
+    return entry
+
+
+def refresh_messages(state, conversation_id, entry):
+    """キャッシュ済みの会話に、最後に読み込んだメッセージより新しいものだけを追加する"""
+    timestamps = [msg["timestamp"] for msg in entry["messages"] if msg.get("timestamp") is not None]
+    if not timestamps:
+        return load_latest_messages(state, conversation_id)
+
+    params = {"since": max(timestamps)}
+    while True:
+        data = fetch_messages(state, conversation_id, **params)
+        if data is None:
+            state.message_cache.pop(conversation_id, None)
+            return None
+        entry["messages"].extend(data.get("messages", []))
+        entry["messageCount"] += len(data.get("messages", []))
+        if not data.get("lastEvaluatedKey"):
+            break
+        params["lastEvaluatedKey"] = data["lastEvaluatedKey"]
+
+    entry["stale"] = False
+    return entry
+
+
+def to_chat_history(messages):
+    """メッセージをGradio 6.0の辞書形式に変換"""
+    return [{"role": msg['role'], "content": msg['content']} for msg in messages]
+
+
+def render_conversations(state):
+    """キャッシュした会話一覧からドロップダウン用のリストと一覧表示を作る"""
+    conversations = state.conversations
+    if not conversations:
+        return gr.update(choices=[], value=None), "会話履歴がありません"
+
+    # ドロップダウン用の選択肢を作成 (表示名, ID)
+    choices = []
+    for conv in conversations:
+        label = f"{conv['title']} ({conv['messageCount']}件)"
+        preview = short_preview(conv.get("lastMessagePreview"))
+        if preview:
+            label += f" - {preview}"
+        choices.append((label, conv['conversationId']))
+
+    result = "## 📝 会話一覧\n\n"
+    for conv in conversations:
+        result += f"- **{conv['title']}** (メッセージ数: {conv['messageCount']})\n"
+        preview = short_preview(conv.get("lastMessagePreview"))
+        if preview:
+            result += f"  {preview}\n"
+
+    return gr.update(choices=choices, value=None), result
+
+
+def short_preview(text):
+    """最後のメッセージを1行・PREVIEW_LENGTH文字までに縮める"""
+    if not text:
+        return ""
+    text = " ".join(text.split())
+    return text[:PREVIEW_LENGTH] + "…" if len(text) > PREVIEW_LENGTH else text
+
+
+def get_conversations(state):
+    """会話一覧を取得してドロップダウン用のリストを返す
+
+    前回取得時のETagを送り、一覧が変わっていなければ（304）キャッシュから表示する。
+    """
     if not state.id_token:
         return gr.update(choices=[], value=None), "⚠️ 先にログインしてください"
 
     try:
-        response = requests.get(
-            f"{API_URL}/conversations",
-            headers={"Authorization": f"Bearer {state.id_token}"}
+        headers = {}
+        if state.conversations_etag:
+            headers["If-None-Match"] = state.conversations_etag
+        # 最後のメッセージも一覧と一緒に受け取り、会話ごとにメッセージを取得しない
+        response = api_request(
+            state, "GET", "/conversations", headers=headers, params={"include": "preview"}
         )
 
-        data = response.json()
-        conversations = data.get("conversations", [])
-
-        if not conversations:
-            return gr.update(choices=[], value=None), "会話履歴がありません"
-
-        # ドロップダウン用の選択肢を作成 (表示名, ID)
-        choices = []
-        for conv in conversations:
-            label = f"{conv['title']} ({conv['messageCount']}件)"
-            choices.append((label, conv['conversationId']))
+        if response.status_code not in (200, 304):
+            return gr.update(choices=[], value=None), f"❌ エラー: {response.text}"
 
-        result = "## 📝 会話一覧\n\n"
-        for conv in conversations:
-            result += f"- **{conv['title']}** (メッセージ数: {conv['messageCount']})\n"
+        if response.status_code == 200:
+            state.conversations = response.json().get("conversations", [])
+            state.conversations_etag = response.headers.get("ETag")
 
-        return gr.update(choices=choices, value=None), result
+        return render_conversations(state)
 
     except Exception as e:
         return gr.update(choices=[], value=None), f"❌ エラー: {str(e)}"
 
 
-def load_conversation(conversation_id):
-    """選択した会話のメッセージ履歴を読み込む"""
+def load_conversation(conversation_id, state):
+    """選択した会話のメッセージ履歴を読み込む
+
+    一度開いた会話はキャッシュから表示する。一覧のメッセージ数がキャッシュより多い場合や
+    応答の受信を途中で停止した場合は、新しいメッセージだけを取得して追加する。
+    """
     if not conversation_id:
         return [], "会話を選択してください"
 
@@ -136,39 +360,49 @@ def load_conversation(conversation_id):
         return [], "⚠️ 先にログインしてください"
 
     try:
-        response = requests.get(
-            f"{API_URL}/conversations/{conversation_id}",
-            headers={"Authorization": f"Bearer {state.id_token}"}
-        )
-
-        if response.status_code == 404:
+        entry = cached_messages(state, conversation_id)
+        listed = listed_conversation(state, conversation_id)
+        if entry is None:
+            entry = load_latest_messages(state, conversation_id)
+        elif entry["stale"] or (listed and int(listed["messageCount"]) > entry["messageCount"]):
+            entry = refresh_messages(state, conversation_id, entry)
+
+        if entry is None:
             return [], "❌ 会話が見つかりません"
 
-        if response.status_code != 200:
-            return [], f"❌ エラー: {response.text}"
+        state.conversation_id = conversation_id
+        return to_chat_history(entry["messages"]), f"✅ 会話を読み込みました (ID: {conversation_id[:8]}...)"
+
+    except Exception as e:
+        return [], f"❌ エラー: {str(e)}"
 
-        data = response.json()
-        messages = data.get("messages", [])
 
-        # タイムスタンプでソート（古い順）
-        messages.sort(key=lambda x: x['timestamp'])
+def load_older_messages(state):
+    """表示中の会話のさらに古いメッセージを1ページ読み込む"""
+    if not state.id_token:
+        return gr.update(), "⚠️ 先にログインしてください"
 
-        # Gradio 6.0の辞書形式に変換
-        chat_history = []
-        for msg in messages:
-            chat_history.append({
-                "role": msg['role'],
-                "content": msg['content']
-            })
+    entry = state.message_cache.get(state.conversation_id) if state.conversation_id else None
+    if entry is None:
+        return gr.update(), "会話を選択してください"
+    if not entry["olderCursor"]:
+        return gr.update(), "これより古いメッセージはありません"
 
-        state.conversation_id = conversation_id
-        return chat_history, f"✅ 会話を読み込みました (ID: {conversation_id[:8]}...)"
+    try:
+        data = fetch_messages(state, state.conversation_id, lastEvaluatedKey=entry["olderCursor"])
+        if data is None:
+            return [], "❌ 会話が見つかりません"
+
+        older = sorted(data.get("messages", []), key=lambda x: x['timestamp'])
+        entry["messages"][:0] = older
+        entry["olderCursor"] = data.get("lastEvaluatedKey")
+        return to_chat_history(entry["messages"]), f"✅ 古いメッセージを{len(older)}件読み込みました"
 
     except Exception as e:
-        return [], f"❌ エラー: {str(e)}"
+        return gr.update(), f"❌ エラー: {str(e)}"
 
 
-def delete_conversation(conversation_id):
+def delete_conversation(conversation_id, state):
     """会話を削除する"""
     if not conversation_id:
         return gr.update(), [], "⚠️ 削除する会話を選択してください", ""
@@ -177,34 +411,37 @@ def delete_conversation(conversation_id):
         return gr.update(), [], "⚠️ 先にログインしてください", ""
 
     try:
-        response = requests.delete(
-            f"{API_URL}/conversations/{conversation_id}",
-            headers={"Authorization": f"Bearer {state.id_token}"}
-        )
+        response = api_request(state, "DELETE", f"/conversations/{conversation_id}")
 
         if response.status_code == 404:
             return gr.update(), [], "❌ 会話が見つかりません", ""
 
-        if response.status_code != 200:
+        # 202はメッセージのバックグラウンド削除を受け付けた場合
+        if response.status_code not in (200, 202):
             return gr.update(), [], f"❌ エラー: {response.text}", ""
 
         # 現在の会話が削除された場合はリセット
         if state.conversation_id == conversation_id:
             state.conversation_id = None
 
-        # 会話一覧を更新
-        dropdown_update, conversations_text = get_conversations()
+        # 会話一覧は取得し直さずにキャッシュから取り除く
+        state.conversations = [
+            conv for conv in state.conversations if conv["conversationId"] != conversation_id
+        ]
+        state.message_cache.pop(conversation_id, None)
+        dropdown_update, conversations_text = render_conversations(state)
         return dropdown_update, [], "✅ 会話を削除しました", conversations_text
 
     except Exception as e:
         return gr.update(), [], f"❌ エラー: {str(e)}", ""
 
 
-def logout():
+def logout(state):
     """ログアウト"""
     state.id_token = None
     state.conversation_id = None
     state.username = None
+    state.reset_cache()
     return "ログアウトしました", gr.update(visible=True), gr.update(visible=False)
 
 
@@ -570,6 +807,9 @@ pre code,
 
 # === UI構築 ===
 with gr.Blocks(title="Bedrock Chat") as demo:
+    # セッションごとの状態（ログイン中のトークンと選択中の会話）
+    session_state = gr.State(AppState())
+
     # ヘッダー
     gr.HTML(
         """
@@ -618,9 +858,11 @@ with gr.Blocks(title="Bedrock Chat") as demo:
                         container=False
                     )
                     submit_btn = gr.Button("送信", variant="primary", scale=1, elem_classes="primary-btn")
+                    stop_btn = gr.Button("停止", scale=1, elem_classes="action-btn")
 
                 with gr.Row():
                     new_conv_btn = gr.Button("新規会話", size="sm", elem_classes="action-btn")
+                    load_older_btn = gr.Button("古いメッセージを読み込む", size="sm", elem_classes="action-btn")
                     logout_btn = gr.Button("ログアウト", size="sm", elem_classes="action-btn")
 
                 new_conv_status = gr.Markdown("")
@@ -658,68 +900,91 @@ with gr.Blocks(title="Bedrock Chat") as demo:
     # ログイン
     login_btn.click(
         login,
-        inputs=[username_input, password_input],
+        inputs=[username_input, password_input, session_state],
         outputs=[login_status, login_section, chat_section, conversation_dropdown, conversations_display]
     )
 
     # チャット送信 - Gradio 6.0の辞書形式に対応
-    def respond(message, chat_history):
-        bot_message = chat(message, chat_history)
+    def respond(message, chat_history, state):
+        replies = chat(message, chat_history, state)
         # Gradio 6.0では辞書形式を使用
         chat_history.append({"role": "user", "content": message})
-        chat_history.append({"role": "assistant", "content": bot_message})
-        return "", chat_history
+        chat_history.append({"role": "assistant", "content": ""})
+        yield "", chat_history
+
+        # トークンが届くたびに応答を更新する
+        for partial in replies:
+            chat_history[-1]["content"] = partial
+            yield "", chat_history
 
-    submit_btn.click(
+    submit_event = submit_btn.click(
         respond,
-        inputs=[msg, chatbot],
+        inputs=[msg, chatbot, session_state],
         outputs=[msg, chatbot]
     )
 
-    msg.submit(
+    msg_event = msg.submit(
         respond,
-        inputs=[msg, chatbot],
+        inputs=[msg, chatbot, session_state],
         outputs=[msg, chatbot]
     )
 
+    # 生成を停止（応答待ちの接続を切断し、API側の生成も止める）
+    stop_btn.click(None, cancels=[submit_event, msg_event])
+
     # 新規会話
     new_conv_btn.click(
         new_conversation,
+        inputs=[session_state],
         outputs=[chatbot, new_conv_status]
     )
 
     # 会話一覧更新
     refresh_btn.click(
         get_conversations,
+        inputs=[session_state],
         outputs=[conversation_dropdown, conversations_display]
     )
 
     # 会話を読み込む
     load_conv_btn.click(
         load_conversation,
-        inputs=[conversation_dropdown],
+        inputs=[conversation_dropdown, session_state],
+        outputs=[chatbot, new_conv_status]
+    )
+
+    # さらに古いメッセージを読み込む
+    load_older_btn.click(
+        load_older_messages,
+        inputs=[session_state],
         outputs=[chatbot, new_conv_status]
     )
 
     # 会話を削除
     delete_conv_btn.click(
         delete_conversation,
-        inputs=[conversation_dropdown],
+        inputs=[conversation_dropdown, session_state],
         outputs=[conversation_dropdown, chatbot, new_conv_status, conversations_display]
     )
 
     # ログアウト
     logout_btn.click(
         logout,
+        inputs=[session_state],
         outputs=[new_conv_status, login_section, chat_section]
     )
 
+# 既定では1イベントずつしか処理しないため、応答待ちのチャットを並行して処理できるようにする
+demo.queue(default_concurrency_limit=CONCURRENCY_LIMIT, max_size=MAX_QUEUE_SIZE)
+
 
 if __name__ == "__main__":
     demo.launch(
         server_name="0.0.0.0",
         server_port=7860,
         share=False,
+        # 同期関数を実行するスレッド数（同時実行数より少ないと待ちが発生する）
+        max_threads=max(40, CONCURRENCY_LIMIT),
         css=custom_css,
         theme=gr.themes.Base(
             primary_hue="indigo",
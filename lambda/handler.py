@@ -1,10 +1,51 @@
+import hashlib
 import json
+import os
 import uuid
 import time
+from concurrent.futures import ThreadPoolExecutor
 from decimal import Decimal
 
+from services import metrics
+from services.admission import BedrockThrottledError
+from services.aws_clients import should_prewarm
 from services.bedrock_service import BedrockService
-from services.dynamodb_service import DynamoDBService
+from services.dynamodb_service import (
+    DynamoDBService, CONVERSATION_LIST_ATTRIBUTES, CONVERSATION_PREVIEW_ATTRIBUTE
+)
+from services.task_service import TaskService
+from services.job_queue import JobQueue
+from services.history_cache import HistoryCache
+from services.cursor import encode_cursor, decode_cursor, InvalidCursorError
+from services.message_key import new_message_key, key_to_epoch_seconds
+from services.chat_turn import ChatTurnService, budget_history, unsummarized_messages
+from services.chat_stream import open_chat_stream
+
+
+# このメッセージ数を超える会話の削除はバックグラウンドで行う
+ASYNC_DELETE_THRESHOLD = int(os.environ.get('ASYNC_DELETE_THRESHOLD', 2000))
+# 同期削除時にLambdaのタイムアウトまで残しておく秒数
+DELETE_TIME_MARGIN_SECONDS = 5
+# 会話一覧で常に返す属性（ETagの計算とページングに使用）
+CONVERSATION_REQUIRED_FIELDS = ('conversationId', 'updatedAt')
+# 会話一覧のincludeパラメータで追加できる情報
+CONVERSATION_INCLUDE_OPTIONS = ('preview',)
+# GET /conversations/{id} で返す会話の属性（会話ヘッダーにも複製されているもの）
+CONVERSATION_VIEW_ATTRIBUTES = ('title', 'createdAt')
+# POST /chat/batch で1リクエストに含められるプロンプト数
+BATCH_CHAT_MAX_ITEMS = int(os.environ.get('BATCH_CHAT_MAX_ITEMS', 20))
+# POST /chat/batch でBedrockを同時に呼び出す数
+BATCH_CHAT_CONCURRENCY = int(os.environ.get('BATCH_CHAT_CONCURRENCY', 8))
+# バッチの保存のためにLambdaのタイムアウトまで残しておく秒数
+BATCH_TIME_MARGIN_SECONDS = 5
+# Bedrockの再試行を打ち切る際に、応答の保存用としてLambdaのタイムアウトまで残しておく秒数
+BEDROCK_TIME_MARGIN_SECONDS = 3
+# 非同期生成ジョブの保持期間（秒）。過ぎたジョブはTTLで削除される
+JOB_TTL_SECONDS = int(os.environ.get('JOB_TTL_SECONDS', 24 * 60 * 60))
+# GET /jobs/{id} で返すジョブの属性
+JOB_RESPONSE_FIELDS = (
+    'jobId', 'status', 'conversationId', 'result', 'error', 'createdAt', 'updatedAt'
+)
 
 
 class DecimalEncoder(json.JSONEncoder):
@@ -19,10 +60,58 @@ class DecimalEncoder(json.JSONEncoder):
 
 bedrock_service = BedrockService()
 dynamodb_service = DynamoDBService()
+task_service = TaskService()
+# 非同期生成ジョブのキュー
+job_queue = JobQueue()
+# ウォームコンテナ間で再利用する会話履歴キャッシュ
+history_cache = HistoryCache()
+# DynamoDBへの書き込みをBedrock呼び出しと並行して行うためのスレッドプール
+executor = ThreadPoolExecutor(max_workers=4)
+# 1回分のチャットの手順（非同期ジョブのワーカーと共有）
+chat_turns = ChatTurnService(dynamodb_service, history_cache, task_service, executor)
+
+# 初期化フェーズ（課金・レイテンシの影響が小さい）で接続を確立しておく
+if should_prewarm():
+    try:
+        dynamodb_service.prewarm()
+    except Exception as e:
+        print(f"Prewarm failed: {str(e)}")
 
 
 def lambda_handler(event, context):
     """メインハンドラー"""
+    metrics.start_request(route_name(event))
+    if context is not None:
+        metrics.current().set_property('RequestId', getattr(context, 'aws_request_id', None))
+
+    # スロットリング時の再試行はLambdaのタイムアウトに余裕を残して打ち切る
+    bedrock_service.set_deadline(remaining_deadline(context, BEDROCK_TIME_MARGIN_SECONDS))
+
+    result = route_request(event, context)
+
+    # Server-Timingヘッダーの付与とEMFでのメトリクス出力
+    return metrics.finish_request(result)
+
+
+def remaining_deadline(context, margin_seconds):
+    """Lambdaのタイムアウトからmargin_seconds前の時刻（time.monotonic基準、contextがなければNone）"""
+    if context is None:
+        return None
+    return time.monotonic() + context.get_remaining_time_in_millis() / 1000 - margin_seconds
+
+
+def route_name(event):
+    """メトリクスのディメンションに使うルート名（IDは置換する）"""
+    path = event.get('path', '')
+    if path.startswith('/conversations/'):
+        path = '/conversations/{id}'
+    elif path.startswith('/jobs/'):
+        path = '/jobs/{id}'
+    return f"{event.get('httpMethod')} {path}"
+
+
+def route_request(event, context):
+    """ルーティング"""
     try:
         http_method = event['httpMethod']
         path = event['path']
@@ -33,23 +122,41 @@ def lambda_handler(event, context):
         # ルーティング
         if http_method == 'POST' and path == '/chat':
             body = json.loads(event['body'])
+            if wants_async(event, body):
+                return handle_chat_async(body, user_id)
+            if wants_stream(event, body):
+                return handle_chat_stream(body, user_id)
             return handle_chat(body, user_id)
 
+        elif http_method == 'POST' and path == '/chat/batch':
+            return handle_chat_batch(json.loads(event['body']), user_id, context)
+
         elif http_method == 'GET' and path == '/conversations':
             params = event.get('queryStringParameters') or {}
-            return handle_get_conversations(user_id, params)
+            return handle_get_conversations(user_id, params, request_headers(event))
 
         elif http_method == 'GET' and path.startswith('/conversations/'):
             conversation_id = path.split('/')[-1]
             params = event.get('queryStringParameters') or {}
             return handle_get_messages(conversation_id, user_id, params)
 
+        elif http_method == 'GET' and path.startswith('/jobs/'):
+            job_id = path.split('/')[-1]
+            return handle_get_job(job_id, user_id)
+
         elif http_method == 'DELETE' and path.startswith('/conversations/'):
             conversation_id = path.split('/')[-1]
-            return handle_delete_conversation(conversation_id, user_id)
+            return handle_delete_conversation(conversation_id, user_id, context)
 
         return response(404, {'error': 'Not found'})
-        
+
+    except BedrockThrottledError as e:
+        print(f"Throttled: {str(e)}")
+        return response(429, {'error': 'Too many requests'}, headers={
+            'Retry-After': str(e.retry_after),
+            'Access-Control-Expose-Headers': 'Retry-After'
+        })
+
     except Exception as e:
         print(f"Error: {str(e)}")
         import traceback
@@ -57,6 +164,23 @@ def lambda_handler(event, context):
         return response(500, {'error': 'Internal server error'})
 
 
+def request_headers(event):
+    """リクエストヘッダーを小文字のキーで返す"""
+    return {k.lower(): v for k, v in (event.get('headers') or {}).items()}
+
+
+def wants_stream(event, body):
+    """ストリーミング(SSE)応答が要求されているか判定"""
+    headers = request_headers(event)
+    return body.get('stream') is True or 'text/event-stream' in headers.get('accept', '')
+
+
+def wants_async(event, body):
+    """非同期ジョブとしての実行が要求されているか判定"""
+    headers = request_headers(event)
+    return body.get('async') is True or 'respond-async' in headers.get('prefer', '')
+
+
 def handle_chat(body, user_id):
     """POST /chat のハンドラー"""
     message = body.get('message')
@@ -65,118 +189,445 @@ def handle_chat(body, user_id):
     if not message:
         return response(400, {'error': 'message is required'})
 
-    # 新規会話の場合
-    if not conversation_id:
-        conversation_id = str(uuid.uuid4())
-        timestamp = int(time.time())
-        title = message[:50] + '...' if len(message) > 50 else message
-
-        dynamodb_service.create_conversation(
-            user_id=user_id,
-            conversation_id=conversation_id,
-            title=title,
-            timestamp=timestamp
-        )
-
-    # ユーザーメッセージを保存
-    timestamp = int(time.time())
-    dynamodb_service.save_message(conversation_id, 'user', message, timestamp)
-
-    # 会話履歴を取得
-    history = dynamodb_service.get_conversation_history(conversation_id)
-
-    # Bedrock呼び出し
-    ai_response = bedrock_service.generate_response_with_history(history)
-
-    # AI応答を保存
-    ai_timestamp = int(time.time())
-    dynamodb_service.save_message(conversation_id, 'assistant', ai_response, ai_timestamp)
+    with metrics.span('prepare'):
+        turn = chat_turns.start(user_id, conversation_id, message)
+    if turn is None:
+        return response(404, {'error': 'Conversation not found'})
 
-    # 会話メタデータを更新
-    dynamodb_service.update_conversation_metadata(user_id, conversation_id, ai_timestamp)
+    try:
+        # Bedrock呼び出し
+        with metrics.span('generate'):
+            result = bedrock_service.converse_with_history(turn['history'], summary=turn['summary'])
+        ai_response = result['text']
+        metrics.record_bedrock(result['usage'], result['metrics'])
+
+        with metrics.span('persist'):
+            ai_timestamp = chat_turns.finish(user_id, turn, ai_response, result['usage'])
+    except Exception:
+        # 失敗の種類によらずユーザーメッセージを取り消す
+        chat_turns.discard(user_id, turn)
+        raise
 
     return response(200, {
-        'conversationId': conversation_id,
+        'conversationId': turn['conversationId'],
         'response': ai_response,
         'timestamp': ai_timestamp
     })
 
 
-def handle_get_conversations(user_id, params):
-    """GET /conversations"""
-    limit = int(params.get('limit', 20))
+def handle_chat_stream(body, user_id):
+    """POST /chat (stream) のハンドラー"""
+    if not body.get('message'):
+        return response(400, {'error': 'message is required'})
 
-    kwargs = {
-        'IndexName': 'userId-updatedAt-index',
-        'KeyConditionExpression': 'userId = :uid',
-        'ExpressionAttributeValues': {':uid': user_id},
-        'ScanIndexForward': False,
-        'Limit': limit
-    }
+    with metrics.span('prepare'):
+        turn = chat_turns.start(user_id, body.get('conversationId'), body['message'])
+    if turn is None:
+        return response(404, {'error': 'Conversation not found'})
 
-    if 'lastEvaluatedKey' in params:
-        kwargs['ExclusiveStartKey'] = json.loads(params['lastEvaluatedKey'])
+    # 最初のトークンより前のスロットリングはここで送出され、429として返す
+    events = open_chat_stream(chat_turns, bedrock_service, user_id, turn)
 
-    result = dynamodb_service.conversations_table.query(**kwargs)
+    # API GatewayのLambdaプロキシ統合ではSSEイベント列をまとめて返す
+    # 届いた分から受け取る場合はLambda Web Adapter経由の POST /chat/stream を使う
+    return sse_response(events)
 
-    return response(200, {
-        'conversations': result['Items'],
-        'lastEvaluatedKey': result.get('LastEvaluatedKey')
+
+def handle_chat_async(body, user_id):
+    """POST /chat (async) のハンドラー
+
+    生成をワーカーLambdaのジョブとしてキューに積み、202とジョブIDを返す。
+    API GatewayとLambdaのタイムアウトに縛られずに長い応答を生成でき、
+    結果は GET /jobs/{id} で取得する。
+    """
+    message = body.get('message')
+    conversation_id = body.get('conversationId')
+
+    if not message:
+        return response(400, {'error': 'message is required'})
+    if dynamodb_service.jobs_table is None:
+        return response(501, {'error': 'Async mode is not configured'})
+
+    # 権限チェック（存在しない会話のジョブは受け付けない）
+    if conversation_id and dynamodb_service.get_conversation(user_id, conversation_id) is None:
+        return response(404, {'error': 'Conversation not found'})
+
+    job_id = str(uuid.uuid4())
+    now = int(time.time())
+    with metrics.span('enqueue'):
+        job = dynamodb_service.create_job(
+            job_id, user_id, message, conversation_id, now, expires_at=now + JOB_TTL_SECONDS
+        )
+        job_queue.send({'jobId': job_id})
+
+    return response(202, job_view(job), headers={
+        'Location': f'/jobs/{job_id}',
+        'Access-Control-Expose-Headers': 'Location'
     })
 
 
-def handle_get_messages(conversation_id, user_id, params):
-    """GET /conversations/{id}"""
-    # 権限チェック
-    conv = dynamodb_service.conversations_table.get_item(
-        Key={'userId': user_id, 'conversationId': conversation_id}
+def handle_get_job(job_id, user_id):
+    """GET /jobs/{id}"""
+    if dynamodb_service.jobs_table is None:
+        return response(404, {'error': 'Job not found'})
+
+    job = dynamodb_service.get_job(job_id)
+    # 他のユーザーのジョブは存在しないものとして扱う
+    if job is None or job.get('userId') != user_id:
+        return response(404, {'error': 'Job not found'})
+
+    return response(200, job_view(job))
+
+
+def job_view(job):
+    """ジョブのうちクライアントに返す属性"""
+    return {field: job[field] for field in JOB_RESPONSE_FIELDS if field in job}
+
+
+def handle_chat_batch(body, user_id, context=None):
+    """POST /chat/batch のハンドラー
+
+    互いに独立した複数のプロンプトをBedrockへ並行して送り、項目ごとの結果を返す。
+    項目ごとにconversationIdを指定すると、その会話の続きとして生成する。
+    並行して生成した応答が会話の中で入り混じらないよう、同じ会話を指定できるのは1項目までとし、
+    2つ目以降の項目はエラーとして結果に含める。
+    保存は成功した項目のみ、メッセージと新規会話をBatchWriteItemでまとめて行う。
+    """
+    items = body.get('items')
+    if not isinstance(items, list) or not items:
+        return response(400, {'error': 'items must be a non-empty list'})
+    if len(items) > BATCH_CHAT_MAX_ITEMS:
+        return response(400, {'error': f'items must not exceed {BATCH_CHAT_MAX_ITEMS}'})
+    if any(not isinstance(item, dict) or not isinstance(item.get('message'), str) or not item['message']
+           for item in items):
+        return response(400, {'error': 'message is required for every item'})
+
+    # Lambdaのタイムアウトまでに保存を終えられるよう、開始できなかった項目は打ち切る
+    deadline = remaining_deadline(context, BATCH_TIME_MARGIN_SECONDS)
+
+    with ThreadPoolExecutor(max_workers=min(BATCH_CHAT_CONCURRENCY, len(items))) as pool:
+        with metrics.span('prepare'):
+            turns = prepare_batch_turns(pool, user_id, items)
+        with metrics.span('generate'):
+            results = list(pool.map(lambda turn: run_batch_turn(turn, deadline), turns))
+
+    with metrics.span('persist'):
+        save_batch_turns(user_id, turns, results)
+
+    metrics.current().add('BatchItems', len(items))
+    metrics.current().add('BatchErrors', sum(1 for result in results if 'error' in result))
+    return response(200, {'results': results})
+
+
+def prepare_batch_turns(pool, user_id, items):
+    """バッチの各項目についてBedrockへ送る履歴を組み立てる（既存の会話は1回ずつ並行して読み込む）"""
+    conversation_ids = {item['conversationId'] for item in items if item.get('conversationId')}
+    loaded = dict(zip(
+        conversation_ids,
+        pool.map(lambda cid: chat_turns.load_recent_messages(user_id, cid), conversation_ids)
+    ))
+
+    turns = []
+    seen = set()
+    for item in items:
+        message = item['message']
+        turn = {
+            'id': item.get('id'),
+            'conversationId': item.get('conversationId'),
+            'summary': None,
+        }
+
+        if turn['conversationId'] in seen:
+            turn['error'] = 'Duplicate conversationId in batch'
+            turns.append(turn)
+            continue
+        if turn['conversationId']:
+            seen.add(turn['conversationId'])
+            conv, recent = loaded[turn['conversationId']]
+            if conv is None:
+                turn['error'] = 'Conversation not found'
+                turns.append(turn)
+                continue
+            turn['conversation'] = conv
+            turn['summary'] = conv.get('summary')
+            recent = unsummarized_messages(conv, recent)
+        else:
+            turn['conversationId'] = str(uuid.uuid4())
+            turn['title'] = message[:50] + '...' if len(message) > 50 else message
+            recent = []
+
+        turn['userItem'] = dynamodb_service.build_message_item(
+            turn['conversationId'], 'user', message, new_message_key()
+        )
+        turn['history'] = budget_history(recent + [turn['userItem']], turn['summary'])
+        turns.append(turn)
+    return turns
+
+
+def run_batch_turn(turn, deadline=None):
+    """バッチの1項目の応答を生成し、項目ごとの結果を返す（例外は結果のerrorに変換）"""
+    result = {'conversationId': turn['conversationId']}
+    if turn.get('id') is not None:
+        result['id'] = turn['id']
+    if 'error' in turn:
+        result['error'] = turn['error']
+        return result
+    if deadline is not None and time.monotonic() >= deadline:
+        result['error'] = 'Timed out before processing'
+        return result
+
+    try:
+        generated = bedrock_service.converse_with_history(turn['history'], summary=turn['summary'])
+    except BedrockThrottledError as e:
+        result['error'] = 'Too many requests'
+        result['retryAfter'] = e.retry_after
+        return result
+    except Exception as e:
+        print(f"Batch item error: {str(e)}")
+        result['error'] = 'Generation failed'
+        return result
+    metrics.record_bedrock(generated['usage'], generated['metrics'])
+
+    ai_timestamp = new_message_key()
+    turn['aiItem'] = dynamodb_service.build_message_item(
+        turn['conversationId'], 'assistant', generated['text'], ai_timestamp,
+        token_count=generated['usage'].get('outputTokens')
     )
-    if 'Item' not in conv:
-        return response(404, {'error': 'Conversation not found'})
+    result['response'] = generated['text']
+    result['timestamp'] = ai_timestamp
+    return result
+
+
+def save_batch_turns(user_id, turns, results):
+    """成功した項目のメッセージと新規会話をまとめて保存し、既存の会話のメタデータを更新"""
+    completed = [turn for turn, result in zip(turns, results) if 'response' in result]
+    if not completed:
+        return
+
+    new_conversations = []
+    messages = []
+    # 既存の会話ごとの (会話メタデータ, 更新日時, 最後の応答)
+    updates = {}
+    for turn in completed:
+        messages += [turn['userItem'], turn['aiItem']]
+        updated_at = key_to_epoch_seconds(turn['aiItem']['timestamp'])
+        last_message = turn['aiItem']['content']
+        if 'conversation' in turn:
+            updates[turn['conversationId']] = (turn['conversation'], updated_at, last_message)
+        else:
+            new_conversations.append(dynamodb_service.build_conversation_item(
+                user_id, turn['conversationId'], turn['title'], updated_at, message_count=2,
+                last_message=last_message
+            ))
+
+    dynamodb_service.batch_put(new_conversations, messages)
+
+    for conversation_id, (conv, updated_at, last_message) in updates.items():
+        dynamodb_service.update_conversation_metadata(
+            user_id, conversation_id, updated_at, increment=2, last_message=last_message
+        )
+        # キャッシュには追加していないため、次のターンでは履歴を読み直す
+        history_cache.invalidate(conversation_id)
+        chat_turns.request_summary_if_needed(
+            user_id, conversation_id,
+            int(conv.get('messageCount', 0)) + 2, int(conv.get('summarizedCount', 0))
+        )
+
+
+def handle_get_conversations(user_id, params, headers=None):
+    """GET /conversations"""
+    limit = int(params.get('limit', 20))
 
-    limit = int(params.get('limit', 50))
+    fields = parse_conversation_fields(params.get('fields'))
+    if fields is None:
+        return response(400, {
+            'error': f"fields must be a subset of: {', '.join(CONVERSATION_LIST_ATTRIBUTES)}"
+        })
+    include = parse_conversation_include(params.get('include'))
+    if include is None:
+        return response(400, {
+            'error': f"include must be a subset of: {', '.join(CONVERSATION_INCLUDE_OPTIONS)}"
+        })
+    if 'preview' in include:
+        fields = (*fields, CONVERSATION_PREVIEW_ATTRIBUTE)
+
+    # ページング位置はユーザーに紐づけた署名付きカーソルでやり取りする
+    cursor_scope = f"conversations:{user_id}"
+    start_key = None
+    if params.get('lastEvaluatedKey'):
+        try:
+            conversation_id, updated_at = decode_cursor(params['lastEvaluatedKey'], cursor_scope)
+        except (InvalidCursorError, ValueError):
+            return response(400, {'error': 'Invalid lastEvaluatedKey'})
+        start_key = {'userId': user_id, 'conversationId': conversation_id, 'updatedAt': updated_at}
+
+    items, last_key = dynamodb_service.list_conversations(
+        user_id, limit, exclusive_start_key=start_key, attributes=fields
+    )
+    if 'preview' in include:
+        fill_conversation_previews(items)
+    next_cursor = None
+    if last_key is not None:
+        next_cursor = encode_cursor(
+            [last_key['conversationId'], last_key['updatedAt']], cursor_scope
+        )
 
-    kwargs = {
-        'KeyConditionExpression': 'conversationId = :cid',
-        'ExpressionAttributeValues': {':cid': conversation_id},
-        'ScanIndexForward': False,
-        'Limit': limit
+    # 一覧が変わっていなければ本文を返さずに304で応答する
+    etag = conversations_etag(items, fields, limit, params.get('lastEvaluatedKey'))
+    cache_headers = {
+        'ETag': etag,
+        'Cache-Control': 'private, no-cache',
+        'Access-Control-Expose-Headers': 'ETag'
     }
+    if etag_matches((headers or {}).get('if-none-match'), etag):
+        return not_modified(cache_headers)
+
+    return response(200, {
+        'conversations': items,
+        'lastEvaluatedKey': next_cursor
+    }, headers=cache_headers)
+
+
+def parse_conversation_fields(fields_param):
+    """fieldsパラメータを射影する属性のタプルに変換（不正な属性名があればNone）"""
+    if not fields_param:
+        return CONVERSATION_LIST_ATTRIBUTES
+
+    requested = [f.strip() for f in fields_param.split(',') if f.strip()]
+    if any(f not in CONVERSATION_LIST_ATTRIBUTES for f in requested):
+        return None
+    # ETagの計算とページングに必要な属性は常に含める
+    return tuple(
+        f for f in CONVERSATION_LIST_ATTRIBUTES
+        if f in requested or f in CONVERSATION_REQUIRED_FIELDS
+    )
 
-    if 'lastEvaluatedKey' in params:
-        kwargs['ExclusiveStartKey'] = json.loads(params['lastEvaluatedKey'])
 
-    result = dynamodb_service.messages_table.query(**kwargs)
+def parse_conversation_include(include_param):
+    """includeパラメータを追加する情報の集合に変換（不正な値があればNone）"""
+    requested = {i.strip() for i in (include_param or '').split(',') if i.strip()}
+    if any(i not in CONVERSATION_INCLUDE_OPTIONS for i in requested):
+        return None
+    return requested
+
+
+def fill_conversation_previews(items):
+    """最後のメッセージの複製を持たない会話（複製を始める前の会話）のプレビューを補う
+
+    会話ごとにLimit=1のQueryを並行して発行し、クライアントが会話ごとに
+    GET /conversations/{id} を呼ばなくて済むようにする。
+    """
+    missing = [
+        item for item in items
+        if CONVERSATION_PREVIEW_ATTRIBUTE not in item and item.get('messageCount') != 0
+    ]
+    if missing:
+        metrics.current().add('PreviewFallbackQueries', len(missing))
+        previews = executor.map(
+            dynamodb_service.get_last_message_preview,
+            [item['conversationId'] for item in missing]
+        )
+        for item, preview in zip(missing, previews):
+            item[CONVERSATION_PREVIEW_ATTRIBUTE] = preview
+    for item in items:
+        item.setdefault(CONVERSATION_PREVIEW_ATTRIBUTE, None)
+
+
+def conversations_etag(items, fields, limit, cursor):
+    """会話一覧のETag（件数・最新のupdatedAt・内容のダイジェストから生成）"""
+    latest = max((int(item['updatedAt']) for item in items), default=0)
+    digest = hashlib.sha1(json.dumps(
+        [fields, limit, cursor, items], cls=DecimalEncoder, sort_keys=True
+    ).encode('utf-8')).hexdigest()[:16]
+    return f'W/"{len(items)}-{latest}-{digest}"'
+
+
+def etag_matches(if_none_match, etag):
+    """If-None-MatchヘッダーがETagに一致するか判定（弱い比較）"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    weak = etag.removeprefix('W/')
+    return any(
+        tag.strip().removeprefix('W/') == weak for tag in if_none_match.split(',')
+    )
+
+
+def handle_get_messages(conversation_id, user_id, params):
+    """GET /conversations/{id}
+
+    既定では新しい順にページングする。since=<timestamp>を指定すると
+    それより新しいメッセージだけを古い順に返し、クライアントは差分のみ取得できる。
+    before=<timestamp>はそれより古いメッセージに絞る（さらに古い履歴の読み込み用）。
+    timestampはメッセージのソートキー（高分解能キーまたは移行前の秒単位のキー）で、
+    since/beforeには取得済みのメッセージのtimestampをそのまま渡す。
+    会話ヘッダーを使う場合、最新のページは会話ヘッダーと合わせて1回のQueryで読む。
+    """
+    try:
+        limit = int(params.get('limit', 50))
+        since = int(params['since']) if params.get('since') else None
+        before = int(params['before']) if params.get('before') else None
+    except ValueError:
+        return response(400, {'error': 'limit, since and before must be integers'})
+
+    # 差分取得は古い順、それ以外は新しい順
+    newest_first = since is None
+    cursor_scope = f"messages:{user_id}:{conversation_id}:{'desc' if newest_first else 'asc'}"
+    start_key = None
+    if params.get('lastEvaluatedKey'):
+        try:
+            (timestamp,) = decode_cursor(params['lastEvaluatedKey'], cursor_scope)
+        except (InvalidCursorError, ValueError):
+            return response(400, {'error': 'Invalid lastEvaluatedKey'})
+        start_key = {'conversationId': conversation_id, 'timestamp': timestamp}
+
+    conv = None
+    items = None
+    if (dynamodb_service.conversation_headers and since is None and before is None
+            and start_key is None):
+        conv, items, last_key = dynamodb_service.get_conversation_view(conversation_id, limit)
+
+    # 権限チェック（会話ヘッダーのない会話はConversationsテーブルで確認する）
+    if conv is None:
+        conv = dynamodb_service.get_conversation(user_id, conversation_id)
+    if conv is None or conv['userId'] != user_id:
+        return response(404, {'error': 'Conversation not found'})
+
+    if items is None:
+        items, last_key = dynamodb_service.query_messages_page(
+            conversation_id, limit, since=since, before=before,
+            newest_first=newest_first, exclusive_start_key=start_key
+        )
+    next_cursor = None
+    if last_key is not None:
+        next_cursor = encode_cursor([last_key['timestamp']], cursor_scope)
 
     return response(200, {
         'conversationId': conversation_id,
-        'messages': result['Items'],
-        'lastEvaluatedKey': result.get('LastEvaluatedKey')
+        'conversation': {attr: conv[attr] for attr in CONVERSATION_VIEW_ATTRIBUTES if attr in conv},
+        'messages': items,
+        'lastEvaluatedKey': next_cursor
     })
 
 
-def handle_delete_conversation(conversation_id, user_id):
+def handle_delete_conversation(conversation_id, user_id, context=None):
     """DELETE /conversations/{id}"""
-    # 権限チェック
-    conv = dynamodb_service.conversations_table.get_item(
-        Key={'userId': user_id, 'conversationId': conversation_id}
-    )
-    if 'Item' not in conv:
+    # 会話削除（一覧からは即座に消える）。キーにuserIdを含むため権限チェックを兼ねる
+    conv = dynamodb_service.delete_conversation(user_id, conversation_id)
+    if conv is None:
         return response(404, {'error': 'Conversation not found'})
+    history_cache.invalidate(conversation_id)
 
-    # 会話削除
-    dynamodb_service.conversations_table.delete_item(
-        Key={'userId': user_id, 'conversationId': conversation_id}
-    )
-
-    # メッセージ全削除
-    messages = dynamodb_service.get_conversation_history(conversation_id)
+    # メッセージ数が多い会話はワーカーLambdaでバックグラウンド削除する
+    if int(conv.get('messageCount', 0)) > ASYNC_DELETE_THRESHOLD:
+        return accept_message_deletion(conversation_id)
 
-    with dynamodb_service.messages_table.batch_writer() as batch:
-        for msg in messages:
-            batch.delete_item(
-                Key={'conversationId': conversation_id, 'timestamp': msg['timestamp']}
-            )
+    # Lambdaのタイムアウトに余裕を残して同期削除し、終わらなければワーカーに引き継ぐ
+    deadline = remaining_deadline(context, DELETE_TIME_MARGIN_SECONDS)
+    _, completed = dynamodb_service.delete_messages(conversation_id, deadline=deadline)
+    if not completed:
+        return accept_message_deletion(conversation_id)
 
     return response(200, {
         'message': 'Conversation deleted successfully',
@@ -184,13 +635,51 @@ def handle_delete_conversation(conversation_id, user_id):
     })
 
 
-def response(status_code, body):
+def accept_message_deletion(conversation_id):
+    """メッセージ削除をワーカーLambdaに依頼して202を返す"""
+    task_service.invoke_async('delete_messages', conversationId=conversation_id)
+    return response(202, {
+        'message': 'Conversation deletion accepted',
+        'conversationId': conversation_id
+    })
+
+
+def response(status_code, body, headers=None):
     """レスポンスヘルパー"""
+    with metrics.span('serialize'):
+        serialized = json.dumps(body, cls=DecimalEncoder)
+
     return {
         'statusCode': status_code,
         'headers': {
             'Content-Type': 'application/json',
+            'Access-Control-Allow-Origin': '*',
+            **(headers or {})
+        },
+        'body': serialized
+    }
+
+
+def not_modified(headers):
+    """304 Not Modified（本文なし）"""
+    return {
+        'statusCode': 304,
+        'headers': {
+            'Access-Control-Allow-Origin': '*',
+            **headers
+        },
+        'body': ''
+    }
+
+
+def sse_response(events):
+    """SSEレスポンスヘルパー"""
+    return {
+        'statusCode': 200,
+        'headers': {
+            'Content-Type': 'text/event-stream; charset=utf-8',
+            'Cache-Control': 'no-cache',
             'Access-Control-Allow-Origin': '*'
         },
-        'body': json.dumps(body, cls=DecimalEncoder)
+        'body': ''.join(events)
     }
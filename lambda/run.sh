@@ -0,0 +1,4 @@
+#!/bin/bash
+# Lambda Web Adapter（AWS_LAMBDA_EXEC_WRAPPER=/opt/bootstrap）から起動される
+# マネージドランタイムのboto3を使うため、ランタイムのディレクトリをPYTHONPATHに含める
+PYTHONPATH=$PYTHONPATH:/opt/python:$LAMBDA_RUNTIME_DIR exec python stream_server.py
@@ -0,0 +1,146 @@
+import math
+import os
+import random
+import threading
+import time
+
+from services import metrics
+
+
+# Bedrockのスロットリングとして扱うエラーコード（減速して再試行する）
+THROTTLING_ERROR_CODES = (
+    'ThrottlingException',
+    'TooManyRequestsException',
+    'ServiceUnavailableException',
+)
+
+
+class BedrockThrottledError(Exception):
+    """Bedrockの呼び出しを受け付けられなかった（429で応答する）"""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Bedrock is throttled, retry after {retry_after}s")
+        # クライアントに返すRetry-After（秒）
+        self.retry_after = retry_after
+
+
+class AdaptiveRateLimiter:
+    """Bedrock呼び出しのアドミッション制御
+
+    トークンバケットで1秒あたりの呼び出し数を、セマフォで同時呼び出し数を制限する。
+    呼び出し数の上限はAIMDで調整し、成功するたびに少しずつ上げ、
+    スロットリングを受けたら乗算的に下げる。
+    Lambdaのコンテナ内で共有し、バッチのファンアウトなど並行する呼び出しにも効かせる。
+    """
+
+    def __init__(self, rate=None, min_rate=None, max_rate=None, max_concurrency=None,
+                 max_wait_seconds=None, increase=None, decrease_factor=None):
+        self.rate = float(rate or os.environ.get('BEDROCK_RATE_LIMIT', 5))
+        self.min_rate = float(min_rate or os.environ.get('BEDROCK_MIN_RATE', 0.5))
+        self.max_rate = float(max_rate or os.environ.get('BEDROCK_MAX_RATE', 20))
+        self.max_concurrency = int(max_concurrency or os.environ.get('BEDROCK_MAX_CONCURRENCY', 8))
+        # 空きを待つ最大秒数（超えたら429で応答する）
+        self.max_wait_seconds = float(
+            max_wait_seconds or os.environ.get('BEDROCK_ADMISSION_MAX_WAIT', 3)
+        )
+        # 成功1回あたりの加算量と、スロットリング時の乗数
+        self.increase = float(increase or os.environ.get('BEDROCK_RATE_INCREASE', 0.2))
+        self.decrease_factor = float(
+            decrease_factor or os.environ.get('BEDROCK_RATE_DECREASE_FACTOR', 0.5)
+        )
+
+        self.tokens = self._capacity()
+        self.in_flight = 0
+        self.throttles = 0
+        self._updated = time.monotonic()
+        self._condition = threading.Condition()
+
+    def acquire(self, deadline=None):
+        """呼び出しの枠を確保（待てる時間内に確保できなければBedrockThrottledError）
+
+        deadline（time.monotonic基準）を指定すると、それを超えて待たない。
+        """
+        started = time.monotonic()
+        limit = started + self.max_wait_seconds
+        if deadline is not None:
+            limit = min(limit, deadline)
+
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                if self.in_flight < self.max_concurrency and self.tokens >= 1:
+                    self.tokens -= 1
+                    self.in_flight += 1
+                    break
+
+                if now >= limit:
+                    metrics.current().add('BedrockAdmissionRejected', 1)
+                    raise BedrockThrottledError(self._retry_after())
+                # トークン不足なら補充されるまで、同時呼び出し数の超過なら解放されるまで待つ
+                wait = limit - now
+                if self.tokens < 1:
+                    wait = min(wait, (1 - self.tokens) / self.rate)
+                self._condition.wait(wait)
+
+        metrics.current().add('BedrockAdmissionWait', (time.monotonic() - started) * 1000, 'Milliseconds')
+
+    def release(self, throttled=False, adjust=True):
+        """確保した枠を返し、呼び出し結果に応じて上限を調整
+
+        throttledは呼び出しが実際にスロットリングされたか（5xxや接続エラーはFalse）。
+        adjust=Falseの場合は枠を返すだけで上限は変えない（スロットリング以外のエラーや
+        フェイルオーバー先が残っている場合など）。BedrockThrottlesはadjustにかかわらず
+        スロットリングされた呼び出しだけを数える。
+        """
+        with self._condition:
+            self.in_flight -= 1
+            if not adjust:
+                pass
+            elif throttled:
+                self.throttles += 1
+                self.rate = max(self.min_rate, self.rate * self.decrease_factor)
+                # 溜まっていたトークンも捨て、直後の呼び出しが集中しないようにする
+                self.tokens = min(self.tokens, 0.0)
+            else:
+                self.rate = min(self.max_rate, self.rate + self.increase)
+            self._condition.notify_all()
+
+        if throttled:
+            metrics.current().add('BedrockThrottles', 1)
+
+    def backoff(self, attempt):
+        """再試行までの待ち時間（フルジッター付き指数バックオフ）"""
+        return random.uniform(0, min(4.0, 0.2 * 2 ** attempt))
+
+    def retry_after(self):
+        """クライアントに返すRetry-After（秒）"""
+        with self._condition:
+            self._refill(time.monotonic())
+            return self._retry_after()
+
+    def _retry_after(self):
+        return max(1, math.ceil((1 - min(self.tokens, 1.0)) / self.rate))
+
+    def _capacity(self):
+        # 1秒分の呼び出しまでバーストを許容する
+        return max(1.0, self.rate)
+
+    def _refill(self, now):
+        elapsed = now - self._updated
+        self._updated = now
+        self.tokens = min(self._capacity(), self.tokens + elapsed * self.rate)
+
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def shared_limiter():
+    """コンテナ内で共有するアドミッション制御"""
+    global _shared
+    if _shared is None:
+        with _shared_lock:
+            if _shared is None:
+                _shared = AdaptiveRateLimiter()
+    return _shared
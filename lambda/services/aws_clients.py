@@ -0,0 +1,104 @@
+import os
+import threading
+
+import boto3
+from botocore.config import Config
+
+from services import metrics
+
+
+# Lambdaのタイムアウト（秒）。読み取りタイムアウトがこれを超えないようにする
+LAMBDA_TIMEOUT_SECONDS = int(os.environ.get('LAMBDA_TIMEOUT_SECONDS', 30))
+
+# サービスごとの読み取りタイムアウト（秒）
+READ_TIMEOUTS = {
+    # 応答生成を待つため、Lambdaのタイムアウトから後処理分を差し引いた値
+    'bedrock-runtime': max(LAMBDA_TIMEOUT_SECONDS - 4, 5),
+    'dynamodb': 5,
+    'lambda': 5,
+}
+
+# サービスごとの再試行設定（既定はadaptiveモードで3回まで）
+RETRIES = {
+    # スロットリングはBedrockServiceのアドミッション制御で減速・再試行するため、
+    # botocoreでは再試行せずに呼び出し結果をそのまま返す
+    'bedrock-runtime': {'mode': 'standard', 'max_attempts': 1},
+}
+
+# Server-Timing / EMFで使うサービスごとの区間名の接頭辞
+METRIC_PREFIXES = {
+    'bedrock-runtime': 'bedrock',
+    'dynamodb': 'ddb',
+}
+
+_session = None
+_clients = {}
+_resources = {}
+_lock = threading.RLock()
+
+
+def get_session():
+    """全クライアントで共有するboto3セッション"""
+    global _session
+    if _session is None:
+        with _lock:
+            if _session is None:
+                _session = boto3.session.Session()
+    return _session
+
+
+def client_config(service_name):
+    """サービスごとのbotocore設定"""
+    return Config(
+        connect_timeout=2,
+        read_timeout=READ_TIMEOUTS.get(service_name, 10),
+        tcp_keepalive=True,
+        # ThreadPoolExecutorからの並列呼び出しに合わせたコネクションプール
+        max_pool_connections=int(os.environ.get('AWS_MAX_POOL_CONNECTIONS', 16)),
+        retries=RETRIES.get(service_name, {'mode': 'adaptive', 'max_attempts': 3}),
+    )
+
+
+def get_client(service_name, region_name=None):
+    """botocoreクライアントを取得（初回利用時に生成してコンテナ内で再利用）"""
+    key = (service_name, region_name)
+    client = _clients.get(key)
+    if client is None:
+        with _lock:
+            client = _clients.get(key)
+            if client is None:
+                client = get_session().client(
+                    service_name,
+                    region_name=region_name,
+                    config=client_config(service_name)
+                )
+                metrics.instrument_client(client, METRIC_PREFIXES.get(service_name, service_name))
+                _clients[key] = client
+    return client
+
+
+def get_resource(service_name, region_name=None):
+    """boto3リソースを取得（初回利用時に生成してコンテナ内で再利用）"""
+    key = (service_name, region_name)
+    resource = _resources.get(key)
+    if resource is None:
+        with _lock:
+            resource = _resources.get(key)
+            if resource is None:
+                resource = get_session().resource(
+                    service_name,
+                    region_name=region_name,
+                    config=client_config(service_name)
+                )
+                metrics.instrument_client(
+                    resource.meta.client, METRIC_PREFIXES.get(service_name, service_name)
+                )
+                _resources[key] = resource
+    return resource
+
+
+def should_prewarm():
+    """初期化フェーズで接続を事前確立するか（Lambda上でのみ既定で有効）"""
+    if os.environ.get('PREWARM_CONNECTIONS', 'true').lower() == 'false':
+        return False
+    return 'AWS_LAMBDA_FUNCTION_NAME' in os.environ
@@ -1,15 +1,96 @@
-import boto3
 import os
+import time
+from concurrent.futures import wait
+
+from botocore.exceptions import (
+    ClientError, ConnectionError as BotocoreConnectionError, ReadTimeoutError
+)
+
+from services import metrics
+from services.admission import (
+    shared_limiter, BedrockThrottledError, THROTTLING_ERROR_CODES
+)
+from services.aws_clients import get_client
+from services.context_builder import estimate_tokens, message_tokens
+from services.hedging import shared_hedge_policy, hedge_executor, first_successful
+from services.region_router import shared_router
+
+
+# 要約をシステムプロンプトとして渡す際の前置き
+SUMMARY_SYSTEM_PREFIX = "以下はこれまでの会話の要約です。この内容を踏まえて会話を続けてください。\n\n"
+
+# 会話の要約を更新する際の指示
+SUMMARIZE_INSTRUCTION = (
+    "以下の「これまでの要約」と「続きの会話」を統合し、"
+    "以降の応答に必要な事実・決定事項・ユーザーの意図や前提を漏らさず、"
+    "簡潔な要約として書き直してください。要約本文のみを出力してください。"
+)
+
+# モデルごとのプロンプトキャッシュ設定（モデルIDに含まれる文字列で判定）
+# minTokens: キャッシュポイントまでのプレフィックスに必要な最小トークン数
+PROMPT_CACHE_MODELS = {
+    "anthropic.claude-haiku-4-5": {"minTokens": 4096},
+    "anthropic.claude-sonnet-4": {"minTokens": 1024},
+    "anthropic.claude-opus-4": {"minTokens": 1024},
+    "anthropic.claude-3-7-sonnet": {"minTokens": 1024},
+    "anthropic.claude-3-5-haiku": {"minTokens": 2048},
+    "amazon.nova": {"minTokens": 1024},
+}
+
+CACHE_POINT = {"cachePoint": {"type": "default"}}
+
+# スロットリング・障害時の最大試行回数（フェイルオーバーを含む）
+MAX_ATTEMPTS = int(os.environ.get('BEDROCK_MAX_ATTEMPTS', 4))
+# スロットリング以外で別のリージョンへフェイルオーバーするエラーコード（5xx）
+FAILOVER_ERROR_CODES = (
+    'InternalServerException',
+    'ModelNotReadyException',
+)
 
 
 class BedrockService:
-    def __init__(self):
-        self.client = boto3.client("bedrock-runtime", region_name="us-east-1")
+    def __init__(self, client=None, limiter=None, router=None, hedge=None):
+        # clientはローカル検証時にスタブを差し込めるよう引数で受け取れる（全リージョンで共用）
+        self._client = client
+        # リージョンごとに差し込んだクライアント（ローカル検証用）
+        self.region_clients = {}
+        # 呼び出し数の制御とリージョンの選択はコンテナ内で共有する
+        self.limiter = limiter or shared_limiter()
+        self.router = router or shared_router()
+        self.hedge = hedge or shared_hedge_policy()
+        # 再試行を打ち切る時刻（time.monotonic基準）。リクエストごとにset_deadlineで設定する
+        self.deadline = None
         self.model_id = os.environ.get(
             'BEDROCK_MODEL_ID',
             'us.anthropic.claude-haiku-4-5-20251001-v1:0'
         )
-    
+        self.inference_config = {
+            "maxTokens": 2048,
+            "temperature": 1.0
+        }
+        self.prompt_cache = self._prompt_cache_config(self.model_id)
+
+    @property
+    def client(self):
+        """優先リージョンのクライアント"""
+        return self.client_for(self.router.regions[0])
+
+    @client.setter
+    def client(self, client):
+        self._client = client
+
+    def client_for(self, region):
+        """リージョンのクライアント（Bedrockを使わないルートでは生成しないよう、初回利用時に生成する）"""
+        if region in self.region_clients:
+            return self.region_clients[region]
+        if self._client is not None:
+            return self._client
+        return get_client("bedrock-runtime", region_name=region)
+
+    def set_deadline(self, deadline):
+        """このリクエストでBedrockの呼び出しを待てる期限を設定（Noneで無制限）"""
+        self.deadline = deadline
+
     def generate_response(self, user_message):
         """単一メッセージからAI応答を生成"""
         messages = [
@@ -19,35 +100,326 @@ class BedrockService:
             }
         ]
         
-        response = self.client.converse(
+        response = self._converse(
             modelId=self.model_id,
             messages=messages,
-            inferenceConfig={
-                "maxTokens": 2048,
-                "temperature": 1.0
-            }
+            inferenceConfig=self.inference_config
         )
         
         return response["output"]["message"]["content"][0]["text"]
     
     def generate_response_with_history(self, history):
         """会話履歴からAI応答を生成"""
-        # DynamoDB形式をBedrock形式に変換
-        messages = [
+        return self.converse_with_history(history)["text"]
+
+    def converse_with_history(self, history, summary=None, max_tokens=None):
+        """会話履歴からAI応答を生成し、応答テキストとusage・metricsを返す
+
+        max_tokensで出力トークン数の上限を上書きできる（非同期ジョブ用）。
+        ヘッジが有効な場合、応答が遅ければ2本目の呼び出しを出して先に返った方を使う。
+        """
+        kwargs = self._converse_kwargs(history, summary, max_tokens)
+        if self.hedge.enabled:
+            response, region = self._hedged_converse(kwargs)
+        else:
+            response, region = self._converse_with_region(**kwargs)
+
+        return {
+            "text": response["output"]["message"]["content"][0]["text"],
+            "usage": response.get("usage", {}),
+            "metrics": response.get("metrics", {}),
+            "region": region,
+        }
+
+    def generate_response_stream(self, history, metadata=None, summary=None):
+        """会話履歴からAI応答をストリーミング生成（テキスト断片を順にyield）
+
+        metadataにdictを渡すと、ストリーム終端のusage等と呼び出したリージョンが格納される。
+        ヘッジが有効な場合、最初のトークンが遅ければ2本目のストリームを開き、
+        先に最初のトークンを返した方を最後まで読む。
+        """
+        kwargs = self._converse_kwargs(history, summary)
+        if not self.hedge.enabled:
+            yield from self._stream_texts(kwargs, metadata)
+            return
+
+        chunks, stream_metadata = self._hedged_stream(kwargs)
+        yield from chunks
+        if metadata is not None:
+            metadata.update(stream_metadata)
+
+    def _stream_texts(self, kwargs, metadata=None, avoid=()):
+        """converse_streamを呼び出してテキスト断片をyield（枠はストリームを読み終えるまで確保する）"""
+        response, region = self._admitted_call("converse_stream", kwargs, avoid)
+        if metadata is not None:
+            metadata["region"] = region
+
+        throttled = False
+        try:
+            for event in response["stream"]:
+                if "contentBlockDelta" in event:
+                    text = event["contentBlockDelta"]["delta"].get("text")
+                    if text:
+                        yield text
+                elif "metadata" in event:
+                    if metadata is not None:
+                        metadata.update(event["metadata"])
+                elif "messageStop" in event:
+                    continue
+                else:
+                    # ストリーム中の例外イベント（throttlingException等）
+                    for key in event:
+                        if key == "throttlingException":
+                            # 出力済みの断片があるため再試行はしない
+                            throttled = True
+                            raise BedrockThrottledError(self.limiter.retry_after())
+                        if key.endswith("Exception"):
+                            raise RuntimeError(
+                                f"Bedrock stream error: {key}: {event[key].get('message')}"
+                            )
+        finally:
+            # 途中で閉じられた場合（ヘッジで負けた場合など）もHTTPのストリームを閉じる
+            close = getattr(response["stream"], "close", None)
+            if close is not None:
+                close()
+            self.limiter.release(throttled=throttled)
+
+    def summarize(self, previous_summary, messages):
+        """既存の要約に続きの会話を畳み込んだ新しい要約を生成"""
+        transcript = "\n".join(
+            f"{'ユーザー' if msg['role'] == 'user' else 'アシスタント'}: {msg['content']}"
+            for msg in messages
+        )
+        prompt = (
+            f"{SUMMARIZE_INSTRUCTION}\n\n"
+            f"## これまでの要約\n{previous_summary or '（なし）'}\n\n"
+            f"## 続きの会話\n{transcript}"
+        )
+
+        response = self._converse(
+            modelId=self.model_id,
+            messages=[{"role": "user", "content": [{"text": prompt}]}],
+            inferenceConfig={
+                "maxTokens": 1024,
+                "temperature": 0.0
+            }
+        )
+
+        return response["output"]["message"]["content"][0]["text"]
+
+    def _converse(self, **kwargs):
+        """アドミッション制御と再試行を経てconverseを呼び出す"""
+        return self._converse_with_region(**kwargs)[0]
+
+    def _converse_with_region(self, avoid=(), **kwargs):
+        """converseを呼び出し、(応答, 呼び出したリージョン)を返す（avoidのリージョンは後回しにする）"""
+        response, region = self._admitted_call("converse", kwargs, avoid)
+        self.limiter.release()
+        return response, region
+
+    def _hedged_converse(self, kwargs):
+        """応答が遅延の分位点を過ぎたらヘッジを出し、先に成功した応答を返す"""
+        self.hedge.start_request()
+        executor = hedge_executor()
+        # 1本目とは別のリージョンにヘッジを出す（リージョンが1つなら同じリージョン）
+        avoid = self.router.ranked()[:1]
+
+        started = time.perf_counter()
+        primary = executor.submit(self._converse_with_region, **kwargs)
+        primary.add_done_callback(lambda _: self.hedge.record_latency(
+            "converse", (time.perf_counter() - started) * 1000
+        ))
+        done, _ = wait([primary], timeout=self.hedge.delay_seconds("converse"))
+        if done or not self.hedge.try_hedge():
+            return primary.result()
+
+        metrics.current().add("BedrockHedges", 1)
+        secondary = executor.submit(self._converse_with_region, avoid=avoid, **self._hedge_kwargs(kwargs))
+        # 負けた方の呼び出しは中断できないため、結果を捨てる
+        winner = first_successful([primary, secondary])
+        if winner is secondary:
+            self.hedge.record_win()
+            metrics.current().add("BedrockHedgeWins", 1)
+        return winner.result()
+
+    def _hedged_stream(self, kwargs):
+        """最初のトークンが遅延の分位点を過ぎたらヘッジのストリームを開き、先に最初のトークンを返した方を使う
+
+        (テキスト断片のイテレーター, ストリームのmetadata) を返す。metadataは読み終えた後に確定する。
+        """
+        self.hedge.start_request()
+        executor = hedge_executor()
+        avoid = self.router.ranked()[:1]
+
+        started = time.perf_counter()
+        candidates = [{"metadata": {}}]
+        candidates[0]["stream"] = self._stream_texts(kwargs, candidates[0]["metadata"])
+        candidates[0]["first"] = executor.submit(next, candidates[0]["stream"], None)
+        candidates[0]["first"].add_done_callback(lambda _: self.hedge.record_latency(
+            "stream", (time.perf_counter() - started) * 1000
+        ))
+
+        done, _ = wait([candidates[0]["first"]], timeout=self.hedge.delay_seconds("stream"))
+        if not done and self.hedge.try_hedge():
+            metrics.current().add("BedrockHedges", 1)
+            hedge = {"metadata": {}}
+            hedge["stream"] = self._stream_texts(self._hedge_kwargs(kwargs), hedge["metadata"], avoid)
+            hedge["first"] = executor.submit(next, hedge["stream"], None)
+            candidates.append(hedge)
+
+        winner_future = first_successful([candidate["first"] for candidate in candidates])
+        winner = next(c for c in candidates if c["first"] is winner_future)
+        if winner is not candidates[0]:
+            self.hedge.record_win()
+            metrics.current().add("BedrockHedgeWins", 1)
+        # 負けたストリームは最初のトークンを待ち終えた後に閉じ、呼び出しの枠を返す
+        for candidate in candidates:
+            if candidate is not winner:
+                candidate["first"].add_done_callback(
+                    lambda _, stream=candidate["stream"]: stream.close()
+                )
+
+        def chunks():
+            first = winner_future.result()
+            if first is None:
+                return
+            yield first
+            yield from winner["stream"]
+
+        return chunks(), winner["metadata"]
+
+    def _hedge_kwargs(self, kwargs):
+        """ヘッジ用のリクエストパラメータ（ヘッジ用のモデルが指定されていれば差し替える）"""
+        if not self.hedge.model_id or self.hedge.model_id == kwargs["modelId"]:
+            return kwargs
+        hedge_kwargs = {**kwargs, "modelId": self.hedge.model_id}
+        # キャッシュポイントはモデルごとの最小トークン数に合わせて置いているため外す
+        hedge_kwargs["messages"] = [
+            {**msg, "content": [block for block in msg["content"] if block != CACHE_POINT]}
+            for msg in kwargs["messages"]
+        ]
+        if "system" in kwargs:
+            hedge_kwargs["system"] = [block for block in kwargs["system"] if block != CACHE_POINT]
+        return hedge_kwargs
+
+    def _admitted_call(self, operation, kwargs, avoid=()):
+        """呼び出しの枠を確保し、最も状態のよいリージョンでBedrockを呼び出す
+
+        スロットリング・5xx・接続エラー・読み取りタイムアウトの場合は、まだ試していないリージョンへ待たずに
+        フェイルオーバーする。全リージョンで失敗した場合は上限を下げ、
+        ジッター付きバックオフで再試行する。試行回数か期限を使い切った場合、
+        スロットリングならBedrockThrottledErrorを、それ以外は最後のエラーを送出する。
+        成功時は枠を確保したまま (応答, リージョン) を返すため、呼び出し側でlimiter.releaseすること。
+        avoidのリージョンは、ほかに候補がある限り使わない（ヘッジ用）。
+        """
+        attempt = 0
+        # このリクエストで失敗したリージョン（と避けるリージョン）
+        failed = set(avoid)
+        while True:
+            ranked = self.router.ranked()
+            region = next((r for r in ranked if r not in failed), ranked[0])
+
+            self.limiter.acquire(self.deadline)
+            started = time.perf_counter()
+            try:
+                response = getattr(self.client_for(region), operation)(**kwargs)
+            except ClientError as e:
+                code = e.response.get("Error", {}).get("Code")
+                if code not in THROTTLING_ERROR_CODES and code not in FAILOVER_ERROR_CODES:
+                    self.limiter.release(adjust=False)
+                    raise
+                error, throttled = e, code in THROTTLING_ERROR_CODES
+            except (BotocoreConnectionError, ReadTimeoutError) as e:
+                # 応答が返らないリージョンもスロットリングではない障害として扱う
+                error, throttled = e, False
+            except BaseException:
+                self.limiter.release(adjust=False)
+                raise
+            else:
+                self.router.record_success(region, (time.perf_counter() - started) * 1000)
+                metrics.current().set_property("BedrockRegion", region)
+                return response, region
+
+            self.router.record_failure(region)
+            failed.add(region)
+            attempt += 1
+            # まだ試していないリージョンがあれば待たずに切り替える
+            failover = len(failed) < len(self.router.regions)
+            # 減速するのは全リージョンでスロットリングされた場合のみ
+            self.limiter.release(throttled=throttled, adjust=throttled and not failover)
+
+            if attempt >= MAX_ATTEMPTS:
+                self._raise_exhausted(error, throttled)
+            if failover:
+                metrics.current().add("BedrockFailovers", 1)
+                continue
+
+            failed.clear()
+            delay = self.limiter.backoff(attempt)
+            if self.deadline is not None and time.monotonic() + delay >= self.deadline:
+                self._raise_exhausted(error, throttled)
+            time.sleep(delay)
+
+    def _raise_exhausted(self, error, throttled):
+        """再試行を使い切ったときの例外を送出"""
+        if throttled:
+            raise BedrockThrottledError(self.limiter.retry_after())
+        raise error
+
+    def _converse_kwargs(self, history, summary=None, max_tokens=None):
+        """converse / converse_stream 共通のリクエストパラメータを組み立て"""
+        inference_config = self.inference_config
+        if max_tokens is not None:
+            inference_config = {**inference_config, "maxTokens": max_tokens}
+        kwargs = {
+            "modelId": self.model_id,
+            "messages": self._to_bedrock_messages(history),
+            "inferenceConfig": inference_config
+        }
+        if summary:
+            kwargs["system"] = [{"text": SUMMARY_SYSTEM_PREFIX + summary}]
+
+        if self.prompt_cache:
+            self._add_cache_points(kwargs, history, summary)
+        return kwargs
+
+    def _add_cache_points(self, kwargs, history, summary):
+        """ターンをまたいで変わらないプレフィックスの末尾にキャッシュポイントを置く
+
+        - システムプロンプト（要約）の末尾
+        - 今回のユーザーメッセージ直前（前ターンの応答）の末尾
+        プレフィックスが最小トークン数に満たない位置には置かない。
+        """
+        min_tokens = self.prompt_cache["minTokens"]
+        prefix_tokens = 0
+
+        if summary:
+            prefix_tokens += estimate_tokens(summary)
+            if prefix_tokens >= min_tokens:
+                kwargs["system"].append(CACHE_POINT)
+
+        if len(history) < 2:
+            return
+        prefix_tokens += sum(message_tokens(msg) for msg in history[:-1])
+        if prefix_tokens >= min_tokens:
+            kwargs["messages"][-2]["content"].append(CACHE_POINT)
+
+    @staticmethod
+    def _prompt_cache_config(model_id):
+        """モデルIDに対応するプロンプトキャッシュ設定（非対応・無効ならNone）"""
+        if os.environ.get('BEDROCK_PROMPT_CACHE', 'auto').lower() == 'off':
+            return None
+        for key, config in PROMPT_CACHE_MODELS.items():
+            if key in model_id:
+                return config
+        return None
+
+    def _to_bedrock_messages(self, history):
+        """DynamoDB形式をBedrock形式に変換"""
+        return [
             {
                 "role": msg['role'],
                 "content": [{"text": msg['content']}]
             }
             for msg in history
         ]
-        
-        response = self.client.converse(
-            modelId=self.model_id,
-            messages=messages,
-            inferenceConfig={
-                "maxTokens": 2048,
-                "temperature": 1.0
-            }
-        )
-        
-        return response["output"]["message"]["content"][0]["text"]
@@ -0,0 +1,82 @@
+import json
+import time
+
+from services import metrics
+from services.admission import BedrockThrottledError
+
+
+def open_chat_stream(chat_turns, bedrock_service, user_id, turn):
+    """チャットの応答をSSEイベント文字列のジェネレーターとして開く
+
+    最初のテキスト断片が届くまでここで待つため、それまでのスロットリングやエラーは
+    レスポンスヘッダーを送る前に例外として送出され、呼び出し側は429/500を返せる
+    （ユーザーメッセージは取り消し済み）。
+    返すジェネレーターを途中で閉じると（クライアントの切断）、Bedrockのストリームを閉じて
+    生成を止め、ターンを取り消す。
+    """
+    started = time.perf_counter()
+    metadata = {}
+    stream = bedrock_service.generate_response_stream(
+        turn['history'], metadata, summary=turn['summary']
+    )
+    try:
+        first_text = next(stream, None)
+    except Exception:
+        chat_turns.discard(user_id, turn)
+        raise
+
+    first_token_ms = int((time.perf_counter() - started) * 1000)
+    metrics.current().add('TimeToFirstToken', first_token_ms, 'Milliseconds')
+
+    return _chat_events(
+        chat_turns, user_id, turn, stream, first_text, metadata, started, first_token_ms
+    )
+
+
+def _chat_events(chat_turns, user_id, turn, stream, first_text, metadata, started,
+                 first_token_ms):
+    """最初の断片を受け取った後のSSEイベントを順にyieldし、応答を保存する"""
+    try:
+        yield sse_event('start', {'conversationId': turn['conversationId']})
+
+        chunks = []
+        if first_text is not None:
+            chunks.append(first_text)
+            yield sse_event('delta', {'text': first_text})
+        for text in stream:
+            chunks.append(text)
+            yield sse_event('delta', {'text': text})
+        metrics.current().record_timing('generate', (time.perf_counter() - started) * 1000)
+        metrics.record_bedrock(metadata.get('usage'), metadata.get('metrics'))
+
+        # 組み立てた応答を最後に保存
+        with metrics.span('persist'):
+            ai_timestamp = chat_turns.finish(user_id, turn, ai_response=''.join(chunks),
+                                             usage=metadata.get('usage'))
+    except GeneratorExit:
+        # クライアントが切断した場合は生成を止め、応答のないターンを残さない
+        stream.close()
+        chat_turns.discard(user_id, turn)
+        raise
+    except BedrockThrottledError as e:
+        # 出力済みの断片があるため、ステータスコードではなくイベントで伝える
+        print(f"Stream throttled: {str(e)}")
+        chat_turns.discard(user_id, turn)
+        yield sse_event('error', {'error': 'Too many requests', 'retryAfter': e.retry_after})
+        return
+    except Exception as e:
+        print(f"Stream error: {str(e)}")
+        chat_turns.discard(user_id, turn)
+        yield sse_event('error', {'error': 'Internal server error'})
+        return
+
+    yield sse_event('done', {
+        'conversationId': turn['conversationId'],
+        'timestamp': ai_timestamp,
+        'timeToFirstTokenMs': first_token_ms
+    })
+
+
+def sse_event(event, data):
+    """SSE形式のイベント文字列を生成"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
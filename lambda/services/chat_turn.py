@@ -0,0 +1,221 @@
+import os
+import uuid
+
+from services import metrics
+from services.context_builder import build_context, estimate_tokens, DEFAULT_TOKEN_BUDGET
+from services.message_key import new_message_key, key_to_epoch_seconds
+
+
+# プロンプトに含める直近メッセージ数（それより古いものは要約で補う）
+RECENT_MESSAGE_LIMIT = int(os.environ.get('RECENT_MESSAGE_LIMIT', 20))
+# 要約の更新を依頼する未要約メッセージ数（直近分を除く）
+SUMMARY_THRESHOLD = int(os.environ.get('SUMMARY_THRESHOLD', 20))
+# 要約済み以降のメッセージとして読み込む最大件数
+# 要約が進むまでプロンプトの先頭を固定し、プロンプトキャッシュを効かせるため
+# 直近分だけでなく要約待ちの分も含めて読み込む
+HISTORY_FETCH_LIMIT = RECENT_MESSAGE_LIMIT + 2 * SUMMARY_THRESHOLD
+
+
+class ChatTurnService:
+    """1回分のチャット（ユーザーメッセージの保存・履歴の組み立て・応答の保存）の手順
+
+    POST /chat（同期・ストリーミング）と非同期ジョブのワーカーで共有する。
+    依存するサービスは各エントリポイントのモジュールレベルのインスタンスを受け取る。
+    """
+
+    def __init__(self, dynamodb_service, history_cache, task_service, executor):
+        self.dynamodb_service = dynamodb_service
+        # ウォームコンテナ間で再利用する会話履歴キャッシュ
+        self.history_cache = history_cache
+        # 要約の更新の依頼先
+        self.task_service = task_service
+        # DynamoDBへの書き込みをBedrock呼び出しと並行して行うためのスレッドプール
+        self.executor = executor
+
+    def start(self, user_id, conversation_id, message):
+        """会話を準備し、Bedrockへ送る要約と直近の履歴を返す
+
+        ユーザーメッセージの書き込みはBedrock呼び出しと並行して行い、
+        finishで完了を待つ。既存の会話が見つからない場合はNoneを返す。
+        """
+        turn = {
+            'conversationId': conversation_id,
+            'summary': None,
+            'messageCount': 0,
+            'summarizedCount': 0,
+        }
+
+        # 新規会話の場合
+        if not conversation_id:
+            conversation_id = str(uuid.uuid4())
+            timestamp = new_message_key()
+            title = message[:50] + '...' if len(message) > 50 else message
+            user_item = self.dynamodb_service.build_message_item(
+                conversation_id, 'user', message, timestamp
+            )
+
+            # 会話作成と最初のメッセージを1トランザクションで書き込む
+            turn['pendingWrite'] = self.executor.submit(
+                self.dynamodb_service.create_conversation_with_message,
+                user_id, conversation_id, title, user_item
+            )
+            turn['conversationId'] = conversation_id
+            turn['isNew'] = True
+            turn['userItem'] = user_item
+            turn['recent'] = []
+            history = [user_item]
+        else:
+            # 権限チェックを兼ねて会話を取得し、キャッシュ済みの履歴を検証する
+            conv, recent = self.load_recent_messages(user_id, conversation_id)
+            if conv is None:
+                return None
+
+            turn['summary'] = conv.get('summary')
+            turn['messageCount'] = int(conv.get('messageCount', 0))
+            turn['summarizedCount'] = int(conv.get('summarizedCount', 0))
+            turn['recent'] = recent
+
+            # 要約済みのメッセージは除外する
+            recent = unsummarized_messages(conv, recent)
+
+            timestamp = new_message_key()
+            user_item = self.dynamodb_service.build_message_item(
+                conversation_id, 'user', message, timestamp
+            )
+            turn['pendingWrite'] = self.executor.submit(self.dynamodb_service.put_message, user_item)
+            turn['userItem'] = user_item
+
+            # 履歴は再読み込みせず、取得済みの履歴と今回のメッセージから組み立てる
+            history = recent + [user_item]
+
+        turn['history'] = budget_history(history, turn['summary'])
+
+        return turn
+
+    def finish(self, user_id, turn, ai_response, usage=None, request_summary=True):
+        """AI応答を保存して会話メタデータを更新
+
+        request_summary=Falseの場合は要約の更新を依頼しない（呼び出し側で行う）。
+        """
+        conversation_id = turn['conversationId']
+
+        # ユーザーメッセージの書き込み完了を待つ（失敗時は例外を送出）
+        turn['pendingWrite'].result()
+
+        # AI応答の保存（出力トークン数を記録）とメタデータ更新を1トランザクションで行う
+        # ソートキーは同一秒のユーザーメッセージと衝突しない高分解能キー、更新日時は秒単位
+        ai_timestamp = new_message_key()
+        updated_at = key_to_epoch_seconds(ai_timestamp)
+        ai_item = self.dynamodb_service.build_message_item(
+            conversation_id, 'assistant', ai_response, ai_timestamp,
+            token_count=(usage or {}).get('outputTokens')
+        )
+        self.dynamodb_service.save_message_and_update_metadata(user_id, ai_item, updated_at)
+        # 応答を保存した後はターンを取り消さない
+        turn['saved'] = True
+        # キーが衝突して書き直した場合は新しいキーになっている
+        ai_timestamp = ai_item['timestamp']
+
+        # 次のターンで再読み込みしないよう、直近メッセージをキャッシュしておく
+        self.history_cache.put(
+            conversation_id,
+            (turn['recent'] + [turn['userItem'], ai_item])[-(HISTORY_FETCH_LIMIT - 1):],
+            message_count=turn['messageCount'] + 2,
+            updated_at=updated_at
+        )
+
+        if request_summary:
+            self.request_summary_if_needed(
+                user_id, conversation_id, turn['messageCount'] + 2, turn['summarizedCount']
+            )
+
+        return ai_timestamp
+
+    def discard(self, user_id, turn):
+        """応答を保存できなかったターンのユーザーメッセージ（新規会話なら会話も）を取り消す
+
+        POST /chat（同期・ストリーミング）と非同期ジョブのどの経路でも、失敗の種類によらず
+        呼び出す。応答のないメッセージが会話に残らず、429を受けたクライアントが再送しても
+        同じメッセージが重複しないようにする。応答を保存済みか取り消し済みのターンには何もしない。
+        取り消しの失敗は記録のみ行い、呼び出し側の本来のエラーを優先する。
+        """
+        if turn is None or turn.get('saved') or turn.get('discarded'):
+            return
+        turn['discarded'] = True
+        try:
+            turn['pendingWrite'].result()
+            self.dynamodb_service.delete_message(
+                turn['conversationId'], turn['userItem']['timestamp']
+            )
+            if turn.get('isNew'):
+                self.dynamodb_service.delete_conversation(user_id, turn['conversationId'])
+        except Exception as e:
+            # ユーザーメッセージの書き込み自体が失敗した場合など
+            print(f"Rollback of turn in {turn['conversationId']} failed: {str(e)}")
+
+    def load_recent_messages(self, user_id, conversation_id):
+        """会話メタデータと直近メッセージ（古い順）を取得
+
+        ウォームコンテナのキャッシュが最新ならメッセージは読まず、
+        古ければ直近の範囲を読み直す。会話が見つからない場合は (None, None)。
+        """
+        limit = HISTORY_FETCH_LIMIT - 1
+        entry = self.history_cache.get(conversation_id)
+
+        if entry is None:
+            metrics.current().add('HistoryCacheMiss', 1)
+            # キャッシュなし: 会話取得と直近メッセージ取得を並行して行う
+            recent_future = self.executor.submit(
+                self.dynamodb_service.get_recent_messages, conversation_id, limit
+            )
+            conv = self.dynamodb_service.get_conversation(user_id, conversation_id)
+            recent = recent_future.result()
+            if conv is None:
+                return None, None
+            return conv, recent
+
+        conv = self.dynamodb_service.get_conversation(user_id, conversation_id)
+        if conv is None:
+            self.history_cache.invalidate(conversation_id)
+            return None, None
+
+        cached = entry['messages']
+        message_count = int(conv.get('messageCount', 0))
+        if self.history_cache.validate(entry, message_count, conv.get('updatedAt')):
+            metrics.current().add('HistoryCacheHit', 1)
+            return conv, cached
+        metrics.current().add('HistoryCacheStale', 1)
+
+        # 他のコンテナで更新されている場合は直近の範囲を読み直す。キーはコンテナごとに発行するため、
+        # 同時に書かれた他のコンテナのメッセージがキャッシュの最新より小さいキーを持つことがあり、
+        # キャッシュの最新以降の差分だけでは取りこぼす
+        return conv, self.dynamodb_service.get_recent_messages(conversation_id, limit)
+
+    def request_summary_if_needed(self, user_id, conversation_id, message_count,
+                                  summarized_count):
+        """未要約のメッセージが閾値を超えたら、要約の更新をバックグラウンドに依頼"""
+        if summary_needed(message_count, summarized_count):
+            self.task_service.invoke_async(
+                'summarize', userId=user_id, conversationId=conversation_id
+            )
+
+
+def budget_history(history, summary):
+    """要約の分を差し引いたトークン予算内に履歴を絞る"""
+    token_budget = DEFAULT_TOKEN_BUDGET
+    if summary:
+        token_budget -= estimate_tokens(summary)
+    return build_context(history, token_budget)
+
+
+def unsummarized_messages(conv, messages):
+    """要約に含まれていないメッセージのみを返す"""
+    summary_until = conv.get('summaryUntil')
+    if summary_until is None:
+        return messages
+    return [msg for msg in messages if msg['timestamp'] > summary_until]
+
+
+def summary_needed(message_count, summarized_count):
+    """未要約のメッセージが要約の更新を依頼する閾値に達したか"""
+    return message_count - summarized_count >= RECENT_MESSAGE_LIMIT + SUMMARY_THRESHOLD
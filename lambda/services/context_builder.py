@@ -0,0 +1,54 @@
+import math
+import os
+
+
+# Bedrockへ送る会話履歴の入力トークン上限
+DEFAULT_TOKEN_BUDGET = int(os.environ.get('CONTEXT_TOKEN_BUDGET', 16000))
+# メッセージ1件あたりのロール・区切り等のオーバーヘッド
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def estimate_tokens(text):
+    """トークン数をローカルで概算（ASCIIは約4文字で1トークン、日本語等は1文字1トークン）"""
+    ascii_chars = sum(1 for c in text if ord(c) < 128)
+    return math.ceil(ascii_chars / 4) + (len(text) - ascii_chars)
+
+
+def message_tokens(msg):
+    """メッセージのトークン数（Bedrockのusageから記録済みの値を優先）"""
+    if msg.get('tokenCount') is not None:
+        return int(msg['tokenCount']) + MESSAGE_OVERHEAD_TOKENS
+    return estimate_tokens(msg['content']) + MESSAGE_OVERHEAD_TOKENS
+
+
+def build_context(history, token_budget=None):
+    """トークン予算内に収まる直近の会話を選択（古い順で返す）
+
+    最新のユーザーメッセージは予算を超えても必ず含め、
+    先頭がuserでuser/assistantが交互になるよう調整する。
+    """
+    if token_budget is None:
+        token_budget = DEFAULT_TOKEN_BUDGET
+
+    selected = []
+    used = 0
+    expected_role = 'user'
+    for msg in reversed(history):
+        # 保存途中の失敗などで同じロールが連続している場合は古い方を捨てる
+        if msg['role'] != expected_role:
+            continue
+
+        tokens = message_tokens(msg)
+        if selected and used + tokens > token_budget:
+            break
+
+        selected.append(msg)
+        used += tokens
+        expected_role = 'assistant' if expected_role == 'user' else 'user'
+
+    # 先頭はuserでなければならない
+    if selected and selected[-1]['role'] == 'assistant':
+        selected.pop()
+
+    selected.reverse()
+    return selected
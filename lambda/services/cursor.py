@@ -0,0 +1,89 @@
+import base64
+import hashlib
+import hmac
+import json
+import os
+from decimal import Decimal
+
+from services.aws_clients import get_client
+
+
+def load_secret():
+    """署名に使う鍵を初期化時に1回だけ取得
+
+    デプロイ環境ではCURSOR_SECRET_ARNのSecrets Managerのシークレットから読む
+    （鍵を環境変数に平文で置かない）。CURSOR_SECRETはローカルでの実行・ベンチマーク用。
+    どちらも未設定の場合はコンテナごとに鍵が変わり、別のコンテナで発行したカーソルを
+    検証できなくなるため、起動時にエラーにする。
+    """
+    secret_arn = os.environ.get('CURSOR_SECRET_ARN')
+    if secret_arn:
+        response = get_client('secretsmanager').get_secret_value(SecretId=secret_arn)
+        return response['SecretString'].encode('utf-8')
+    if os.environ.get('CURSOR_SECRET'):
+        return os.environ['CURSOR_SECRET'].encode('utf-8')
+    raise RuntimeError('CURSOR_SECRET_ARN (or CURSOR_SECRET for local runs) must be set')
+
+
+# 署名に使う鍵（全コンテナで同じ鍵を使い、どのコンテナで発行したカーソルも検証できるようにする）
+CURSOR_SECRET = load_secret()
+# 署名の長さ（バイト）。改ざん検出には十分で、クエリ文字列を短く保てる
+SIGNATURE_BYTES = 12
+
+
+class InvalidCursorError(ValueError):
+    """カーソルの形式不正・改ざん・用途違い"""
+
+
+def encode_cursor(values, scope):
+    """ページング位置を署名付きの不透明なカーソル文字列に変換
+
+    valuesはキーのうちパスやユーザーから復元できない値のリスト。
+    scopeには用途（ユーザー・会話・取得方向など）を渡し、別のクエリへの流用を防ぐ。
+    """
+    payload = json.dumps(
+        [_to_json_value(v) for v in values], separators=(',', ':'), ensure_ascii=False
+    ).encode('utf-8')
+    return f"{_b64encode(payload)}.{_b64encode(_sign(payload, scope))}"
+
+
+def decode_cursor(cursor, scope):
+    """カーソル文字列を検証して値のリストに戻す"""
+    try:
+        encoded_payload, encoded_signature = cursor.split('.')
+        payload = _b64decode(encoded_payload)
+        signature = _b64decode(encoded_signature)
+    except ValueError:
+        raise InvalidCursorError('Malformed cursor')
+
+    if not hmac.compare_digest(signature, _sign(payload, scope)):
+        raise InvalidCursorError('Cursor signature mismatch')
+
+    values = json.loads(payload, parse_float=Decimal)
+    if not isinstance(values, list):
+        raise InvalidCursorError('Malformed cursor')
+    return values
+
+
+def _sign(payload, scope):
+    return hmac.new(
+        CURSOR_SECRET, scope.encode('utf-8') + b'\0' + payload, hashlib.sha256
+    ).digest()[:SIGNATURE_BYTES]
+
+
+def _to_json_value(value):
+    """DynamoDBのDecimalをJSONの数値に変換"""
+    if isinstance(value, Decimal):
+        return int(value) if value % 1 == 0 else float(value)
+    return value
+
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+
+def _b64decode(text):
+    try:
+        return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+    except (ValueError, TypeError):
+        raise ValueError('Invalid base64')
@@ -1,17 +1,93 @@
-import boto3
 import uuid
 import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from services.aws_clients import get_resource
+from services.message_codec import MessageCodec, ENCODED_CONTENT_ATTRIBUTES
+from services.message_key import new_message_key, key_to_epoch_seconds
+
+
+# BatchWriteItemの1リクエストあたりの上限件数
+BATCH_WRITE_LIMIT = 25
+# UnprocessedItemsの再試行回数
+BATCH_WRITE_MAX_RETRIES = 8
+# メッセージのソートキーが既存のメッセージと衝突した場合に、新しいキーで書き直す回数
+MESSAGE_KEY_MAX_ATTEMPTS = 3
+# メッセージを上書きしないための条件（同じキーのアイテムがあれば書き込みを失敗させる）
+NEW_MESSAGE_CONDITION = {
+    'ConditionExpression': 'attribute_not_exists(#ts)',
+    'ExpressionAttributeNames': {'#ts': 'timestamp'},
+}
+# 会話履歴として読み込む属性（messageId等の未使用属性は読まない）
+HISTORY_ATTRIBUTES = (
+    'conversationId', 'timestamp', 'role', 'content', 'tokenCount', *ENCODED_CONTENT_ATTRIBUTES
+)
+# 会話一覧の取得に使うGSI
+CONVERSATIONS_INDEX_NAME = 'userId-updatedAt-index'
+# 会話一覧で返す属性（GSIをINCLUDE射影にする場合もこの属性を射影する）
+CONVERSATION_LIST_ATTRIBUTES = (
+    'userId', 'conversationId', 'title', 'createdAt', 'updatedAt', 'messageCount'
+)
+# 最後のメッセージの先頭部分を会話に複製する属性（会話一覧のinclude=previewで返す）
+CONVERSATION_PREVIEW_ATTRIBUTE = 'lastMessagePreview'
+# 最後のメッセージとして複製する文字数
+MESSAGE_PREVIEW_LENGTH = 100
+# 会話ヘッダー（所有者・タイトル）をMessagesテーブルに置くソートキー（64ビット整数の最大値）
+# どのメッセージのキーよりも大きいため、新しい順のQueryで最新のページと一緒に先頭に読める
+CONVERSATION_HEADER_KEY = 2 ** 63 - 1
+# 会話ヘッダーに複製する属性（会話の作成後に変わらないものだけにし、更新のたびに書かない）
+CONVERSATION_HEADER_ATTRIBUTES = ('userId', 'title', 'createdAt')
+
+
+def message_preview(content):
+    """メッセージ本文から会話一覧に表示する先頭部分を作る（改行などの空白は1つにまとめる）"""
+    text = ' '.join(str(content).split())
+    if len(text) > MESSAGE_PREVIEW_LENGTH:
+        return text[:MESSAGE_PREVIEW_LENGTH] + '...'
+    return text
+
+
+def key_collided(error, transaction_index=None):
+    """条件付き書き込みの失敗がメッセージのキーの衝突によるものか
+
+    トランザクションの場合は、transaction_index番目（メッセージのPut）の条件で失敗したかを見る。
+    """
+    if transaction_index is None:
+        return error.response.get('Error', {}).get('Code') == 'ConditionalCheckFailedException'
+    reasons = error.response.get('CancellationReasons') or []
+    return (
+        len(reasons) > transaction_index
+        and reasons[transaction_index].get('Code') == 'ConditionalCheckFailed'
+    )
 
 
 class DynamoDBService:
     def __init__(self):
-        dynamodb = boto3.resource('dynamodb')
+        dynamodb = get_resource('dynamodb')
+        # トランザクション書き込み用（resource経由のclientはPython型をそのまま扱える）
+        self.client = dynamodb.meta.client
         self.conversations_table = dynamodb.Table(
             os.environ['CONVERSATIONS_TABLE_NAME']
         )
         self.messages_table = dynamodb.Table(
             os.environ['MESSAGES_TABLE_NAME']
         )
+        # 非同期生成ジョブの状態（未設定の場合は非同期モードを使わない）
+        self.jobs_table = None
+        if os.environ.get('JOBS_TABLE_NAME'):
+            self.jobs_table = dynamodb.Table(os.environ['JOBS_TABLE_NAME'])
+        # メッセージ本文の圧縮・退避（読み書きの際に透過的に変換する）
+        self.codec = MessageCodec()
+        # 会話ヘッダーをMessagesテーブルにも書き、会話を開く際に1回のQueryで読む
+        self.conversation_headers = os.environ.get('CONVERSATION_HEADERS', 'off').lower() == 'on'
+
+    def prewarm(self):
+        """存在しないキーを読み、DynamoDBへのTLS接続を初期化フェーズで確立しておく"""
+        self.conversations_table.get_item(
+            Key={'userId': '__prewarm__', 'conversationId': '__prewarm__'}
+        )
 
     def create_conversation(self, user_id, conversation_id, title, timestamp):
         """新規会話を作成"""
@@ -26,37 +102,535 @@ class DynamoDBService:
             }
         )
 
-    def save_message(self, conversation_id, role, content, timestamp):
-        """メッセージを保存"""
-        self.messages_table.put_item(
-            Item={
-                'conversationId': conversation_id,
-                'timestamp': timestamp,
-                'messageId': str(uuid.uuid4()),
-                'role': role,
-                'content': content
+    def save_message(self, conversation_id, role, content, timestamp, token_count=None):
+        """メッセージを保存（timestampはmessage_keyで発行したソートキー）"""
+        self.put_message(
+            self.build_message_item(conversation_id, role, content, timestamp, token_count)
+        )
+
+    def build_message_item(self, conversation_id, role, content, timestamp, token_count=None):
+        """Messagesテーブルのアイテムを組み立て"""
+        item = {
+            'conversationId': conversation_id,
+            'timestamp': timestamp,
+            'messageId': str(uuid.uuid4()),
+            'role': role,
+            'content': content
+        }
+        # Bedrockのusageから得たトークン数（履歴の予算計算に使用）
+        if token_count is not None:
+            item['tokenCount'] = token_count
+        return item
+
+    def put_message(self, item):
+        """組み立て済みのメッセージを保存
+
+        キーが既存のメッセージと衝突した場合はitemのtimestampを新しいキーに置き換えて書き直す。
+        """
+        self._write_new_message(
+            item, lambda: self.messages_table.put_item(
+                Item=self.codec.encode(item), **NEW_MESSAGE_CONDITION
+            )
+        )
+
+    def _write_new_message(self, item, write, transaction_index=None):
+        """メッセージを含む書き込みを行い、ソートキーが衝突した場合は新しいキーで書き直す
+
+        キーは別のコンテナが同じミリ秒に発行したものと衝突しうるため、条件付きで書き込む。
+        transaction_indexはトランザクションの場合のメッセージのPutの位置。
+        """
+        for attempt in range(MESSAGE_KEY_MAX_ATTEMPTS):
+            try:
+                return write()
+            except (self.client.exceptions.ConditionalCheckFailedException,
+                    self.client.exceptions.TransactionCanceledException) as e:
+                if attempt == MESSAGE_KEY_MAX_ATTEMPTS - 1 or not key_collided(e, transaction_index):
+                    raise
+                print(f"Message key collision in {item['conversationId']}, retrying with a new key")
+                item['timestamp'] = new_message_key()
+
+    def build_conversation_item(self, user_id, conversation_id, title, timestamp, message_count=0,
+                                last_message=None):
+        """Conversationsテーブルのアイテムを組み立て（last_messageは最後のメッセージの本文）"""
+        item = {
+            'userId': user_id,
+            'conversationId': conversation_id,
+            'title': title,
+            'createdAt': timestamp,
+            'updatedAt': timestamp,
+            'messageCount': message_count
+        }
+        if last_message is not None:
+            item[CONVERSATION_PREVIEW_ATTRIBUTE] = message_preview(last_message)
+        return item
+
+    def build_conversation_header(self, conversation_item):
+        """会話アイテムからMessagesテーブルに置く会話ヘッダーを組み立て"""
+        header = {
+            'conversationId': conversation_item['conversationId'],
+            'timestamp': CONVERSATION_HEADER_KEY,
+            'itemType': 'header'
+        }
+        for attr in CONVERSATION_HEADER_ATTRIBUTES:
+            if attr in conversation_item:
+                header[attr] = conversation_item[attr]
+        return header
+
+    def batch_put(self, conversation_items=(), message_items=(), max_workers=4):
+        """会話とメッセージをBatchWriteItemでまとめて保存
+
+        25件ずつのリクエストを並列に発行する。同じキーのアイテムを1リクエストに
+        含められないため、メッセージは衝突しないソートキーで組み立てておくこと。
+        """
+        if self.conversation_headers:
+            message_items = [
+                *message_items,
+                *(self.build_conversation_header(item) for item in conversation_items)
+            ]
+        requests = [
+            (self.conversations_table.name, {'PutRequest': {'Item': item}})
+            for item in conversation_items
+        ] + [
+            (self.messages_table.name, {'PutRequest': {'Item': self.codec.encode(item)}})
+            for item in message_items
+        ]
+        chunks = [
+            requests[start:start + BATCH_WRITE_LIMIT]
+            for start in range(0, len(requests), BATCH_WRITE_LIMIT)
+        ]
+        if len(chunks) <= 1:
+            return sum(self._batch_write(chunk) for chunk in chunks)
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(chunks))) as executor:
+            return sum(executor.map(self._batch_write, chunks))
+
+    def delete_message(self, conversation_id, timestamp):
+        """メッセージを1件削除"""
+        self.messages_table.delete_item(
+            Key={'conversationId': conversation_id, 'timestamp': timestamp}
+        )
+
+    def create_conversation_with_message(self, user_id, conversation_id, title, message_item):
+        """新規会話の作成と最初のメッセージ保存を1つのトランザクションで実行"""
+        # 会話の日時は秒単位で保持する
+        timestamp = key_to_epoch_seconds(message_item['timestamp'])
+        conversation_item = self.build_conversation_item(
+            user_id, conversation_id, title, timestamp, last_message=message_item['content']
+        )
+        transact_items = [
+            {
+                'Put': {
+                    'TableName': self.conversations_table.name,
+                    'Item': conversation_item,
+                    'ConditionExpression': 'attribute_not_exists(conversationId)'
+                }
+            },
+            {
+                'Put': {
+                    'TableName': self.messages_table.name,
+                    'Item': message_item,
+                    **NEW_MESSAGE_CONDITION
+                }
             }
+        ]
+        if self.conversation_headers:
+            transact_items.append({
+                'Put': {
+                    'TableName': self.messages_table.name,
+                    'Item': self.build_conversation_header(conversation_item)
+                }
+            })
+
+        def write():
+            transact_items[1]['Put']['Item'] = self.codec.encode(message_item)
+            self.client.transact_write_items(TransactItems=transact_items)
+
+        self._write_new_message(message_item, write, transaction_index=1)
+
+    def save_message_and_update_metadata(self, user_id, message_item, updated_at):
+        """AI応答の保存と会話メタデータの更新を1つのトランザクションで実行
+
+        キーが衝突した場合はmessage_itemのtimestampを新しいキーに置き換えて書き直す。
+        """
+        self._write_new_message(message_item, lambda: self.client.transact_write_items(
+            TransactItems=[
+                {
+                    'Put': {
+                        'TableName': self.messages_table.name,
+                        'Item': self.codec.encode(message_item),
+                        **NEW_MESSAGE_CONDITION
+                    }
+                },
+                {
+                    'Update': {
+                        'TableName': self.conversations_table.name,
+                        'Key': {
+                            'userId': user_id,
+                            'conversationId': message_item['conversationId']
+                        },
+                        'UpdateExpression': (
+                            'SET updatedAt = :ua, messageCount = messageCount + :inc, #pv = :pv'
+                        ),
+                        'ConditionExpression': 'attribute_exists(conversationId)',
+                        'ExpressionAttributeNames': {'#pv': CONVERSATION_PREVIEW_ATTRIBUTE},
+                        'ExpressionAttributeValues': {
+                            ':ua': updated_at,
+                            ':inc': 2,  # userとassistantの2メッセージ
+                            ':pv': message_preview(message_item['content'])
+                        }
+                    }
+                }
+            ]
+        ), transaction_index=0)
+
+    def get_conversation(self, user_id, conversation_id):
+        """会話メタデータを取得（存在しなければNone）"""
+        response = self.conversations_table.get_item(
+            Key={'userId': user_id, 'conversationId': conversation_id}
+        )
+        return response.get('Item')
+
+    def delete_conversation(self, user_id, conversation_id):
+        """会話を削除し、削除前のアイテムを返す（存在しなければNone）
+
+        キーにuserIdを含むため、ほかのユーザーの会話は削除されない（事前の権限チェックは不要）。
+        会話ヘッダーも消し、メッセージの削除を待たずに会話を開けないようにする。
+        """
+        response = self.conversations_table.delete_item(
+            Key={'userId': user_id, 'conversationId': conversation_id},
+            ReturnValues='ALL_OLD'
         )
+        # 存在しなかった場合はAttributesが返らない（空のマップが返る実装もあるため両方をNoneにする）
+        item = response.get('Attributes') or None
+        if item is not None and self.conversation_headers:
+            self.delete_message(conversation_id, CONVERSATION_HEADER_KEY)
+        return item
+
+    def get_conversation_view(self, conversation_id, limit):
+        """会話ヘッダーと最新のメッセージ1ページを1回のQueryで取得
 
-    def get_conversation_history(self, conversation_id):
-        """会話履歴を取得"""
+        (ヘッダー, メッセージ（新しい順）, LastEvaluatedKey) を返す。ヘッダーのない会話
+        （移行前・存在しない会話）はヘッダーをNoneで返し、メッセージはlimit件に切り詰める。
+        """
         response = self.messages_table.query(
             KeyConditionExpression='conversationId = :cid',
             ExpressionAttributeValues={':cid': conversation_id},
-            ScanIndexForward=True  # 古い順
+            ScanIndexForward=False,
+            Limit=limit + 1
         )
-        return response['Items']
+        items = response['Items']
+        last_key = response.get('LastEvaluatedKey')
+
+        header = None
+        if items and items[0]['timestamp'] == CONVERSATION_HEADER_KEY:
+            header = items.pop(0)
+        elif len(items) > limit:
+            items = items[:limit]
+            last_key = {'conversationId': conversation_id, 'timestamp': items[-1]['timestamp']}
+        return header, [self.codec.decode(item) for item in items], last_key
+
+    def list_conversations(self, user_id, limit, exclusive_start_key=None,
+                           attributes=CONVERSATION_LIST_ATTRIBUTES):
+        """会話一覧を更新日時の降順で1ページ取得（(アイテム, LastEvaluatedKey)を返す）"""
+        kwargs = {
+            'IndexName': CONVERSATIONS_INDEX_NAME,
+            'KeyConditionExpression': 'userId = :uid',
+            'ExpressionAttributeValues': {':uid': user_id},
+            'ProjectionExpression': ', '.join(f'#a{i}' for i in range(len(attributes))),
+            'ExpressionAttributeNames': {f'#a{i}': attr for i, attr in enumerate(attributes)},
+            'ScanIndexForward': False,
+            'Limit': limit
+        }
+        if exclusive_start_key is not None:
+            kwargs['ExclusiveStartKey'] = exclusive_start_key
+
+        response = self.conversations_table.query(**kwargs)
+        return response['Items'], response.get('LastEvaluatedKey')
 
-    def update_conversation_metadata(self, user_id, conversation_id, updated_at):
-        """会話のメタデータを更新"""
+    def get_conversation_history(self, conversation_id, newest_first=False, limit=None,
+                                 after=None, attributes=HISTORY_ATTRIBUTES, include_header=False):
+        """会話履歴をページングしながら1件ずつ返すジェネレーター
+
+        newest_first=Trueで新しい順に読み、limit件で打ち切る。
+        afterを指定した場合は、そのtimestampより新しいメッセージのみ対象とする。
+        attributesで取得する属性を絞り、不要な属性の読み込みを避ける。
+        会話ヘッダーはinclude_header=Trueの場合のみ含める（キー条件で除くため読み込まない）。
+        """
+        names = {f'#a{i}': attr for i, attr in enumerate(attributes)}
+        kwargs = {
+            'KeyConditionExpression': 'conversationId = :cid',
+            'ExpressionAttributeValues': {':cid': conversation_id},
+            'ProjectionExpression': ', '.join(f'#a{i}' for i in range(len(attributes))),
+            'ExpressionAttributeNames': names,
+            'ScanIndexForward': not newest_first
+        }
+        if after is not None and not include_header:
+            # BETWEENは境界を含むため、整数のtimestampを1ずつ内側に寄せる
+            kwargs['KeyConditionExpression'] += ' AND #ts BETWEEN :after AND :header'
+            kwargs['ExpressionAttributeValues'].update({
+                ':after': after + 1, ':header': CONVERSATION_HEADER_KEY - 1
+            })
+        elif after is not None:
+            kwargs['KeyConditionExpression'] += ' AND #ts > :after'
+            kwargs['ExpressionAttributeValues'][':after'] = after
+        elif not include_header:
+            kwargs['KeyConditionExpression'] += ' AND #ts < :header'
+            kwargs['ExpressionAttributeValues'][':header'] = CONVERSATION_HEADER_KEY
+        if after is not None or not include_header:
+            names['#ts'] = 'timestamp'
+
+        remaining = limit
+        while remaining is None or remaining > 0:
+            if remaining is not None:
+                kwargs['Limit'] = remaining
+
+            response = self.messages_table.query(**kwargs)
+            for item in response['Items']:
+                yield self.codec.decode(item)
+
+            if remaining is not None:
+                remaining -= len(response['Items'])
+            if 'LastEvaluatedKey' not in response:
+                return
+            kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    def query_messages_page(self, conversation_id, limit, since=None, before=None,
+                            newest_first=True, exclusive_start_key=None):
+        """メッセージを1ページ取得（(アイテム, LastEvaluatedKey)を返す）
+
+        since/beforeはtimestamp（ソートキー）の範囲（いずれも境界を含まない）としてキー条件に含め、
+        範囲外のメッセージを読み込まないようにする。秒単位の旧キーと高分解能キーは
+        同じ順序で並ぶため、どちらのメッセージのtimestampも境界に使える。
+        beforeを指定しない場合も会話ヘッダーの手前までに絞る。
+        """
+        if before is None:
+            before = CONVERSATION_HEADER_KEY
+        kwargs = {
+            'KeyConditionExpression': 'conversationId = :cid',
+            'ExpressionAttributeValues': {':cid': conversation_id},
+            'ScanIndexForward': not newest_first,
+            'Limit': limit
+        }
+        if since is not None:
+            # BETWEENは境界を含むため、整数のtimestampを1ずつ内側に寄せる
+            if before - since < 2:
+                return [], None
+            kwargs['KeyConditionExpression'] += ' AND #ts BETWEEN :since AND :before'
+            kwargs['ExpressionAttributeValues'].update({':since': since + 1, ':before': before - 1})
+        else:
+            kwargs['KeyConditionExpression'] += ' AND #ts < :before'
+            kwargs['ExpressionAttributeValues'][':before'] = before
+        kwargs['ExpressionAttributeNames'] = {'#ts': 'timestamp'}
+        if exclusive_start_key is not None:
+            kwargs['ExclusiveStartKey'] = exclusive_start_key
+
+        response = self.messages_table.query(**kwargs)
+        items = [self.codec.decode(item) for item in response['Items']]
+        return items, response.get('LastEvaluatedKey')
+
+    def get_recent_messages(self, conversation_id, limit, after=None):
+        """直近のメッセージを最大limit件取得（古い順で返す）"""
+        messages = list(self.get_conversation_history(
+            conversation_id, newest_first=True, limit=limit, after=after
+        ))
+        messages.reverse()
+        return messages
+
+    def get_last_message_preview(self, conversation_id):
+        """最後のメッセージの先頭部分をLimit=1のQueryで取得（メッセージがなければNone）"""
+        messages = list(self.get_conversation_history(
+            conversation_id, newest_first=True, limit=1,
+            attributes=('content', *ENCODED_CONTENT_ATTRIBUTES)
+        ))
+        return message_preview(messages[0]['content']) if messages else None
+
+    def get_messages_after(self, conversation_id, after=None):
+        """指定timestampより新しいメッセージを全件取得（古い順）"""
+        return list(self.get_conversation_history(conversation_id, after=after))
+
+    def iter_message_keys(self, conversation_id):
+        """会話のメッセージ（会話ヘッダーを含む）のキーのみを順に返す"""
+        # 本文を読まずにキーだけ取得して読み込み容量を抑える
+        return self.get_conversation_history(
+            conversation_id, attributes=('conversationId', 'timestamp'), include_header=True
+        )
+
+    def delete_messages(self, conversation_id, deadline=None, max_workers=8):
+        """会話のメッセージを全件削除
+
+        キーをページングしながら25件ずつのBatchWriteItemを並列に発行する。
+        deadline（time.monotonic基準）を過ぎた場合は途中で打ち切る。
+        戻り値は (削除件数, 完了したか)。
+        """
+        deleted = 0
+        batch = []
+        futures = []
+        completed = True
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for key in self.iter_message_keys(conversation_id):
+                batch.append(key)
+                if len(batch) == BATCH_WRITE_LIMIT:
+                    futures.append(executor.submit(self._batch_delete_messages, batch))
+                    batch = []
+
+                if deadline is not None and time.monotonic() >= deadline:
+                    completed = False
+                    break
+
+            if batch and completed:
+                futures.append(executor.submit(self._batch_delete_messages, batch))
+
+            for future in futures:
+                deleted += future.result()
+
+        if completed:
+            self.codec.delete_spilled(conversation_id)
+        return deleted, completed
+
+    def _batch_delete_messages(self, keys):
+        """BatchWriteItemでメッセージを削除"""
+        return self._batch_write([
+            (self.messages_table.name, {'DeleteRequest': {'Key': key}}) for key in keys
+        ])
+
+    def _batch_write(self, requests):
+        """(テーブル名, リクエスト)のリストをBatchWriteItemで実行し、未処理分はジッター付きバックオフで再試行"""
+        request_items = {}
+        for table_name, request in requests:
+            request_items.setdefault(table_name, []).append(request)
+
+        for attempt in range(BATCH_WRITE_MAX_RETRIES):
+            response = self.client.batch_write_item(RequestItems=request_items)
+            request_items = response.get('UnprocessedItems')
+            if not request_items:
+                return len(requests)
+            time.sleep(random.uniform(0, min(1.0, 0.05 * 2 ** attempt)))
+
+        raise RuntimeError(
+            f"BatchWriteItem left unprocessed items after {BATCH_WRITE_MAX_RETRIES} retries"
+        )
+
+    def update_summary(self, user_id, conversation_id, summary, summary_until,
+                       summarized_count, previous_until=None):
+        """会話の要約を更新（他の要約処理と競合した場合はFalse）"""
+        if previous_until is None:
+            condition = 'attribute_exists(conversationId) AND attribute_not_exists(summaryUntil)'
+            values = {}
+        else:
+            condition = 'summaryUntil = :prev'
+            values = {':prev': previous_until}
+
+        try:
+            self.conversations_table.update_item(
+                Key={
+                    'userId': user_id,
+                    'conversationId': conversation_id
+                },
+                UpdateExpression='SET summary = :s, summaryUntil = :su, summarizedCount = :sc',
+                ConditionExpression=condition,
+                ExpressionAttributeValues={
+                    ':s': summary,
+                    ':su': summary_until,
+                    ':sc': summarized_count,
+                    **values
+                }
+            )
+        except self.conversations_table.meta.client.exceptions.ConditionalCheckFailedException:
+            return False
+        return True
+
+    def update_conversation_metadata(self, user_id, conversation_id, updated_at, increment=2,
+                                     last_message=None):
+        """会話のメタデータを更新（incrementは追加したメッセージ数、last_messageは最後のメッセージの本文）"""
+        kwargs = {
+            'UpdateExpression': 'SET updatedAt = :ua, messageCount = messageCount + :inc',
+            'ExpressionAttributeValues': {
+                ':ua': updated_at,
+                ':inc': increment
+            }
+        }
+        if last_message is not None:
+            kwargs['UpdateExpression'] += ', #pv = :pv'
+            kwargs['ExpressionAttributeNames'] = {'#pv': CONVERSATION_PREVIEW_ATTRIBUTE}
+            kwargs['ExpressionAttributeValues'][':pv'] = message_preview(last_message)
         self.conversations_table.update_item(
             Key={
                 'userId': user_id,
                 'conversationId': conversation_id
             },
-            UpdateExpression='SET updatedAt = :ua, messageCount = messageCount + :inc',
-            ExpressionAttributeValues={
-                ':ua': updated_at,
-                ':inc': 2  # userとassistantの2メッセージ
-            }
+            **kwargs
+        )
+
+    def create_job(self, job_id, user_id, message, conversation_id, timestamp, expires_at):
+        """非同期生成ジョブを受付状態で作成"""
+        item = {
+            'jobId': job_id,
+            'userId': user_id,
+            'message': message,
+            'status': 'queued',
+            'createdAt': timestamp,
+            'updatedAt': timestamp,
+            # TTLで自動削除する日時
+            'expiresAt': expires_at
+        }
+        if conversation_id:
+            item['conversationId'] = conversation_id
+        self.jobs_table.put_item(Item=item)
+        return item
+
+    def get_job(self, job_id):
+        """ジョブを取得（存在しなければNone）"""
+        response = self.jobs_table.get_item(Key={'jobId': job_id})
+        return response.get('Item')
+
+    def claim_job(self, job_id, timestamp, stale_before):
+        """ジョブを実行中にする（受付状態か、stale_beforeより前に開始して止まったジョブのみ）
+
+        SQSは同じメッセージを複数回配信することがあるため、条件付き更新で
+        1つのワーカーだけが実行するようにする。取得できなければNoneを返す。
+        """
+        try:
+            response = self.jobs_table.update_item(
+                Key={'jobId': job_id},
+                UpdateExpression='SET #st = :running, startedAt = :ts, updatedAt = :ts',
+                ConditionExpression='#st = :queued OR (#st = :running AND startedAt < :stale)',
+                ExpressionAttributeNames={'#st': 'status'},
+                ExpressionAttributeValues={
+                    ':running': 'running',
+                    ':queued': 'queued',
+                    ':ts': timestamp,
+                    ':stale': stale_before
+                },
+                ReturnValues='ALL_NEW'
+            )
+        except self.jobs_table.meta.client.exceptions.ConditionalCheckFailedException:
+            return None
+        return response['Attributes']
+
+    def finish_job(self, job_id, timestamp, conversation_id=None, result=None, error=None):
+        """ジョブを完了（resultあり）または失敗（errorあり）にする"""
+        values = {
+            ':st': 'failed' if error else 'succeeded',
+            ':ts': timestamp
+        }
+        expression = 'SET #st = :st, updatedAt = :ts'
+        if conversation_id:
+            expression += ', conversationId = :cid'
+            values[':cid'] = conversation_id
+        if result is not None:
+            expression += ', #res = :res'
+            values[':res'] = result
+        if error:
+            expression += ', #err = :err'
+            values[':err'] = error
+
+        self.jobs_table.update_item(
+            Key={'jobId': job_id},
+            UpdateExpression=expression,
+            ExpressionAttributeNames={
+                '#st': 'status',
+                **({'#res': 'result'} if result is not None else {}),
+                **({'#err': 'error'} if error else {})
+            },
+            ExpressionAttributeValues=values
         )
@@ -0,0 +1,120 @@
+import os
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+
+# 遅延の分位点を求めるのに使う直近の呼び出し数
+LATENCY_WINDOW = 200
+# 分位点を使い始めるまでに必要な計測数（それまではBEDROCK_HEDGE_DELAY_MSを使う）
+MIN_SAMPLES = 20
+# 使わずに貯めておけるヘッジの上限（アイドル後のバーストで予算を超えないようにする）
+MAX_HEDGE_CREDITS = 5.0
+
+
+class HedgePolicy:
+    """Bedrockへのヘッジリクエストを出すかどうかの判断
+
+    最初の呼び出しが直近の遅延の分位点（既定p95）を過ぎても応答しない場合に、
+    2本目の呼び出しを出して先に返った方を使う。ヘッジは呼び出し1回ごとに
+    budget回分（既定0.1回）のクレジットが貯まり、クレジットがある場合だけ出すため、
+    追加のトークン消費は呼び出し数のbudget倍までに抑えられる。
+    遅延は応答全体（converse）と最初のトークン（ストリーミング）で別々に追跡する。
+    """
+
+    def __init__(self, enabled=None, percentile=None, budget=None, default_delay_ms=None,
+                 model_id=None):
+        if enabled is None:
+            enabled = os.environ.get('BEDROCK_HEDGE', 'off').lower() == 'on'
+        self.enabled = enabled
+        self.percentile = float(percentile or os.environ.get('BEDROCK_HEDGE_PERCENTILE', 95))
+        self.budget = float(budget or os.environ.get('BEDROCK_HEDGE_BUDGET', 0.1))
+        self.default_delay_ms = float(
+            default_delay_ms or os.environ.get('BEDROCK_HEDGE_DELAY_MS', 3000)
+        )
+        # ヘッジに使うモデル（未設定なら同じモデル）
+        self.model_id = model_id or os.environ.get('BEDROCK_HEDGE_MODEL_ID')
+
+        self.requests = 0
+        self.hedges = 0
+        self.wins = 0
+        self._credits = 1.0
+        self._latencies = {}
+        self._lock = threading.Lock()
+
+    def delay_seconds(self, kind):
+        """ヘッジを出すまでの待ち時間（秒）"""
+        with self._lock:
+            samples = sorted(self._latencies.get(kind, ()))
+        if len(samples) < MIN_SAMPLES:
+            return self.default_delay_ms / 1000
+        index = min(len(samples) - 1, int(len(samples) * self.percentile / 100))
+        return samples[index] / 1000
+
+    def record_latency(self, kind, latency_ms):
+        """最初の呼び出しの遅延を記録"""
+        with self._lock:
+            self._latencies.setdefault(kind, deque(maxlen=LATENCY_WINDOW)).append(latency_ms)
+
+    def start_request(self):
+        """呼び出し1回分のヘッジ予算を貯める"""
+        with self._lock:
+            self.requests += 1
+            self._credits = min(MAX_HEDGE_CREDITS, self._credits + self.budget)
+
+    def try_hedge(self):
+        """予算が残っていればヘッジを1回分消費してTrue"""
+        with self._lock:
+            if self._credits < 1:
+                return False
+            self._credits -= 1
+            self.hedges += 1
+            return True
+
+    def record_win(self):
+        """ヘッジ側が先に応答した"""
+        with self._lock:
+            self.wins += 1
+
+    def snapshot(self):
+        """ヘッジの実績（ベンチマーク・デバッグ用）"""
+        with self._lock:
+            return {'requests': self.requests, 'hedges': self.hedges, 'wins': self.wins}
+
+
+def first_successful(futures):
+    """最初に成功したFutureを返す（すべて失敗した場合は最初の呼び出しの例外を送出）"""
+    pending = set(futures)
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in futures:
+            if future in done and future.exception() is None:
+                return future
+    raise futures[0].exception()
+
+
+_shared = None
+_executor = None
+_shared_lock = threading.Lock()
+
+
+def shared_hedge_policy():
+    """コンテナ内で共有するヘッジの判断"""
+    global _shared
+    if _shared is None:
+        with _shared_lock:
+            if _shared is None:
+                _shared = HedgePolicy()
+    return _shared
+
+
+def hedge_executor():
+    """ヘッジ中の呼び出しを実行するスレッドプール（初回利用時に生成）"""
+    global _executor
+    if _executor is None:
+        with _shared_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=int(os.environ.get('BEDROCK_HEDGE_MAX_WORKERS', 16))
+                )
+    return _executor
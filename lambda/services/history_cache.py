@@ -0,0 +1,113 @@
+import os
+import sys
+import threading
+from collections import OrderedDict
+
+
+# メッセージ1件あたりのdict・属性名などの概算オーバーヘッド（バイト）
+MESSAGE_OVERHEAD_BYTES = 512
+
+
+class HistoryCache:
+    """会話ごとの直近メッセージを保持するLRUキャッシュ
+
+    モジュールレベルで生成し、ウォームコンテナの呼び出し間で再利用する。
+    エントリは会話のmessageCount/updatedAtと突き合わせて検証する。
+    """
+
+    def __init__(self, max_bytes=None):
+        if max_bytes is None:
+            # 関数のメモリサイズ（512MB）に対する割合で上限を決める
+            memory_mb = int(os.environ.get('AWS_LAMBDA_FUNCTION_MEMORY_SIZE', 512))
+            ratio = float(os.environ.get('HISTORY_CACHE_MEMORY_RATIO', 0.1))
+            max_bytes = int(memory_mb * 1024 * 1024 * ratio)
+        self.max_bytes = max_bytes
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.evictions = 0
+
+    def get(self, conversation_id):
+        """キャッシュ済みのエントリを返す（なければNone）
+
+        エントリは messages / messageCount / updatedAt を持つ。
+        使う前に validate で会話メタデータと突き合わせること。
+        """
+        with self._lock:
+            entry = self._entries.get(conversation_id)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(conversation_id)
+            return {**entry, 'messages': list(entry['messages'])}
+
+    def validate(self, entry, message_count, updated_at):
+        """エントリが会話の最新状態と一致するか検証
+
+        一致しない場合は他のコンテナで更新済みのため、直近の範囲の読み直しが必要。
+        """
+        fresh = entry['messageCount'] == message_count and entry['updatedAt'] == updated_at
+        with self._lock:
+            if fresh:
+                self.hits += 1
+            else:
+                self.stale += 1
+        return fresh
+
+    def put(self, conversation_id, messages, message_count, updated_at):
+        """直近メッセージを登録し、上限を超えた分を古い順に追い出す"""
+        size = sum(
+            sys.getsizeof(msg.get('content', '')) + MESSAGE_OVERHEAD_BYTES
+            for msg in messages
+        )
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            old = self._entries.pop(conversation_id, None)
+            if old is not None:
+                self.current_bytes -= old['bytes']
+
+            self._entries[conversation_id] = {
+                'messages': list(messages),
+                'messageCount': message_count,
+                'updatedAt': updated_at,
+                'bytes': size,
+            }
+            self.current_bytes += size
+
+            while self.current_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.current_bytes -= evicted['bytes']
+                self.evictions += 1
+
+    def invalidate(self, conversation_id):
+        """エントリを削除"""
+        with self._lock:
+            old = self._entries.pop(conversation_id, None)
+            if old is not None:
+                self.current_bytes -= old['bytes']
+
+    def invalidate_all(self):
+        """全エントリを削除"""
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def stats(self):
+        """ヒット・ミス・追い出しの件数とメモリ使用量"""
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self.current_bytes,
+                'maxBytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'stale': self.stale,
+                'evictions': self.evictions,
+            }
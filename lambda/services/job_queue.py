@@ -0,0 +1,45 @@
+import json
+import os
+import threading
+from collections import deque
+
+from services.aws_clients import get_client
+
+
+class JobQueue:
+    """長時間の生成ジョブをワーカーLambdaへ渡すキュー
+
+    JOB_QUEUE_URLが設定されていればSQSを使い、なければプロセス内のキュー
+    （テスト・ベンチマーク用の代替）に積む。プロセス内のキューはreceiveで取り出して処理する。
+    """
+
+    def __init__(self):
+        self.queue_url = os.environ.get('JOB_QUEUE_URL')
+        self._client = None
+        self._local = deque()
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        """SQSクライアント（初回利用時に生成）"""
+        if self._client is None:
+            self._client = get_client('sqs')
+        return self._client
+
+    def send(self, message):
+        """メッセージ（dict）をキューに積む"""
+        if self.queue_url:
+            self.client.send_message(
+                QueueUrl=self.queue_url,
+                MessageBody=json.dumps(message, ensure_ascii=False)
+            )
+            return
+        with self._lock:
+            self._local.append(message)
+
+    def receive(self):
+        """プロセス内のキューから全メッセージを取り出す（SQS利用時はイベントソースが配信する）"""
+        with self._lock:
+            messages = list(self._local)
+            self._local.clear()
+        return messages
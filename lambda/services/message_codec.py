@@ -0,0 +1,109 @@
+import os
+import zlib
+
+from services.object_store import ObjectStore
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+# 圧縮後の本文を保存する属性（DynamoDBのBinary型）
+CONTENT_BINARY_ATTRIBUTE = 'contentBin'
+# オブジェクトストアに退避した本文のキー
+CONTENT_REF_ATTRIBUTE = 'contentRef'
+# 本文の符号化方式（この属性がないアイテムはcontentに平文で保存されている）
+CODEC_ATTRIBUTE = 'codec'
+# 符号化した本文の読み込みに必要な属性
+ENCODED_CONTENT_ATTRIBUTES = (CONTENT_BINARY_ATTRIBUTE, CONTENT_REF_ATTRIBUTE, CODEC_ATTRIBUTE)
+
+
+class MessageCodec:
+    """メッセージ本文の保存形式を変換する
+
+    MESSAGE_COMPRESSION（off / zlib / zstd）で圧縮を有効にすると、
+    閾値以上の本文を圧縮してBinary属性に保存し、アイテムサイズと読み込み単位を減らす。
+    アイテムの上限（400KB）に近い本文はオブジェクトストアに退避する。
+    読み込み時の復号は設定にかかわらず常に行う。
+    """
+
+    def __init__(self, object_store=None):
+        self.compression = os.environ.get('MESSAGE_COMPRESSION', 'off').lower()
+        if self.compression == 'zstd' and zstandard is None:
+            print("zstandard is not installed; falling back to zlib")
+            self.compression = 'zlib'
+        # これ未満の本文は圧縮しても読み込み単位が変わらないため平文のまま保存する
+        self.min_bytes = int(os.environ.get('MESSAGE_COMPRESSION_MIN_BYTES', 1024))
+        # これ以上の本文はオブジェクトストアに退避する（属性名などの分を残しておく）
+        self.spill_bytes = int(os.environ.get('MESSAGE_SPILL_BYTES', 350 * 1024))
+        self.object_store = object_store or ObjectStore()
+
+    def encode(self, item):
+        """保存用のアイテムを返す（変換が不要なら元のアイテムをそのまま返す）"""
+        content = item.get('content')
+        if content is None:
+            return item
+
+        data = content.encode('utf-8')
+        codec = None
+        if self.compression != 'off' and len(data) >= self.min_bytes:
+            compressed = compress(self.compression, data)
+            if len(compressed) < len(data):
+                data, codec = compressed, self.compression
+
+        encoded = {k: v for k, v in item.items() if k != 'content'}
+        if len(data) >= self.spill_bytes and self.object_store.enabled:
+            # messageIdも含め、キーが衝突した書き込みが他のメッセージの本文を上書きしないようにする
+            key = f"{item['conversationId']}/{item['timestamp']}-{item.get('messageId', '')}"
+            self.object_store.put(key, data)
+            encoded[CONTENT_REF_ATTRIBUTE] = key
+            encoded[CODEC_ATTRIBUTE] = codec or 'none'
+        elif codec is not None:
+            encoded[CONTENT_BINARY_ATTRIBUTE] = data
+            encoded[CODEC_ATTRIBUTE] = codec
+        else:
+            return item
+        return encoded
+
+    def decode(self, item):
+        """読み込んだアイテムの本文をcontentに平文で戻す"""
+        codec = item.get(CODEC_ATTRIBUTE)
+        if codec is None:
+            return item
+
+        decoded = {k: v for k, v in item.items() if k not in ENCODED_CONTENT_ATTRIBUTES}
+        if CONTENT_REF_ATTRIBUTE in item:
+            data = self.object_store.get(item[CONTENT_REF_ATTRIBUTE])
+        else:
+            # boto3のresourceはBinary型で返す
+            data = getattr(item[CONTENT_BINARY_ATTRIBUTE], 'value', item[CONTENT_BINARY_ATTRIBUTE])
+        decoded['content'] = decompress(codec, bytes(data)).decode('utf-8')
+        return decoded
+
+    def delete_spilled(self, conversation_id):
+        """会話のメッセージのうちオブジェクトストアに退避した本文を削除"""
+        if self.object_store.enabled:
+            self.object_store.delete_prefix(f"{conversation_id}/")
+
+
+def compress(codec, data):
+    """指定の方式で圧縮"""
+    if codec == 'zstd':
+        return zstandard.ZstdCompressor(level=3).compress(data)
+    if codec == 'zlib':
+        return zlib.compress(data, 6)
+    raise ValueError(f"Unknown codec: {codec}")
+
+
+def decompress(codec, data):
+    """指定の方式で展開"""
+    if codec == 'zstd':
+        if zstandard is None:
+            raise RuntimeError("zstandard is required to read zstd-compressed messages")
+        return zstandard.ZstdDecompressor().decompress(data)
+    if codec == 'zlib':
+        return zlib.decompress(data)
+    if codec == 'none':
+        return data
+    raise ValueError(f"Unknown codec: {codec}")
@@ -0,0 +1,50 @@
+import random
+import threading
+import time
+
+
+# 1ミリ秒あたりのキーの数（下3桁を同一ミリ秒内の連番に使う）
+SEQUENCE_PER_MS = 1000
+# これ以上のキーは高分解能キー、未満は移行前の秒単位のキーとして扱う
+# （秒単位のUnix timestampがこの値に達するのは数万年後）
+HIGH_RESOLUTION_THRESHOLD = 10 ** 12
+
+
+class MessageKeyGenerator:
+    """MessagesテーブルのソートキーをUnixミリ秒×1000+連番で発行する
+
+    同じプロセス内では単調増加を保証し、同一秒のuserとassistantのメッセージが
+    上書きし合わないようにする。連番の初期値を乱数にして、別のコンテナが
+    同じミリ秒に発行したキーとも衝突しにくくする。
+    値は2^53未満に収まるため、JavaScriptの数値としても精度を失わない。
+    移行前の秒単位のキーより常に大きいので、新旧のアイテムは時系列順に並ぶ。
+    """
+
+    def __init__(self):
+        self._last = 0
+        self._lock = threading.Lock()
+
+    def next(self):
+        """次のソートキーを発行"""
+        candidate = int(time.time() * 1000) * SEQUENCE_PER_MS + random.randrange(SEQUENCE_PER_MS // 2)
+        with self._lock:
+            # 時計が戻った場合や同一ミリ秒内の連続発行でも前回より大きくする
+            self._last = max(candidate, self._last + 1)
+            return self._last
+
+
+_generator = MessageKeyGenerator()
+
+
+def new_message_key():
+    """プロセス共通のジェネレーターでソートキーを発行"""
+    return _generator.next()
+
+
+def key_to_epoch_seconds(key):
+    """ソートキーをUnix timestamp（秒）に変換（移行前の秒単位のキーはそのまま返す）"""
+    key = int(key)
+    if key >= HIGH_RESOLUTION_THRESHOLD:
+        return key // (1000 * SEQUENCE_PER_MS)
+    return key
+
@@ -0,0 +1,206 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+
+# CloudWatchメトリクスの名前空間
+NAMESPACE = os.environ.get('METRICS_NAMESPACE', 'BedrockChat')
+# DynamoDBの消費キャパシティを取得するか（ReturnConsumedCapacityを付与する）
+RECORD_CONSUMED_CAPACITY = os.environ.get('METRICS_CONSUMED_CAPACITY', 'true').lower() != 'false'
+
+# 計測中のリクエスト
+# Lambdaの1コンテナは同時に1リクエストしか処理しないため、
+# スレッドプールから呼ばれるAWSクライアントのフックからも参照できるようモジュール変数で持つ
+_current = None
+
+
+class RequestMetrics:
+    """1リクエスト分の区間計測とメトリクスの集計"""
+
+    def __init__(self, route):
+        self.route = route
+        self.started = time.perf_counter()
+        self.timings = {}
+        self.values = {}
+        self.properties = {}
+        self._lock = threading.Lock()
+
+    def record_timing(self, name, duration_ms):
+        """区間の所要時間を加算"""
+        with self._lock:
+            total, count = self.timings.get(name, (0.0, 0))
+            self.timings[name] = (total + duration_ms, count + 1)
+
+    @contextmanager
+    def span(self, name):
+        """with文で囲んだ区間の所要時間を計測"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record_timing(name, (time.perf_counter() - started) * 1000)
+
+    def add(self, name, value, unit='Count'):
+        """メトリクスを加算"""
+        if value is None:
+            return
+        with self._lock:
+            current, _ = self.values.get(name, (0, unit))
+            self.values[name] = (current + value, unit)
+
+    def set_property(self, key, value):
+        """メトリクス以外の付加情報（検索用）を設定"""
+        self.properties[key] = value
+
+    def elapsed_ms(self):
+        """リクエスト開始からの経過時間"""
+        return (time.perf_counter() - self.started) * 1000
+
+    def server_timing(self):
+        """Server-Timingヘッダーの値"""
+        entries = [
+            f'{name};dur={total:.1f}' + (f';desc="{count} calls"' if count > 1 else '')
+            for name, (total, count) in self.timings.items()
+        ]
+        entries.append(f'total;dur={self.elapsed_ms():.1f}')
+        return ', '.join(entries)
+
+    def to_emf(self):
+        """CloudWatch Embedded Metric Format のログレコード"""
+        values = {
+            **{f'{name}Time': (total, 'Milliseconds') for name, (total, _) in self.timings.items()},
+            **self.values,
+            'Latency': (self.elapsed_ms(), 'Milliseconds'),
+        }
+        record = {
+            '_aws': {
+                'Timestamp': int(time.time() * 1000),
+                'CloudWatchMetrics': [{
+                    'Namespace': NAMESPACE,
+                    'Dimensions': [['Route']],
+                    'Metrics': [{'Name': name, 'Unit': unit} for name, (_, unit) in values.items()],
+                }],
+            },
+            'Route': self.route,
+            **self.properties,
+        }
+        for name, (value, _) in values.items():
+            record[name] = round(value, 2) if isinstance(value, float) else value
+        return record
+
+
+class _NullMetrics(RequestMetrics):
+    """計測対象のリクエストがないとき（ワーカー等）に使う何もしない実装"""
+
+    def __init__(self):
+        super().__init__(None)
+
+    def record_timing(self, name, duration_ms):
+        pass
+
+    def add(self, name, value, unit='Count'):
+        pass
+
+    def set_property(self, key, value):
+        pass
+
+
+_null = _NullMetrics()
+
+
+def start_request(route):
+    """リクエストの計測を開始"""
+    global _current
+    _current = RequestMetrics(route)
+    return _current
+
+
+def current():
+    """計測中のリクエスト（なければ何もしない実装）"""
+    return _current or _null
+
+
+def finish_request(result):
+    """Server-Timingヘッダーを付与し、EMFのログを出力して計測を終える"""
+    global _current
+    request_metrics, _current = _current, None
+    if request_metrics is None:
+        return result
+
+    if isinstance(result, dict):
+        headers = result.setdefault('headers', {})
+        headers['Server-Timing'] = request_metrics.server_timing()
+        # クロスオリジンのフロントエンドからもServer-Timingを参照できるようにする
+        headers['Timing-Allow-Origin'] = '*'
+        request_metrics.set_property('StatusCode', result.get('statusCode'))
+
+    print(json.dumps(request_metrics.to_emf(), ensure_ascii=False))
+    return result
+
+
+def span(name):
+    """計測中のリクエストに区間を記録するコンテキストマネージャー"""
+    return current().span(name)
+
+
+def record_bedrock(usage, bedrock_metrics):
+    """Bedrockのusage・metricsを計測中のリクエストに記録"""
+    usage = usage or {}
+    request_metrics = current()
+    request_metrics.add('BedrockLatency', (bedrock_metrics or {}).get('latencyMs'), 'Milliseconds')
+    request_metrics.add('InputTokens', usage.get('inputTokens'))
+    request_metrics.add('OutputTokens', usage.get('outputTokens'))
+    # プロンプトキャッシュの効果
+    request_metrics.add('CacheReadInputTokens', usage.get('cacheReadInputTokens', 0))
+    request_metrics.add('CacheWriteInputTokens', usage.get('cacheWriteInputTokens', 0))
+
+
+def instrument_client(client, prefix):
+    """botocoreクライアントの各API呼び出しの所要時間を計測する"""
+    client.meta.events.register('provide-client-params', _request_consumed_capacity)
+    client.meta.events.register('before-call', _before_call)
+    client.meta.events.register(
+        'after-call', lambda **kwargs: _after_call(prefix, **kwargs)
+    )
+
+
+def _request_consumed_capacity(params, model, **kwargs):
+    if RECORD_CONSUMED_CAPACITY and 'ReturnConsumedCapacity' in model.input_shape.members:
+        params.setdefault('ReturnConsumedCapacity', 'TOTAL')
+
+
+def _before_call(context, **kwargs):
+    context['metricsStarted'] = time.perf_counter()
+
+
+def _after_call(prefix, parsed, model, context, **kwargs):
+    started = context.get('metricsStarted')
+    request_metrics = current()
+    if started is None or request_metrics is _null:
+        return
+
+    request_metrics.record_timing(
+        f'{prefix}-{model.name}', (time.perf_counter() - started) * 1000
+    )
+
+    consumed = parsed.get('ConsumedCapacity') if isinstance(parsed, dict) else None
+    if isinstance(consumed, dict):
+        consumed = [consumed]
+    if consumed:
+        request_metrics.add(
+            'DynamoDBConsumedCapacity',
+            sum(float(entry.get('CapacityUnits', 0)) for entry in consumed)
+        )
+
+
+def parse_emf_line(line):
+    """ログ行からEMFレコードを取り出す（EMFでなければNone）"""
+    try:
+        record = json.loads(line)
+    except ValueError:
+        return None
+    if not isinstance(record, dict) or '_aws' not in record:
+        return None
+    return record
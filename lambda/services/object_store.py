@@ -0,0 +1,62 @@
+import os
+import shutil
+
+from services.aws_clients import get_client
+
+
+class ObjectStore:
+    """DynamoDBに収まらない大きなデータの保存先
+
+    OBJECT_STORE_BUCKETが設定されていればS3を、OBJECT_STORE_DIRが設定されていれば
+    ローカルのディレクトリ（開発・ベンチマーク用の代替）を使う。どちらもなければ無効。
+    """
+
+    def __init__(self):
+        self.bucket = os.environ.get('OBJECT_STORE_BUCKET')
+        self.directory = os.environ.get('OBJECT_STORE_DIR')
+        self._client = None
+
+    @property
+    def enabled(self):
+        return bool(self.bucket or self.directory)
+
+    @property
+    def client(self):
+        """S3クライアント（初回利用時に生成）"""
+        if self._client is None:
+            self._client = get_client('s3')
+        return self._client
+
+    def put(self, key, data):
+        """データを保存"""
+        if self.bucket:
+            self.client.put_object(Bucket=self.bucket, Key=key, Body=data)
+            return
+        path = self._local_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+
+    def get(self, key):
+        """データを取得"""
+        if self.bucket:
+            return self.client.get_object(Bucket=self.bucket, Key=key)['Body'].read()
+        with open(self._local_path(key), 'rb') as f:
+            return f.read()
+
+    def delete_prefix(self, prefix):
+        """接頭辞に一致するデータをすべて削除"""
+        if self.bucket:
+            paginator = self.client.get_paginator('list_objects_v2')
+            for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix):
+                keys = [{'Key': obj['Key']} for obj in page.get('Contents', [])]
+                if keys:
+                    self.client.delete_objects(Bucket=self.bucket, Delete={'Objects': keys})
+            return
+        shutil.rmtree(self._local_path(prefix), ignore_errors=True)
+
+    def _local_path(self, key):
+        path = os.path.abspath(os.path.join(self.directory, key))
+        if not path.startswith(os.path.abspath(self.directory) + os.sep):
+            raise ValueError(f"Invalid object key: {key}")
+        return path
@@ -0,0 +1,98 @@
+import os
+import random
+import threading
+import time
+
+
+# Bedrockを呼び出すリージョン（先頭ほど優先。クロスリージョン推論プロファイルが使えるリージョンを並べる）
+DEFAULT_REGIONS = 'us-east-1'
+# EWMAの平滑化係数（大きいほど直近の呼び出しを重視する）
+EWMA_ALPHA = 0.2
+# エラー率1.0をレイテンシに換算した重み（エラー率10%でレイテンシを1.5倍とみなす）
+ERROR_PENALTY = 5.0
+
+
+class RegionRouter:
+    """Bedrockのリージョンごとのレイテンシ・エラー率をEWMAで追跡し、呼び出し先を選ぶ
+
+    スロットリングや5xxを返したリージョンは一定時間候補の後ろに回し、
+    ほかのリージョンへフェイルオーバーする。コンテナ内で共有する。
+    """
+
+    def __init__(self, regions=None, cooldown_seconds=None):
+        if regions is None:
+            regions = os.environ.get('BEDROCK_REGIONS', DEFAULT_REGIONS).split(',')
+        self.regions = [region.strip() for region in regions if region.strip()]
+        # 障害を検知したリージョンを後回しにする秒数
+        self.cooldown_seconds = float(
+            cooldown_seconds or os.environ.get('BEDROCK_REGION_COOLDOWN_SECONDS', 30)
+        )
+        # 2番目の候補を先に試す確率（遅かったリージョンの回復を検知するため）
+        self.explore_rate = float(os.environ.get('BEDROCK_REGION_EXPLORE_RATE', 0.05))
+
+        self._stats = {
+            region: {'latencyMs': None, 'errorRate': 0.0, 'cooldownUntil': 0.0, 'calls': 0}
+            for region in self.regions
+        }
+        self._lock = threading.Lock()
+
+    def ranked(self):
+        """呼び出し先の候補を優先順に返す"""
+        now = time.monotonic()
+        with self._lock:
+            ranked = sorted(
+                self.regions,
+                key=lambda region: (
+                    self._stats[region]['cooldownUntil'] > now,
+                    self._score(region),
+                    self.regions.index(region)
+                )
+            )
+            if (len(ranked) > 1 and self._stats[ranked[1]]['cooldownUntil'] <= now
+                    and random.random() < self.explore_rate):
+                ranked[0], ranked[1] = ranked[1], ranked[0]
+            return ranked
+
+    def record_success(self, region, latency_ms):
+        """呼び出しの成功とレイテンシを記録"""
+        with self._lock:
+            stats = self._stats[region]
+            stats['calls'] += 1
+            if stats['latencyMs'] is None:
+                stats['latencyMs'] = latency_ms
+            else:
+                stats['latencyMs'] += EWMA_ALPHA * (latency_ms - stats['latencyMs'])
+            stats['errorRate'] *= 1 - EWMA_ALPHA
+
+    def record_failure(self, region):
+        """スロットリング・5xx・接続エラー・読み取りタイムアウトを記録し、しばらく候補の後ろに回す"""
+        with self._lock:
+            stats = self._stats[region]
+            stats['calls'] += 1
+            stats['errorRate'] += EWMA_ALPHA * (1 - stats['errorRate'])
+            stats['cooldownUntil'] = time.monotonic() + self.cooldown_seconds
+
+    def snapshot(self):
+        """リージョンごとの統計（ベンチマーク・デバッグ用）"""
+        with self._lock:
+            return {region: dict(stats) for region, stats in self._stats.items()}
+
+    def _score(self, region):
+        stats = self._stats[region]
+        # 未計測のリージョンは0とみなし、一度は試す
+        latency = stats['latencyMs'] or 0.0
+        return latency * (1 + ERROR_PENALTY * stats['errorRate'])
+
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def shared_router():
+    """コンテナ内で共有するリージョンの選択"""
+    global _shared
+    if _shared is None:
+        with _shared_lock:
+            if _shared is None:
+                _shared = RegionRouter()
+    return _shared
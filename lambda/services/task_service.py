@@ -0,0 +1,31 @@
+import json
+import os
+
+from services.aws_clients import get_client
+
+
+class TaskService:
+    """ワーカーLambdaへのバックグラウンド処理の依頼"""
+
+    def __init__(self):
+        self.function_name = os.environ.get('WORKER_FUNCTION_NAME')
+        self._client = None
+
+    @property
+    def client(self):
+        # 一部のリクエストでしか使わないため初回利用時に生成する
+        if self._client is None:
+            self._client = get_client('lambda')
+        return self._client
+
+    def invoke_async(self, task, **payload):
+        """ワーカーLambdaを非同期（Event）で呼び出す"""
+        if not self.function_name:
+            print(f"WORKER_FUNCTION_NAME is not set, skipped task: {task}")
+            return
+
+        self.client.invoke(
+            FunctionName=self.function_name,
+            InvocationType='Event',
+            Payload=json.dumps({'task': task, **payload}).encode('utf-8')
+        )
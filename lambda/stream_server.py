@@ -0,0 +1,181 @@
+"""POST /chat/stream をLambdaレスポンスストリーミングで返すHTTPサーバー
+
+PythonのマネージドランタイムはLambdaのレスポンスストリーミングに対応していないため、
+Lambda Web Adapter（AWS_LWA_INVOKE_MODE=response_stream）の背後でこのサーバーを起動し、
+Bedrockの応答をSSEとして届いた分からクライアントへ送る（起動はrun.sh）。
+API GatewayのCognitoオーソライザーの結果はx-amzn-request-contextヘッダーで受け取る。
+"""
+import json
+import os
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from services import metrics
+from services.admission import BedrockThrottledError
+from services.aws_clients import should_prewarm
+from services.bedrock_service import BedrockService
+from services.chat_stream import open_chat_stream
+from services.chat_turn import ChatTurnService
+from services.dynamodb_service import DynamoDBService
+from services.history_cache import HistoryCache
+from services.task_service import TaskService
+
+
+# Lambda Web Adapterが転送するポート
+PORT = int(os.environ.get('AWS_LWA_PORT', 8080))
+# Lambda Web Adapterの起動確認に応答するパス
+READINESS_CHECK_PATH = os.environ.get('AWS_LWA_READINESS_CHECK_PATH', '/health')
+# Bedrockの再試行を打ち切る際に、応答の保存用としてLambdaのタイムアウトまで残しておく秒数
+BEDROCK_TIME_MARGIN_SECONDS = 3
+
+
+bedrock_service = BedrockService()
+dynamodb_service = DynamoDBService()
+# 1回分のチャットの手順（POST /chatのハンドラーと同じ）
+chat_turns = ChatTurnService(
+    dynamodb_service, HistoryCache(), TaskService(), ThreadPoolExecutor(max_workers=4)
+)
+
+# 初期化フェーズ（課金・レイテンシの影響が小さい）で接続を確立しておく
+if should_prewarm():
+    try:
+        dynamodb_service.prewarm()
+    except Exception as e:
+        print(f"Prewarm failed: {str(e)}")
+
+
+class ChatStreamHandler(BaseHTTPRequestHandler):
+    """POST /chat/stream のハンドラー"""
+
+    # チャンク形式で送り、Lambda Web Adapterとの接続を使い回す
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        if self.path == READINESS_CHECK_PATH:
+            self.send_json(200, {'status': 'ok'})
+            return
+        self.send_json(404, {'error': 'Not found'})
+
+    def do_POST(self):
+        if self.path.split('?')[0] != '/chat/stream':
+            self.send_json(404, {'error': 'Not found'})
+            return
+
+        metrics.start_request('POST /chat/stream')
+        lambda_context = self.header_json('x-amzn-lambda-context')
+        metrics.current().set_property('RequestId', lambda_context.get('request_id'))
+        # スロットリング時の再試行はLambdaのタイムアウトに余裕を残して打ち切る
+        bedrock_service.set_deadline(remaining_deadline(lambda_context))
+
+        try:
+            status_code = self.handle_chat_stream()
+        except Exception as e:
+            print(f"Error: {str(e)}")
+            traceback.print_exc()
+            status_code = self.send_json(500, {'error': 'Internal server error'})
+
+        # ヘッダーは送信済みのため、Server-Timingは付けずにEMFのみ出力する
+        metrics.current().set_property('StatusCode', status_code)
+        metrics.finish_request(None)
+
+    def handle_chat_stream(self):
+        """SSEを返し、送信したステータスコードを返す"""
+        request_context = self.header_json('x-amzn-request-context')
+        claims = (request_context.get('authorizer') or {}).get('claims') or {}
+        user_id = claims.get('sub')
+        if not user_id:
+            return self.send_json(401, {'error': 'Unauthorized'})
+
+        try:
+            body = json.loads(self.read_body() or b'{}')
+        except ValueError:
+            return self.send_json(400, {'error': 'Invalid JSON'})
+        if not body.get('message'):
+            return self.send_json(400, {'error': 'message is required'})
+
+        with metrics.span('prepare'):
+            turn = chat_turns.start(user_id, body.get('conversationId'), body['message'])
+        if turn is None:
+            return self.send_json(404, {'error': 'Conversation not found'})
+
+        try:
+            # 最初のトークンが届くまで待ち、それまでのスロットリングは429として返す
+            events = open_chat_stream(chat_turns, bedrock_service, user_id, turn)
+        except BedrockThrottledError as e:
+            print(f"Throttled: {str(e)}")
+            return self.send_json(429, {'error': 'Too many requests'}, headers={
+                'Retry-After': str(e.retry_after),
+                'Access-Control-Expose-Headers': 'Retry-After'
+            })
+
+        try:
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream; charset=utf-8')
+            self.send_header('Cache-Control', 'no-cache')
+            self.send_header('Access-Control-Allow-Origin', '*')
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            for event in events:
+                self.write_chunk(event.encode('utf-8'))
+            self.write_chunk(b'')
+        except (BrokenPipeError, ConnectionResetError) as e:
+            # クライアントが切断した: Bedrockのストリームを閉じて生成を止め、ターンを取り消す
+            print(f"Client disconnected: {str(e)}")
+            events.close()
+            chat_turns.discard(user_id, turn)
+            self.close_connection = True
+            metrics.current().add('ClientDisconnected', 1)
+        return 200
+
+    def header_json(self, name):
+        """JSONのヘッダー値（なければ空のdict）"""
+        try:
+            return json.loads(self.headers.get(name) or '{}')
+        except ValueError:
+            return {}
+
+    def read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else b''
+
+    def write_chunk(self, data):
+        """チャンク形式で1チャンク書き込む（空のdataは終端）"""
+        self.wfile.write(f'{len(data):x}\r\n'.encode('ascii') + data + b'\r\n')
+        self.wfile.flush()
+
+    def send_json(self, status_code, body, headers=None):
+        """JSONレスポンスを送り、ステータスコードを返す"""
+        data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        self.send_response(status_code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.send_header('Access-Control-Allow-Origin', '*')
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+        return status_code
+
+    def log_message(self, format, *args):
+        # アクセスログはEMFのメトリクスで足りるため出力しない
+        pass
+
+
+def remaining_deadline(lambda_context):
+    """Lambdaのタイムアウトの少し前の時刻（time.monotonic基準、不明ならNone）"""
+    deadline_ms = lambda_context.get('deadline')
+    if not deadline_ms:
+        return None
+    return time.monotonic() + deadline_ms / 1000 - time.time() - BEDROCK_TIME_MARGIN_SECONDS
+
+
+def main():
+    server = ThreadingHTTPServer(('127.0.0.1', PORT), ChatStreamHandler)
+    print(f"Listening on {PORT}")
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
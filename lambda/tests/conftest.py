@@ -0,0 +1,10 @@
+import os
+import sys
+
+
+# テストはlambda/をカレントにしたLambdaと同じ import パス（services.xxx）で読み込む
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+# カーソルの署名鍵はモジュールの読み込み時に取得するため、テスト用の鍵を先に設定する
+os.environ.pop('CURSOR_SECRET_ARN', None)
+os.environ.setdefault('CURSOR_SECRET', 'test-cursor-secret')
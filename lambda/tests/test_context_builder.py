@@ -0,0 +1,70 @@
+from services.context_builder import (
+    build_context, estimate_tokens, message_tokens, MESSAGE_OVERHEAD_TOKENS
+)
+
+
+def message(role, content, **fields):
+    return {'role': role, 'content': content, **fields}
+
+
+def conversation(turns, content='x' * 40):
+    history = []
+    for i in range(turns):
+        history.append(message('user', f'{content}{i}'))
+        history.append(message('assistant', f'{content}{i}'))
+    return history
+
+
+def test_estimate_tokens():
+    assert estimate_tokens('') == 0
+    assert estimate_tokens('abcd') == 1
+    assert estimate_tokens('abcde') == 2
+    assert estimate_tokens('こんにちは') == 5
+
+
+def test_message_tokens_prefers_recorded_count():
+    assert message_tokens(message('assistant', 'x' * 400, tokenCount=7)) == 7 + MESSAGE_OVERHEAD_TOKENS
+    assert message_tokens(message('user', 'x' * 400)) == 100 + MESSAGE_OVERHEAD_TOKENS
+
+
+def test_whole_history_within_budget():
+    history = conversation(3) + [message('user', 'latest')]
+    assert build_context(history, token_budget=10000) == history
+
+
+def test_oldest_messages_are_dropped_first():
+    history = conversation(10) + [message('user', 'latest')]
+    selected = build_context(history, token_budget=100)
+
+    assert selected == history[-len(selected):]
+    assert len(selected) < len(history)
+    assert sum(message_tokens(msg) for msg in selected) <= 100
+
+
+def test_result_starts_with_user_and_alternates():
+    history = conversation(10) + [message('user', 'latest')]
+    for budget in range(20, 300, 7):
+        selected = build_context(history, token_budget=budget)
+        roles = [msg['role'] for msg in selected]
+        assert roles[0] == 'user'
+        assert roles[-1] == 'user'
+        assert all(a != b for a, b in zip(roles, roles[1:]))
+
+
+def test_latest_user_message_kept_over_budget():
+    latest = message('user', 'x' * 4000)
+    assert build_context(conversation(2) + [latest], token_budget=10) == [latest]
+
+
+def test_consecutive_same_roles_keep_newer():
+    # 応答の保存に失敗してユーザーメッセージが連続した場合
+    history = [
+        message('user', 'q1'), message('assistant', 'a1'),
+        message('user', 'q2 (unanswered)'), message('user', 'q3'),
+    ]
+    selected = build_context(history, token_budget=10000)
+    assert [msg['content'] for msg in selected] == ['q1', 'a1', 'q3']
+
+
+def test_empty_history():
+    assert build_context([], token_budget=100) == []
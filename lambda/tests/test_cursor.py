@@ -0,0 +1,65 @@
+from decimal import Decimal
+
+import pytest
+
+from services.cursor import encode_cursor, decode_cursor, InvalidCursorError
+
+
+SCOPE = 'messages:user-1:conv-1:desc'
+
+
+def test_round_trip():
+    cursor = encode_cursor(['conv-1', Decimal('1700000000123456'), Decimal('1.5')], SCOPE)
+    assert decode_cursor(cursor, SCOPE) == ['conv-1', 1700000000123456, Decimal('1.5')]
+
+
+def test_cursor_is_url_safe():
+    cursor = encode_cursor(['会話/?&=' * 10], SCOPE)
+    assert all(c.isalnum() or c in '-_.' for c in cursor)
+
+
+def test_tampered_signature_is_rejected():
+    payload, signature = encode_cursor([1], SCOPE).split('.')
+    tampered = signature[:-1] + ('A' if signature[-1] != 'A' else 'B')
+    with pytest.raises(InvalidCursorError):
+        decode_cursor(f"{payload}.{tampered}", SCOPE)
+
+
+def test_tampered_payload_is_rejected():
+    signature = encode_cursor([1], SCOPE).split('.')[1]
+    payload = encode_cursor([2], SCOPE).split('.')[0]
+    with pytest.raises(InvalidCursorError):
+        decode_cursor(f"{payload}.{signature}", SCOPE)
+
+
+@pytest.mark.parametrize('truncate', [
+    lambda cursor: cursor[:-4],
+    lambda cursor: cursor.split('.')[0],
+    lambda cursor: cursor[:3],
+    lambda cursor: '',
+])
+def test_truncated_cursor_is_rejected(truncate):
+    with pytest.raises(InvalidCursorError):
+        decode_cursor(truncate(encode_cursor(['conv-1', 123], SCOPE)), SCOPE)
+
+
+def test_extra_separator_is_rejected():
+    with pytest.raises(InvalidCursorError):
+        decode_cursor(encode_cursor([1], SCOPE) + '.x', SCOPE)
+
+
+def test_other_users_scope_is_rejected():
+    cursor = encode_cursor([123], 'messages:user-1:conv-1:desc')
+    with pytest.raises(InvalidCursorError):
+        decode_cursor(cursor, 'messages:user-2:conv-1:desc')
+
+
+def test_other_direction_scope_is_rejected():
+    cursor = encode_cursor([123], 'messages:user-1:conv-1:desc')
+    with pytest.raises(InvalidCursorError):
+        decode_cursor(cursor, 'messages:user-1:conv-1:asc')
+
+
+def test_invalid_cursor_error_is_value_error():
+    # ハンドラーはValueErrorとまとめて400にしている
+    assert issubclass(InvalidCursorError, ValueError)
@@ -0,0 +1,106 @@
+import os
+
+import pytest
+from boto3.dynamodb.types import Binary
+
+from services.message_codec import (
+    MessageCodec, CONTENT_BINARY_ATTRIBUTE, CONTENT_REF_ATTRIBUTE, CODEC_ATTRIBUTE
+)
+
+
+@pytest.fixture
+def codec_env(monkeypatch, tmp_path):
+    """ローカルのオブジェクトストアと小さい閾値でコーデックを作る"""
+    monkeypatch.delenv('OBJECT_STORE_BUCKET', raising=False)
+    monkeypatch.setenv('OBJECT_STORE_DIR', str(tmp_path))
+    monkeypatch.setenv('MESSAGE_COMPRESSION_MIN_BYTES', '64')
+    monkeypatch.setenv('MESSAGE_SPILL_BYTES', '2048')
+
+    def make(compression='off'):
+        monkeypatch.setenv('MESSAGE_COMPRESSION', compression)
+        return MessageCodec()
+    return make
+
+
+def item(content, timestamp=1700000000000001, message_id='m1'):
+    return {
+        'conversationId': 'conv-1',
+        'timestamp': timestamp,
+        'messageId': message_id,
+        'role': 'user',
+        'content': content,
+    }
+
+
+def test_short_content_is_stored_inline(codec_env):
+    codec = codec_env('zlib')
+    original = item('こんにちは')
+    assert codec.encode(original) is original
+    assert codec.decode(original) is original
+
+
+def test_compression_off_keeps_plain_text(codec_env):
+    codec = codec_env('off')
+    original = item('x' * 1000)
+    assert codec.encode(original) is original
+
+
+def test_compressed_round_trip(codec_env):
+    codec = codec_env('zlib')
+    original = item('繰り返しの多い本文。' * 50)
+
+    encoded = codec.encode(original)
+    assert 'content' not in encoded
+    assert encoded[CODEC_ATTRIBUTE] == 'zlib'
+    assert len(encoded[CONTENT_BINARY_ATTRIBUTE]) < len(original['content'].encode('utf-8'))
+
+    # boto3のresourceはBinary型で返す
+    stored = {**encoded, CONTENT_BINARY_ATTRIBUTE: Binary(encoded[CONTENT_BINARY_ATTRIBUTE])}
+    assert codec.decode(stored) == original
+
+
+@pytest.mark.parametrize('compression', ['off', 'zlib'])
+def test_spilled_round_trip(codec_env, tmp_path, compression):
+    codec = codec_env(compression)
+    original = item(os.urandom(2048).hex())
+
+    encoded = codec.encode(original)
+    assert 'content' not in encoded
+    assert encoded[CONTENT_REF_ATTRIBUTE].startswith('conv-1/')
+    assert (tmp_path / encoded[CONTENT_REF_ATTRIBUTE]).is_file()
+    assert codec.decode(encoded) == original
+
+
+def test_spilled_keys_do_not_collide_for_the_same_timestamp(codec_env):
+    codec = codec_env('off')
+    first = item('a' * 4096, message_id='m1')
+    second = item('b' * 4096, message_id='m2')
+
+    encoded_first = codec.encode(first)
+    encoded_second = codec.encode(second)
+    assert encoded_first[CONTENT_REF_ATTRIBUTE] != encoded_second[CONTENT_REF_ATTRIBUTE]
+    assert codec.decode(encoded_first) == first
+    assert codec.decode(encoded_second) == second
+
+
+def test_delete_spilled(codec_env, tmp_path):
+    codec = codec_env('off')
+    codec.encode(item('a' * 4096))
+    assert (tmp_path / 'conv-1').is_dir()
+
+    codec.delete_spilled('conv-1')
+    assert not (tmp_path / 'conv-1').exists()
+
+
+def test_spill_disabled_without_object_store(codec_env, monkeypatch):
+    monkeypatch.delenv('OBJECT_STORE_DIR')
+    codec = codec_env('off')
+    original = item('a' * 4096)
+    assert codec.encode(original) is original
+
+
+def test_items_without_content_pass_through(codec_env):
+    codec = codec_env('zlib')
+    header = {'conversationId': 'conv-1', 'timestamp': 0, 'userId': 'user-1'}
+    assert codec.encode(header) is header
+    assert codec.decode(header) is header
@@ -0,0 +1,55 @@
+import threading
+
+from services import message_key
+from services.message_key import (
+    MessageKeyGenerator, key_to_epoch_seconds, new_message_key, HIGH_RESOLUTION_THRESHOLD
+)
+
+
+def test_keys_increase_within_a_process():
+    keys = [new_message_key() for _ in range(5000)]
+    assert keys == sorted(keys)
+    assert len(set(keys)) == len(keys)
+
+
+def test_keys_increase_when_clock_goes_back(monkeypatch):
+    generator = MessageKeyGenerator()
+    clock = iter([1700000001.0, 1700000000.0, 1699999999.0])
+    monkeypatch.setattr(message_key.time, 'time', lambda: next(clock))
+
+    first, second, third = generator.next(), generator.next(), generator.next()
+    assert first < second < third
+
+
+def test_keys_are_unique_across_threads():
+    generator = MessageKeyGenerator()
+    keys = []
+    lock = threading.Lock()
+
+    def issue():
+        issued = [generator.next() for _ in range(500)]
+        with lock:
+            keys.extend(issued)
+
+    threads = [threading.Thread(target=issue) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(set(keys)) == len(keys)
+
+
+def test_high_resolution_keys_sort_after_legacy_keys():
+    legacy_key = 4102444800  # 2100-01-01（秒単位の旧形式）
+    assert new_message_key() > legacy_key
+    assert new_message_key() >= HIGH_RESOLUTION_THRESHOLD
+
+
+def test_key_to_epoch_seconds():
+    assert key_to_epoch_seconds(1700000000123 * 1000 + 456) == 1700000000
+    # 移行前の秒単位のキーはそのまま
+    assert key_to_epoch_seconds(1700000000) == 1700000000
+
+
+def test_key_fits_in_javascript_number():
+    assert new_message_key() < 2 ** 53
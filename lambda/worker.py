@@ -0,0 +1,146 @@
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from services.admission import BedrockThrottledError
+from services.bedrock_service import BedrockService
+from services.dynamodb_service import DynamoDBService
+from services.history_cache import HistoryCache
+from services.task_service import TaskService
+# 非同期ジョブはPOST /chatと同じ手順（履歴の組み立て・保存・キャッシュ・要約依頼）で処理する
+from services.chat_turn import ChatTurnService, summary_needed, RECENT_MESSAGE_LIMIT
+
+
+# 非同期ジョブの出力トークン数の上限（同期のPOST /chatより長い応答を許容する）
+JOB_MAX_TOKENS = int(os.environ.get('JOB_MAX_TOKENS', 8192))
+# 実行中のまま止まったジョブを再実行できるとみなすまでの秒数（ワーカーのタイムアウト以上）
+JOB_STALE_SECONDS = int(os.environ.get('JOB_STALE_SECONDS', 360))
+
+
+bedrock_service = BedrockService()
+dynamodb_service = DynamoDBService()
+# 要約の更新はジョブの結果を保存した後にこの場で行うため、task_serviceからは依頼しない
+chat_turns = ChatTurnService(
+    dynamodb_service, HistoryCache(), TaskService(), ThreadPoolExecutor(max_workers=4)
+)
+
+
+def lambda_handler(event, context):
+    """バックグラウンド処理のハンドラー"""
+    # スロットリング時の再試行はLambdaのタイムアウトに余裕を残して打ち切る
+    if context is not None:
+        bedrock_service.set_deadline(
+            time.monotonic() + context.get_remaining_time_in_millis() / 1000 - 10
+        )
+
+    # SQSイベントソースからの配信（非同期生成ジョブ）
+    if 'Records' in event:
+        return [
+            handle_chat_job(json.loads(record['body'])['jobId'])
+            for record in event['Records']
+        ]
+
+    task = event.get('task')
+
+    if task == 'summarize':
+        return handle_summarize(event['userId'], event['conversationId'])
+
+    if task == 'delete_messages':
+        return handle_delete_messages(event['conversationId'], context)
+
+    print(f"Unknown task: {task}")
+    return {'status': 'ignored'}
+
+
+def handle_summarize(user_id, conversation_id):
+    """直近分を除く未要約メッセージを会話の要約に畳み込む"""
+    conv = dynamodb_service.get_conversation(user_id, conversation_id)
+    if conv is None:
+        return {'status': 'not_found'}
+
+    previous_until = conv.get('summaryUntil')
+    messages = dynamodb_service.get_messages_after(conversation_id, after=previous_until)
+
+    # 直近のメッセージはプロンプトにそのまま含めるため要約しない
+    targets = messages[:-RECENT_MESSAGE_LIMIT]
+    # 要約の境界がassistantの応答で終わるようにする（次の履歴をuserから始めるため）
+    while targets and targets[-1]['role'] != 'assistant':
+        targets.pop()
+    if not targets:
+        return {'status': 'skipped'}
+
+    summary = bedrock_service.summarize(conv.get('summary'), targets)
+
+    updated = dynamodb_service.update_summary(
+        user_id,
+        conversation_id,
+        summary=summary,
+        summary_until=targets[-1]['timestamp'],
+        summarized_count=int(conv.get('summarizedCount', 0)) + len(targets),
+        previous_until=previous_until
+    )
+
+    return {'status': 'updated' if updated else 'conflict', 'summarized': len(targets)}
+
+
+def handle_delete_messages(conversation_id, context=None):
+    """会話のメッセージを全件削除"""
+    deadline = None
+    if context is not None:
+        deadline = time.monotonic() + context.get_remaining_time_in_millis() / 1000 - 10
+
+    deleted, completed = dynamodb_service.delete_messages(conversation_id, deadline=deadline)
+    print(f"Deleted {deleted} messages of {conversation_id} (completed={completed})")
+
+    # 時間内に終わらなかった場合は例外にして非同期呼び出しの再試行で続きを削除する
+    if not completed:
+        raise RuntimeError(f"Message deletion of {conversation_id} did not complete in time")
+
+    return {'status': 'deleted', 'deleted': deleted}
+
+
+def handle_chat_job(job_id):
+    """非同期生成ジョブを実行して結果をジョブに保存"""
+    now = int(time.time())
+    job = dynamodb_service.claim_job(job_id, now, stale_before=now - JOB_STALE_SECONDS)
+    if job is None:
+        # 他のワーカーが実行中か、完了済みのジョブの再配信
+        return {'status': 'skipped', 'jobId': job_id}
+
+    user_id = job['userId']
+    turn = None
+    try:
+        turn = chat_turns.start(user_id, job.get('conversationId'), job['message'])
+        if turn is None:
+            dynamodb_service.finish_job(job_id, int(time.time()), error='Conversation not found')
+            return {'status': 'failed', 'jobId': job_id}
+
+        result = bedrock_service.converse_with_history(
+            turn['history'], summary=turn['summary'], max_tokens=JOB_MAX_TOKENS
+        )
+        ai_timestamp = chat_turns.finish(
+            user_id, turn, result['text'], result['usage'], request_summary=False
+        )
+    except BedrockThrottledError as e:
+        print(f"Chat job {job_id} throttled: {str(e)}")
+        chat_turns.discard(user_id, turn)
+        dynamodb_service.finish_job(job_id, int(time.time()), error='Too many requests')
+        return {'status': 'failed', 'jobId': job_id}
+    except Exception as e:
+        print(f"Chat job {job_id} failed: {str(e)}")
+        chat_turns.discard(user_id, turn)
+        dynamodb_service.finish_job(job_id, int(time.time()), error='Internal server error')
+        return {'status': 'failed', 'jobId': job_id}
+
+    dynamodb_service.finish_job(
+        job_id, int(time.time()),
+        conversation_id=turn['conversationId'],
+        result={'response': result['text'], 'timestamp': ai_timestamp}
+    )
+
+    # ワーカー自身は呼び出せないため、要約の更新は結果を保存した後にこの場で行う
+    if summary_needed(turn['messageCount'] + 2, turn['summarizedCount']):
+        handle_summarize(user_id, turn['conversationId'])
+
+    return {'status': 'succeeded', 'jobId': job_id}
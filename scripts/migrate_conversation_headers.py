@@ -0,0 +1,117 @@
+"""会話ヘッダーの移行ツール
+
+CONVERSATION_HEADERS=on にする前に作成された会話について、Conversationsテーブルから
+会話ヘッダー（所有者・タイトル・作成日時）を組み立ててMessagesテーブルに書き込む。
+会話ヘッダーは作成後に変わらない属性だけを持つため、何度実行しても結果は同じになる。
+
+--prune-orphansを指定すると、Messagesテーブルを走査して会話が削除済みのヘッダーも消す
+（CONVERSATION_HEADERS=offの間に削除された会話のヘッダーが残っている場合に使う。
+Messagesテーブル全体を読むため、読み込み容量を消費する点に注意）。
+
+使い方:
+    python scripts/migrate_conversation_headers.py \
+        --conversations-table <ConversationsTableName> --messages-table <MessagesTableName>
+    # 書き込まずに件数だけ確認する場合
+    python scripts/migrate_conversation_headers.py ... --dry-run
+"""
+import argparse
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+
+ROOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+LAMBDA_DIR = os.path.join(ROOT_DIR, 'lambda')
+
+
+def scan_segment(table, segment, total_segments, **kwargs):
+    """並列スキャンの1セグメント分のアイテムを順に返す"""
+    kwargs.update({'Segment': segment, 'TotalSegments': total_segments})
+    while True:
+        response = table.scan(**kwargs)
+        yield from response['Items']
+        if 'LastEvaluatedKey' not in response:
+            return
+        kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def backfill_segment(dynamodb_service, segment, total_segments, dry_run):
+    """1セグメント分の会話のヘッダーを書き込み、件数を返す"""
+    from services.dynamodb_service import CONVERSATION_HEADER_ATTRIBUTES
+
+    attributes = ('conversationId', *CONVERSATION_HEADER_ATTRIBUTES)
+    conversations = scan_segment(
+        dynamodb_service.conversations_table, segment, total_segments,
+        ProjectionExpression=', '.join(f'#a{i}' for i in range(len(attributes))),
+        ExpressionAttributeNames={f'#a{i}': attr for i, attr in enumerate(attributes)}
+    )
+    headers = [dynamodb_service.build_conversation_header(item) for item in conversations]
+    if headers and not dry_run:
+        dynamodb_service.batch_put(message_items=headers)
+    return len(headers)
+
+
+def prune_segment(dynamodb_service, segment, total_segments, dry_run):
+    """1セグメント分のヘッダーのうち、会話が削除済みのものを消し、件数を返す"""
+    from services.dynamodb_service import CONVERSATION_HEADER_KEY
+
+    headers = scan_segment(
+        dynamodb_service.messages_table, segment, total_segments,
+        FilterExpression='#ts = :header',
+        ProjectionExpression='conversationId, userId',
+        ExpressionAttributeNames={'#ts': 'timestamp'},
+        ExpressionAttributeValues={':header': CONVERSATION_HEADER_KEY}
+    )
+    pruned = 0
+    for header in headers:
+        if dynamodb_service.get_conversation(header['userId'], header['conversationId']) is not None:
+            continue
+        pruned += 1
+        if not dry_run:
+            dynamodb_service.delete_message(header['conversationId'], CONVERSATION_HEADER_KEY)
+    return pruned
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--conversations-table', default=os.environ.get('CONVERSATIONS_TABLE_NAME'),
+                        help='Conversationsテーブル名（既定: CONVERSATIONS_TABLE_NAME）')
+    parser.add_argument('--messages-table', default=os.environ.get('MESSAGES_TABLE_NAME'),
+                        help='Messagesテーブル名（既定: MESSAGES_TABLE_NAME）')
+    parser.add_argument('--region', default=os.environ.get('AWS_DEFAULT_REGION', 'us-east-1'))
+    parser.add_argument('--segments', type=int, default=4, help='並列スキャンのセグメント数')
+    parser.add_argument('--prune-orphans', action='store_true',
+                        help='会話が削除済みのヘッダーを消す（Messagesテーブルを全件走査する）')
+    parser.add_argument('--dry-run', action='store_true', help='書き込まずに件数だけ出力する')
+    args = parser.parse_args()
+    if not args.conversations_table or not args.messages_table:
+        parser.error('--conversations-table と --messages-table を指定してください')
+
+    os.environ.update({
+        'AWS_DEFAULT_REGION': args.region,
+        'CONVERSATIONS_TABLE_NAME': args.conversations_table,
+        'MESSAGES_TABLE_NAME': args.messages_table,
+    })
+    sys.path.insert(0, LAMBDA_DIR)
+    from services.dynamodb_service import DynamoDBService
+
+    dynamodb_service = DynamoDBService()
+    # ヘッダーはbatch_putのmessage_itemsとして明示的に渡すため、会話からの自動生成は使わない
+    dynamodb_service.conversation_headers = False
+
+    def run(task):
+        with ThreadPoolExecutor(max_workers=args.segments) as executor:
+            return sum(executor.map(
+                lambda segment: task(dynamodb_service, segment, args.segments, args.dry_run),
+                range(args.segments)
+            ))
+
+    action = '書き込み対象' if args.dry_run else '書き込み'
+    print(f"会話ヘッダーの{action}: {run(backfill_segment)}件")
+    if args.prune_orphans:
+        action = '削除対象' if args.dry_run else '削除'
+        print(f"削除済みの会話のヘッダーの{action}: {run(prune_segment)}件")
+
+
+if __name__ == '__main__':
+    main()